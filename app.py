@@ -4,47 +4,122 @@ Aquarium Tracker Application
 A Flask-based web app for tracking aquarium maintenance and parameters
 """
 
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, g, render_template, request, jsonify, make_response
 from flask_cors import CORS
 import sqlite3
+import hashlib
 import json
-from datetime import datetime, timedelta
+import os
 from pathlib import Path
 
-app = Flask(__name__)
-CORS(app)
+import assets
+import changelog
+import clock
+import compression
+import housekeeping
+import idempotency
+import metrics
+import profiling
+import ratelimit
+import replication
+import repository
+import validation
+from streaming import response_format, select_columns, stream_rows
 
 # Database setup
-DB_PATH = Path(__file__).parent / 'aquarium.db'
+DB_PATH = Path(os.environ.get('WATERSCRIBE_DB', Path(__file__).parent / 'aquarium.db'))
+# 'memory' keeps all data in this process instead (tests, benchmarks)
+STORAGE = os.environ.get('WATERSCRIBE_STORAGE', 'sqlite')
+REPOSITORY = repository.MemoryRepository() if STORAGE == 'memory' else None
 
-def init_db():
+# Request bodies accepted by each write, checked and converted before the
+# handler runs (see validation.py)
+READING_VALUE = {'type': 'number', 'min': 0}
+SCHEMAS = {
+    ('parameters', 'POST'): {
+        'temperature': {'type': 'number'},
+        'ph': {'type': 'number', 'min': 0, 'max': 14},
+        'ammonia': READING_VALUE,
+        'nitrite': READING_VALUE,
+        'nitrate': READING_VALUE,
+        'notes': {'type': 'text'},
+    },
+    ('maintenance', 'POST'): {
+        'task_type': {'type': 'text', 'required': True},
+        'description': {'type': 'text'},
+        'completed': {'type': 'boolean', 'default': True},
+    },
+    ('scheduled', 'POST'): {
+        'task_name': {'type': 'text', 'required': True},
+        'is_recurring': {'type': 'boolean', 'default': True},
+        'frequency_days': {'type': 'integer', 'min': 1, 'required': lambda body: body['is_recurring']},
+        'specific_date': {'type': 'timestamp', 'required': lambda body: body['is_recurring'] is False},
+        'description': {'type': 'text'},
+    },
+    ('scheduled', 'PUT'): {
+        'id': {'type': 'integer', 'required': True},
+        'task_name': {'type': 'text', 'default': 'Scheduled Task'},
+    },
+    ('fish', 'POST'): {
+        'species': {'type': 'text', 'required': True},
+        'common_name': {'type': 'text'},
+        'quantity': {'type': 'integer', 'min': 0, 'default': 1},
+        'notes': {'type': 'text'},
+    },
+}
+
+app = Flask(__name__)
+CORS(app)
+# Registered first so it runs after every other after_request hook
+compression.init_app(app)
+profiling.init_app(app)
+metrics.init_app(app, DB_PATH)
+if STORAGE == 'sqlite':
+    housekeeping.init_app(app, DB_PATH)
+    # A standby refuses writes before anything else looks at them
+    replication.init_app(app, DB_PATH)
+assets.init_app(app)
+# Before idempotency, so throttled retries never reach the database
+ratelimit.init_app(app, DB_PATH)
+# Bad input is turned away before anything opens a connection
+validation.init_app(app, SCHEMAS)
+# /api/sync takes a key per queued request instead of the header
+idempotency.init_app(app, lambda: repo(), exclude={'sync'})
+
+def init_db(db_path=None):
     """Initialize the database with required tables"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = sqlite3.connect(db_path or DB_PATH)
     c = conn.cursor()
     
+    # Free pages are reclaimed by the housekeeping job; only takes effect
+    # before the first table is created (existing files: migrate-strict.py)
+    c.execute('PRAGMA auto_vacuum = INCREMENTAL')
+    # Readers (read-only connections) never wait for the writer thread
+    c.execute('PRAGMA journal_mode = WAL')
+    
     # Water parameters table
     c.execute('''
         CREATE TABLE IF NOT EXISTS water_parameters (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            timestamp INTEGER NOT NULL DEFAULT (CAST((julianday('now') - 2440587.5) * 86400000 AS INTEGER)),
             temperature REAL,
             ph REAL,
             ammonia REAL,
             nitrite REAL,
             nitrate REAL,
             notes TEXT
-        )
+        ) STRICT
     ''')
     
     # Maintenance log table
     c.execute('''
         CREATE TABLE IF NOT EXISTS maintenance_log (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            timestamp INTEGER NOT NULL DEFAULT (CAST((julianday('now') - 2440587.5) * 86400000 AS INTEGER)),
             task_type TEXT NOT NULL,
             description TEXT,
-            completed BOOLEAN DEFAULT 1
-        )
+            completed INTEGER DEFAULT 1
+        ) STRICT
     ''')
     
     # Scheduled tasks table
@@ -53,13 +128,13 @@ def init_db():
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             task_name TEXT NOT NULL,
             frequency_days INTEGER,
-            last_completed DATETIME,
-            next_due DATETIME,
+            last_completed INTEGER,
+            next_due INTEGER,
             description TEXT,
-            active BOOLEAN DEFAULT 1,
-            is_recurring BOOLEAN DEFAULT 1,
-            specific_date DATETIME
-        )
+            active INTEGER DEFAULT 1,
+            is_recurring INTEGER DEFAULT 1,
+            specific_date INTEGER
+        ) STRICT
     ''')
     
     # Fish inventory table
@@ -69,301 +144,524 @@ def init_db():
             species TEXT NOT NULL,
             common_name TEXT,
             quantity INTEGER DEFAULT 1,
-            added_date DATETIME DEFAULT CURRENT_TIMESTAMP,
+            added_date INTEGER NOT NULL DEFAULT (CAST((julianday('now') - 2440587.5) * 86400000 AS INTEGER)),
             notes TEXT
-        )
+        ) STRICT
     ''')
     
+    # Daily summaries of readings moved to the archive (see retention.py)
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS water_parameters_daily (
+            day INTEGER PRIMARY KEY,
+            readings INTEGER NOT NULL,
+            temperature_min REAL,
+            temperature_avg REAL,
+            temperature_max REAL,
+            ph_min REAL,
+            ph_avg REAL,
+            ph_max REAL,
+            ammonia_min REAL,
+            ammonia_avg REAL,
+            ammonia_max REAL,
+            nitrite_min REAL,
+            nitrite_avg REAL,
+            nitrite_max REAL,
+            nitrate_min REAL,
+            nitrate_avg REAL,
+            nitrate_max REAL
+        ) STRICT
+    ''')
+    
+    # One row per completion of a scheduled task; on_time means it was
+    # done by the end of the (display-zone) day it was due, NULL when there
+    # was no due date to go by (such rows are left out of task_stats)
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS task_completions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            task_id INTEGER NOT NULL,
+            due_at INTEGER,
+            completed_at INTEGER NOT NULL,
+            on_time INTEGER
+        ) STRICT
+    ''')
+    
+    # Running adherence totals per task, kept by the triggers below so a
+    # standby applying the change log keeps them too
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS task_stats (
+            task_id INTEGER PRIMARY KEY,
+            completions INTEGER NOT NULL,
+            on_time INTEGER NOT NULL,
+            late_ms INTEGER NOT NULL,
+            streak INTEGER NOT NULL,
+            best_streak INTEGER NOT NULL
+        ) STRICT
+    ''')
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS task_completions_stats AFTER INSERT ON task_completions
+        WHEN NEW.on_time IS NOT NULL
+        BEGIN
+            INSERT INTO task_stats (task_id, completions, on_time, late_ms, streak, best_streak)
+            VALUES (NEW.task_id, 1, NEW.on_time, IIF(NEW.on_time, 0, NEW.completed_at - NEW.due_at),
+                    NEW.on_time, NEW.on_time)
+            ON CONFLICT (task_id) DO UPDATE SET
+                completions = completions + 1,
+                on_time = on_time + excluded.on_time,
+                late_ms = late_ms + excluded.late_ms,
+                streak = IIF(excluded.on_time, streak + 1, 0),
+                best_streak = MAX(best_streak, IIF(excluded.on_time, streak + 1, 0));
+        END
+    ''')
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS scheduled_tasks_history_delete AFTER DELETE ON scheduled_tasks
+        BEGIN
+            DELETE FROM task_completions WHERE task_id = OLD.id;
+            DELETE FROM task_stats WHERE task_id = OLD.id;
+        END
+    ''')
+    
+    # Responses to replayed offline writes, by client idempotency key
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS idempotency_keys (
+            key TEXT PRIMARY KEY,
+            method TEXT NOT NULL,
+            path TEXT NOT NULL,
+            status INTEGER,
+            response TEXT,
+            created INTEGER NOT NULL
+        ) STRICT
+    ''')
+    
+    # Indexes for the time-ordered list and range queries
+    c.execute('CREATE INDEX IF NOT EXISTS idx_water_parameters_timestamp ON water_parameters (timestamp)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_maintenance_log_timestamp ON maintenance_log (timestamp)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_scheduled_tasks_active_next_due ON scheduled_tasks (active, next_due)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_fish_inventory_added_date ON fish_inventory (added_date)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_task_completions_task ON task_completions (task_id, completed_at)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_idempotency_keys_created ON idempotency_keys (created)')
+    
+    # Change log for delta sync (/api/changes)
+    changelog.install(c)
+    
     conn.commit()
     conn.close()
 
-def get_db():
-    """Get database connection with proper timeout"""
-    conn = sqlite3.connect(DB_PATH, timeout=10.0)
-    conn.row_factory = sqlite3.Row
-    return conn
+def repo():
+    """Storage for this request: in memory when configured, else SQLite at DB_PATH
+
+    Inside /api/batch, the repository bound to the batch's connection.
+    """
+    bound = g.get('_repository')
+    if bound is not None:
+        return bound
+    return REPOSITORY if REPOSITORY is not None else repository.sqlite(DB_PATH)
+
+# Epoch-millisecond columns, rendered as ISO 8601 strings in responses
+TIME_COLUMNS = {
+    'water_parameters': ('timestamp',),
+    'maintenance_log': ('timestamp',),
+    'scheduled_tasks': ('last_completed', 'next_due', 'specific_date'),
+    'fish_inventory': ('added_date',),
+    'task_completions': ('due_at', 'completed_at'),
+    'water_parameters_daily': ('day',),
+}
+
+def row_to_dict(row, table):
+    """Convert a row to a dict with its time columns as ISO strings"""
+    result = dict(row)
+    for column in TIME_COLUMNS[table]:
+        if isinstance(result.get(column), int):
+            result[column] = clock.iso(result[column])
+    return result
+
+def time_range(args, keys=('since', 'until')):
+    """Epoch ms (since, until) from ?since= / ?until=; None when not given"""
+    try:
+        return tuple(clock.parse(args[key]) if args.get(key) else None for key in keys)
+    except ValueError:
+        raise ValueError(f'{keys[0]}/{keys[1]} must be ISO 8601 timestamps') from None
+
+def due_range(args, now):
+    """next_due (since, until) from ?due_since= / ?due_until= and ?status="""
+    since, until = time_range(args, ('due_since', 'due_until'))
+    status = args.get('status')
+    if status:
+        buckets = repository.task_buckets(now)
+        if status not in buckets:
+            raise ValueError(f"status must be one of: {', '.join(buckets)}")
+        low, high = buckets[status]
+        if low is not None:
+            since = low if since is None else max(since, low)
+        if high is not None:
+            until = high if until is None else min(until, high)
+    return since, until
+
+def stream_list(table, query):
+    """Stream the rows from query(columns), honouring ?fields= and ?format="""
+    try:
+        columns = select_columns(request.args.get('fields'), repository.COLUMNS[table])
+        fmt = response_format(request.args.get('format'))
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    converters = {column: clock.iso for column in TIME_COLUMNS[table]}
+    return stream_rows(query(columns), fmt, converters)
+
+def render_shell():
+    """Render the page shell once; it only changes when the app is deployed"""
+    with app.app_context():
+        html = render_template('index.html').encode()
+    return html, hashlib.sha256(html).hexdigest()[:16]
+
+INDEX_HTML, INDEX_ETAG = render_shell()
+
+def render_service_worker():
+    """Render the service worker once; its version follows the page shell"""
+    with app.app_context():
+        return render_template('sw.js', version=INDEX_ETAG, asset_urls=assets.asset_urls()).encode()
+
+SERVICE_WORKER_JS = render_service_worker()
+SERVICE_WORKER_ETAG = hashlib.sha256(SERVICE_WORKER_JS).hexdigest()[:16]
 
 # Routes
 @app.route('/')
 def index():
     """Serve the main application page"""
-    return render_template('index.html')
+    response = make_response(INDEX_HTML)
+    response.set_etag(INDEX_ETAG)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
+@app.route('/sw.js')
+def service_worker():
+    """Serve the service worker from the site root so it controls every page"""
+    response = make_response(SERVICE_WORKER_JS)
+    response.mimetype = 'text/javascript'
+    response.set_etag(SERVICE_WORKER_ETAG)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
 
 @app.route('/api/parameters', methods=['GET', 'POST', 'DELETE'])
 def parameters():
     """Handle water parameter data"""
-    conn = get_db()
+    if request.method == 'GET':
+        # GET: stream recent parameters, reaching into the archive as needed;
+        # ?before_id= continues from the last row of the previous page
+        limit = request.args.get('limit', 50, type=int)
+        try:
+            since, until = time_range(request.args)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        before_id = request.args.get('before_id', type=int)
+        return stream_list('water_parameters',
+                           lambda columns: repo().parameters(columns, since, until, before_id, limit))
     
-    try:
-        if request.method == 'POST':
-            data = request.json
-            c = conn.cursor()
-            # Use local time explicitly
-            local_timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            c.execute('''
-                INSERT INTO water_parameters (timestamp, temperature, ph, ammonia, nitrite, nitrate, notes)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                local_timestamp,
-                data.get('temperature'),
-                data.get('ph'),
-                data.get('ammonia'),
-                data.get('nitrite'),
-                data.get('nitrate'),
-                data.get('notes')
-            ))
-            conn.commit()
-            return jsonify({'success': True, 'id': c.lastrowid})
-        
-        elif request.method == 'DELETE':
-            # Delete a specific parameter reading by ID
-            param_id = request.args.get('id', type=int)
-            if not param_id:
-                return jsonify({'success': False, 'error': 'ID required'}), 400
-            
-            c = conn.cursor()
-            c.execute('DELETE FROM water_parameters WHERE id = ?', (param_id,))
-            conn.commit()
-            return jsonify({'success': True})
-        
-        else:
-            # GET: return recent parameters
-            limit = request.args.get('limit', 50, type=int)
-            c = conn.cursor()
-            c.execute('''
-                SELECT * FROM water_parameters 
-                ORDER BY timestamp DESC 
-                LIMIT ?
-            ''', (limit,))
-            
-            rows = c.fetchall()
-            return jsonify([dict(row) for row in rows])
+    if request.method == 'POST':
+        reading_id = repo().add_reading({
+            'timestamp': clock.now_ms(),
+            **validation.body()
+        })
+        return jsonify({'success': True, 'id': reading_id})
     
-    finally:
-        conn.close()
+    elif request.method == 'DELETE':
+        # Delete a specific parameter reading by ID
+        param_id = request.args.get('id', type=int)
+        if not param_id:
+            return jsonify({'success': False, 'error': 'ID required'}), 400
+        
+        repo().delete_reading(param_id)
+        return jsonify({'success': True})
+
+@app.route('/api/parameters/daily')
+def parameters_daily():
+    """Daily min/avg/max summaries of archived readings"""
+    try:
+        since, until = time_range(request.args)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    return stream_list('water_parameters_daily',
+                       lambda columns: repo().daily_parameters(columns, since, until))
 
 @app.route('/api/maintenance', methods=['GET', 'POST'])
 def maintenance():
     """Handle maintenance log entries"""
-    conn = get_db()
+    if request.method == 'GET':
+        limit = request.args.get('limit', 50, type=int)
+        before_id = request.args.get('before_id', type=int)
+        return stream_list('maintenance_log', lambda columns: repo().maintenance(columns, before_id, limit))
     
     if request.method == 'POST':
-        data = request.json
-        c = conn.cursor()
-        local_timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        c.execute('''
-            INSERT INTO maintenance_log (timestamp, task_type, description, completed)
-            VALUES (?, ?, ?, ?)
-        ''', (
-            local_timestamp,
-            data.get('task_type'),
-            data.get('description'),
-            data.get('completed', True)
-        ))
-        conn.commit()
-        conn.close()
-        return jsonify({'success': True, 'id': c.lastrowid})
-    
-    else:
-        limit = request.args.get('limit', 50, type=int)
-        c = conn.cursor()
-        c.execute('''
-            SELECT * FROM maintenance_log 
-            ORDER BY timestamp DESC 
-            LIMIT ?
-        ''', (limit,))
-        
-        rows = c.fetchall()
-        conn.close()
-        
-        return jsonify([dict(row) for row in rows])
+        entry_id = repo().add_maintenance({
+            'timestamp': clock.now_ms(),
+            **validation.body()
+        })
+        return jsonify({'success': True, 'id': entry_id})
 
 @app.route('/api/scheduled', methods=['GET', 'POST', 'PUT', 'DELETE'])
 def scheduled():
     """Handle scheduled tasks"""
-    conn = get_db()
+    if request.method == 'GET':
+        # GET: stream active scheduled tasks, soonest due first, filtered by
+        # ?status=, ?due_since= / ?due_until= and ?q=; ?limit= and
+        # ?after_id= page through them (no limit by default)
+        try:
+            since, until = due_range(request.args, clock.now_ms())
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        text = request.args.get('q') or None
+        after_id = request.args.get('after_id', type=int)
+        limit = request.args.get('limit', -1, type=int)
+        return stream_list('scheduled_tasks',
+                           lambda columns: repo().scheduled(columns, since, until, text, after_id, limit))
     
-    try:
-        c = conn.cursor()
-        
-        if request.method == 'POST':
-            data = request.json
-            is_recurring = data.get('is_recurring', True)
-            
-            if is_recurring:
-                # Recurring task with frequency
-                if not data.get('frequency_days'):
-                    return jsonify({'success': False, 'error': 'Frequency is required for recurring tasks'}), 400
-                
-                next_due = datetime.now() + timedelta(days=data['frequency_days'])
-                c.execute('''
-                    INSERT INTO scheduled_tasks (task_name, frequency_days, next_due, description, active, is_recurring)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                ''', (
-                    data['task_name'],
-                    data['frequency_days'],
-                    next_due.isoformat(),
-                    data.get('description'),
-                    True,
-                    True
-                ))
-            else:
-                # One-time task with specific date
-                if not data.get('specific_date') or data['specific_date'].strip() == '':
-                    return jsonify({'success': False, 'error': 'Date is required for one-time tasks'}), 400
-                
-                try:
-                    specific_date = datetime.fromisoformat(data['specific_date'])
-                except ValueError:
-                    return jsonify({'success': False, 'error': 'Invalid date format'}), 400
-                
-                c.execute('''
-                    INSERT INTO scheduled_tasks (task_name, next_due, description, active, is_recurring, specific_date)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                ''', (
-                    data['task_name'],
-                    specific_date.isoformat(),
-                    data.get('description'),
-                    True,
-                    False,
-                    specific_date.isoformat()
-                ))
-            
-            conn.commit()
-            task_id = c.lastrowid
-            return jsonify({'success': True, 'id': task_id})
-        
-        elif request.method == 'PUT':
-            # Complete a task and reschedule (or deactivate if one-time)
-            data = request.json
-            task_id = data['id']
-            
-            c.execute('SELECT frequency_days, is_recurring FROM scheduled_tasks WHERE id = ?', (task_id,))
-            row = c.fetchone()
-            
-            if row:
-                is_recurring = row['is_recurring']
-                now = datetime.now()
-                
-                if is_recurring:
-                    # Recurring task - reschedule
-                    frequency = row['frequency_days']
-                    next_due = now + timedelta(days=frequency)
-                    
-                    c.execute('''
-                        UPDATE scheduled_tasks 
-                        SET last_completed = ?, next_due = ?
-                        WHERE id = ?
-                    ''', (now.isoformat(), next_due.isoformat(), task_id))
-                else:
-                    # One-time task - mark as inactive
-                    c.execute('''
-                        UPDATE scheduled_tasks 
-                        SET last_completed = ?, active = 0
-                        WHERE id = ?
-                    ''', (now.isoformat(), task_id))
-                
-                # Also log to maintenance
-                log_timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                c.execute('''
-                    INSERT INTO maintenance_log (timestamp, task_type, description)
-                    VALUES (?, ?, ?)
-                ''', (log_timestamp, data.get('task_name', 'Scheduled Task'), 'Completed scheduled task'))
-                
-                conn.commit()
-            
-            return jsonify({'success': True})
-        
-        elif request.method == 'DELETE':
-            task_id = request.args.get('id', type=int)
-            c.execute('DELETE FROM scheduled_tasks WHERE id = ?', (task_id,))
-            conn.commit()
-            return jsonify({'success': True})
+    if request.method == 'POST':
+        data = validation.body()
         
+        if data['is_recurring']:
+            # Recurring task with frequency
+            task = {
+                'task_name': data['task_name'],
+                'frequency_days': data['frequency_days'],
+                'next_due': clock.now_ms() + data['frequency_days'] * clock.DAY_MS,
+                'description': data['description'],
+                'active': True,
+                'is_recurring': True
+            }
         else:
-            # GET: return all active scheduled tasks
-            c.execute('''
-                SELECT * FROM scheduled_tasks 
-                WHERE active = 1
-                ORDER BY next_due ASC
-            ''')
-            
-            rows = c.fetchall()
-            return jsonify([dict(row) for row in rows])
+            # One-time task with specific date
+            task = {
+                'task_name': data['task_name'],
+                'next_due': data['specific_date'],
+                'description': data['description'],
+                'active': True,
+                'is_recurring': False,
+                'specific_date': data['specific_date']
+            }
+        
+        task_id = repo().add_task(task)
+        return jsonify({'success': True, 'id': task_id})
     
-    finally:
-        conn.close()
+    elif request.method == 'PUT':
+        # Complete a task and reschedule (or deactivate if one-time),
+        # logging it to maintenance
+        data = validation.body()
+        repo().complete_task(data['id'], data['task_name'], clock.now_ms())
+        return jsonify({'success': True})
+    
+    elif request.method == 'DELETE':
+        task_id = request.args.get('id', type=int)
+        repo().delete_task(task_id)
+        return jsonify({'success': True})
+
+@app.route('/api/scheduled/buckets')
+def scheduled_buckets():
+    """Active task counts per status bucket (overdue, today, week, later)"""
+    return jsonify(repo().task_counts(clock.now_ms(), request.args.get('q') or None))
+
+@app.route('/api/scheduled/<int:task_id>/history')
+def scheduled_history(task_id):
+    """A task's adherence (on-time rate, lateness, streaks) and completions
+
+    Completions are newest first; ?limit= and ?before_id= page through them.
+    """
+    limit = request.args.get('limit', 50, type=int)
+    before_id = request.args.get('before_id', type=int)
+    history = repo().task_history(task_id, before_id, limit)
+    if history is None:
+        return jsonify({'success': False, 'error': 'Task not found'}), 404
+    stats, completions = history
+    return jsonify({
+        'task_id': task_id,
+        'stats': repository.task_summary(stats),
+        'completions': [row_to_dict(row, 'task_completions') for row in completions]
+    })
 
 @app.route('/api/fish', methods=['GET', 'POST', 'DELETE'])
 def fish():
     """Handle fish inventory"""
-    conn = get_db()
-    c = conn.cursor()
+    if request.method == 'GET':
+        return stream_list('fish_inventory', repo().fish)
     
     if request.method == 'POST':
-        data = request.json
-        c.execute('''
-            INSERT INTO fish_inventory (species, common_name, quantity, notes)
-            VALUES (?, ?, ?, ?)
-        ''', (
-            data['species'],
-            data.get('common_name'),
-            data.get('quantity', 1),
-            data.get('notes')
-        ))
-        conn.commit()
-        fish_id = c.lastrowid
-        conn.close()
+        fish_id = repo().add_fish({
+            **validation.body(),
+            'added_date': clock.now_ms()
+        })
         return jsonify({'success': True, 'id': fish_id})
     
     elif request.method == 'DELETE':
         fish_id = request.args.get('id', type=int)
-        c.execute('DELETE FROM fish_inventory WHERE id = ?', (fish_id,))
-        conn.commit()
-        conn.close()
+        repo().delete_fish(fish_id)
         return jsonify({'success': True})
+
+# Writes that clients may queue offline and replay through /api/sync
+SYNC_ENDPOINTS = {'parameters', 'maintenance', 'scheduled', 'fish'}
+SYNC_METHODS = {'POST', 'PUT', 'DELETE'}
+SYNC_MAX_REQUESTS = 500
+
+def write_count(data):
+    """Writes in a /api/sync or /api/batch body: its rate limit cost in write tokens"""
+    ops = data.get('requests') if isinstance(data, dict) else None
+    if not isinstance(ops, list):
+        return 1
+    return sum(not isinstance(op, dict) or str(op.get('method', 'GET')).upper() != 'GET' for op in ops)
+
+def replay(op):
+    """Run one queued write through its view, at most once per idempotency key"""
+    key = op.get('key')
+    method = str(op.get('method', '')).upper()
+    path = op.get('path')
+    if not idempotency.valid_key(key):
+        return 400, {'success': False, 'error': 'Missing or invalid idempotency key'}
+    if method not in SYNC_METHODS or not isinstance(path, str) or not path.startswith('/api/'):
+        return 400, {'success': False, 'error': 'Unsupported request'}
     
-    else:
-        c.execute('SELECT * FROM fish_inventory ORDER BY added_date DESC')
-        rows = c.fetchall()
-        conn.close()
-        return jsonify([dict(row) for row in rows])
+    with app.test_request_context(path, method=method, json=op.get('body')):
+        if request.endpoint not in SYNC_ENDPOINTS:
+            return 400, {'success': False, 'error': 'Unsupported request'}
+        rejected = validation.check()
+        if rejected is not None:
+            body, status = rejected
+            return status, body.get_json()
+        
+        try:
+            stored = idempotency.stored_response(repo(), key, method, path)
+            if stored is not None:
+                return stored
+            idempotency.begin(key, method, path)
+            response = app.make_response(app.view_functions[request.endpoint](**request.view_args))
+        except idempotency.KeyConflict as e:
+            body, status = idempotency.conflict(e)
+            return status, body.get_json()
+        except Exception:
+            app.logger.exception('Replay of %s %s failed', method, path)
+            idempotency.abandon(repo())
+            return 500, {'success': False, 'error': 'Internal error'}
+        
+        body = response.get_json(silent=True)
+        idempotency.finish(repo(), response.status_code, body)
+        return response.status_code, body
 
-@app.route('/api/stats')
-def stats():
-    """Get summary statistics"""
-    conn = get_db()
-    c = conn.cursor()
+@app.route('/api/sync', methods=['POST'])
+@ratelimit.cost(write_count)
+def sync():
+    """Replay writes queued by an offline client, in order"""
+    data = request.get_json(silent=True) or {}
+    ops = data.get('requests')
+    if not isinstance(ops, list) or not all(isinstance(op, dict) for op in ops):
+        return jsonify({'success': False, 'error': 'requests must be a list of objects'}), 400
+    if len(ops) > SYNC_MAX_REQUESTS:
+        return jsonify({'success': False, 'error': f'At most {SYNC_MAX_REQUESTS} requests per sync'}), 400
     
-    # Latest parameters
-    c.execute('SELECT * FROM water_parameters ORDER BY timestamp DESC LIMIT 1')
-    latest_params = c.fetchone()
+    results = []
+    for op in ops:
+        status, body = replay(op)
+        results.append({'key': op.get('key'), 'status': status, 'body': body})
+    return jsonify({'success': True, 'results': results})
+
+# Endpoints /api/batch can call; /api/sync and /api/batch itself are left out
+BATCH_ENDPOINTS = SYNC_ENDPOINTS | {'parameters_daily', 'scheduled_buckets', 'scheduled_history', 'changes', 'stats'}
+BATCH_METHODS = SYNC_METHODS | {'GET'}
+BATCH_MAX_REQUESTS = 100
+
+class BatchAborted(Exception):
+    """A sub-request of an atomic batch failed; the whole batch is undone"""
     
-    # Upcoming tasks
-    c.execute('''
-        SELECT COUNT(*) as count FROM scheduled_tasks 
-        WHERE active = 1 AND next_due <= datetime('now', '+7 days')
-    ''')
-    upcoming_tasks = c.fetchone()['count']
+    def __init__(self, index, status, body):
+        super().__init__(index)
+        self.index = index
+        self.status = status
+        self.body = body
+
+def dispatch(op, bound):
+    """Run one /api/batch sub-request through its view against bound"""
+    method = str(op.get('method', 'GET')).upper()
+    path = op.get('path')
+    if method not in BATCH_METHODS or not isinstance(path, str) or not path.startswith('/api/'):
+        return 400, {'success': False, 'error': 'Unsupported request'}
+    
+    # A fresh app context, so the sub-request has its own g and its teardown
+    # hooks leave the batch request's state alone
+    with app.app_context(), app.test_request_context(path, method=method, json=op.get('body')):
+        if request.endpoint not in BATCH_ENDPOINTS:
+            return 400, {'success': False, 'error': 'Unsupported request'}
+        rejected = validation.check()
+        if rejected is not None:
+            body, status = rejected
+            return status, body.get_json()
+        g._repository = bound
+        response = app.make_response(app.view_functions[request.endpoint](**request.view_args))
+        return response.status_code, response.get_json(silent=True)
+
+@app.route('/api/batch', methods=['POST'])
+@ratelimit.cost(write_count)
+def batch():
+    """Run several API requests on one connection, optionally as one transaction"""
+    data = request.get_json(silent=True) or {}
+    ops = data.get('requests')
+    atomic = bool(data.get('atomic', False))
+    if not isinstance(ops, list) or not all(isinstance(op, dict) for op in ops):
+        return jsonify({'success': False, 'error': 'requests must be a list of objects'}), 400
+    if len(ops) > BATCH_MAX_REQUESTS:
+        return jsonify({'success': False, 'error': f'At most {BATCH_MAX_REQUESTS} requests per batch'}), 400
     
-    # Total fish
-    c.execute('SELECT SUM(quantity) as total FROM fish_inventory')
-    total_fish = c.fetchone()['total'] or 0
+    def run(bound):
+        results = []
+        for index, op in enumerate(ops):
+            try:
+                with bound.isolated():
+                    status, body = dispatch(op, bound)
+            except Exception:
+                app.logger.exception('Batch request %s failed', index)
+                status, body = 500, {'success': False, 'error': 'Internal error'}
+            if atomic and status >= 400:
+                raise BatchAborted(index, status, body)
+            results.append({'status': status, 'body': body})
+        return results
     
-    # Recent maintenance count
-    c.execute('''
-        SELECT COUNT(*) as count FROM maintenance_log 
-        WHERE timestamp >= datetime('now', '-30 days')
-    ''')
-    recent_maintenance = c.fetchone()['count']
+    writes = any(str(op.get('method', 'GET')).upper() != 'GET' for op in ops)
+    try:
+        results = repo().batch(run, write=writes)
+    except BatchAborted as e:
+        return jsonify({
+            'success': False,
+            'error': f'Request {e.index} failed, so none of the batch was saved',
+            'failed': {'index': e.index, 'status': e.status, 'body': e.body}
+        }), e.status
+    return jsonify({'success': True, 'results': results})
+
+@app.route('/api/changes')
+def changes():
+    """Rows changed since a change log seq, with their current values"""
+    since = request.args.get('since', 0, type=int)
+    limit = min(max(request.args.get('limit', 500, type=int), 1), changelog.MAX_LIMIT)
     
-    conn.close()
+    result = repo().changes(since, limit, request.args.get('horizon', type=int))
+    if result is None:
+        # Deletes this client has not seen were compacted away
+        return jsonify({'success': True, 'reset': True})
     
+    entries, last_seq, more, horizon = result
+    return jsonify({
+        'success': True,
+        'changes': [
+            {'seq': seq, 'table': table, 'op': op, 'id': row_id,
+             'row': row_to_dict(row, table) if row else None}
+            for seq, table, op, row_id, row in entries
+        ],
+        'seq': last_seq,
+        'more': more,
+        'horizon': horizon
+    })
+
+@app.route('/api/stats')
+def stats():
+    """Get summary statistics"""
+    summary = repo().stats(clock.now_ms())
+    latest = summary['latest_parameters']
     return jsonify({
-        'latest_parameters': dict(latest_params) if latest_params else None,
-        'upcoming_tasks': upcoming_tasks,
-        'total_fish': total_fish,
-        'recent_maintenance': recent_maintenance
+        **summary,
+        'latest_parameters': row_to_dict(latest, 'water_parameters') if latest else None
     })
 
 if __name__ == '__main__':
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Static Assets
+Serves the frontend's CSS and JS under content-hashed URLs
+(/assets/app.3f9c2a1b7d4e.css) so browsers can cache them forever: a new
+deploy changes the hash, and with it the URL the page shell links to.
+
+Assets are read, hashed and gzipped once at startup and served from
+memory. Templates link to them with {{ asset_url('css/app.css') }}.
+
+To let Nginx serve them directly, write the hashed files (plus .gz
+variants for gzip_static) to a directory:
+    python3 assets.py --out static/dist
+"""
+
+import argparse
+import hashlib
+from collections import namedtuple
+from pathlib import Path
+
+from flask import Response, abort, request
+
+from compression import gzip_bytes
+
+STATIC_DIR = Path(__file__).parent / 'static'
+ASSETS = ('css/app.css', 'js/lists.js', 'js/offline.js', 'js/app.js', 'manifest.webmanifest')
+URL_PREFIX = '/assets/'
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+MIMETYPES = {
+    '.css': 'text/css',
+    '.js': 'text/javascript',
+    '.webmanifest': 'application/manifest+json',
+}
+
+Asset = namedtuple('Asset', 'filename mimetype data gzipped digest')
+
+_assets = {}        # logical name -> Asset
+_by_filename = {}   # hashed filename -> Asset
+
+
+def load(static_dir=STATIC_DIR):
+    """Read, hash and compress every asset"""
+    _assets.clear()
+    _by_filename.clear()
+    for name in ASSETS:
+        path = static_dir / name
+        data = path.read_bytes()
+        digest = hashlib.sha256(data).hexdigest()[:12]
+        asset = Asset(f'{path.stem}.{digest}{path.suffix}', MIMETYPES[path.suffix],
+                      data, gzip_bytes(data, 9), digest)
+        _assets[name] = asset
+        _by_filename[asset.filename] = asset
+
+
+def asset_url(name):
+    """Hashed URL for a logical asset name such as 'css/app.css'"""
+    return URL_PREFIX + _assets[name].filename
+
+
+def asset_urls():
+    """Hashed URLs of every asset, e.g. for the service worker to precache"""
+    return [asset_url(name) for name in ASSETS]
+
+
+def serve(filename):
+    """Serve a hashed asset from memory, gzipped when the client accepts it"""
+    asset = _by_filename.get(filename)
+    if asset is None:
+        abort(404)
+    gzip = request.accept_encodings['gzip'] > 0
+    response = Response(asset.gzipped if gzip else asset.data, mimetype=asset.mimetype)
+    if gzip:
+        response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+    response.headers['Cache-Control'] = IMMUTABLE
+    response.set_etag(asset.digest)
+    return response.make_conditional(request)
+
+
+def build(out_dir):
+    """Write hashed files and .gz variants; returns the files written"""
+    out_dir.mkdir(parents=True, exist_ok=True)
+    written = []
+    for asset in _assets.values():
+        path = out_dir / asset.filename
+        path.write_bytes(asset.data)
+        Path(f'{path}.gz').write_bytes(asset.gzipped)
+        written.append(path)
+    return written
+
+
+def init_app(app):
+    """Load assets and register asset_url() and the /assets/ route"""
+    load()
+    app.add_template_global(asset_url)
+    app.add_url_rule(URL_PREFIX + '<filename>', 'asset', serve)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write hashed static assets for Nginx.')
+    parser.add_argument('--out', default=str(STATIC_DIR / 'dist'),
+                        help='output directory (default: static/dist)')
+    args = parser.parse_args()
+
+    load()
+    for path in build(Path(args.out)):
+        print(f"✓ {path} (+ .gz)")
@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+"""
+Query Plan Auditor
+Records every SQL statement the app and the maintenance scripts execute,
+then runs EXPLAIN QUERY PLAN on each one against a large seeded database
+and reports full table scans, temporary B-trees (sorts, DISTINCT, GROUP
+BY) and automatic indexes.
+
+Statements are captured with set_trace_callback on every connection opened
+while the audit exercises all API routes through the Flask test client,
+a housekeeping pass, retention, the backfill, and each script (import-cycling-schedule.py
+and the migrate-*.py scripts, run against a scratch copy of a current
+database, so only the statements they execute there are seen). Literal
+values are replaced with ? so repeated statements are audited once.
+
+Usage:
+    python3 audit-query-plans.py                     # compare with the baseline
+    python3 audit-query-plans.py --save-baseline     # accept the current plans
+    python3 audit-query-plans.py --size 10m --json report.json
+
+Exits with status 1 when a statement gains a scan, temp B-tree or automatic
+index that the baseline (query-plans-baseline.json) does not have.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import re
+import runpy
+import sqlite3
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib.parse import quote
+
+import backfill
+import benchmark
+import clock
+import generate_data
+
+HERE = Path(__file__).parent
+DEFAULT_BASELINE = HERE / 'query-plans-baseline.json'
+SCRIPTS = ['import-cycling-schedule.py', 'migrate-database.py', 'migrate-database-fixed.py',
+           'migrate-timestamps.py', 'migrate-strict.py']
+AUDITED = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'REPLACE', 'WITH')
+
+# Readings kept in the main file when the audit database is archived, so
+# queries see both tiers at a realistic split
+RETENTION_DAYS = 90
+
+_STRING = re.compile(r"'(?:[^']|'')*'|[xX]'[0-9a-fA-F]*'")
+_NUMBER = re.compile(r'(?<![\w.])\d+(?:\.\d+)?(?:[eE][+-]?\d+)?(?![\w.])')
+_IN_LIST = re.compile(r'\bIN \(\?(?:, \?)*\)', re.IGNORECASE)
+
+
+def normalize(sql):
+    """Statement text with literals replaced by ? and whitespace collapsed"""
+    sql = _NUMBER.sub('?', _STRING.sub('?', sql))
+    sql = ' '.join(sql.split()).rstrip(';').strip()
+    sql = re.sub(r'\( ', '(', re.sub(r' \)', ')', sql))
+    return _IN_LIST.sub('IN (...)', sql)
+
+
+class Recorder:
+    """Collects statements from every sqlite3 connection opened while active"""
+
+    def __init__(self):
+        self.source = None
+        self.statements = {}  # normalized sql -> {'sql': first seen, 'sources': set}
+
+    def trace(self, sql):
+        # source is None while the scratch database is being seeded
+        if self.source is None or sql.startswith('--') or not sql.lstrip().upper().startswith(AUDITED):
+            return
+        entry = self.statements.setdefault(normalize(sql), {'sql': sql, 'sources': set()})
+        entry['sources'].add(self.source)
+
+    @contextlib.contextmanager
+    def capture(self):
+        connect = sqlite3.connect
+
+        def traced_connect(*args, **kwargs):
+            conn = connect(*args, **kwargs)
+            conn.set_trace_callback(self.trace)
+            return conn
+
+        sqlite3.connect = traced_connect
+        try:
+            yield self
+        finally:
+            sqlite3.connect = connect
+
+
+def prepare_database(data_dir, size_name, reseed=False):
+    """Seeded, archived and analyzed database for the plans, cached in data_dir"""
+    import app
+    import housekeeping
+    import retention
+
+    data_dir.mkdir(parents=True, exist_ok=True)
+    db_path = data_dir / f'audit-{size_name}.db'
+    if reseed:
+        for path in (db_path, retention.archive_path(db_path)):
+            if path.exists():
+                path.unlink()
+    if not db_path.exists():
+        print(f"Seeding {size_name} database at {db_path}...")
+        counts = benchmark.volumes(benchmark.SIZES[size_name])
+        generate_data.generate(db_path, counts['readings'], counts['maintenance'],
+                               counts['scheduled'], counts['fish'], seed=42, progress=None)
+        retention.archive_old_readings(db_path, RETENTION_DAYS)
+        housekeeping.run_once(db_path, analyze=True)
+        print("✓ Seeded")
+    # A database cached by an older version gets any new tables and indexes
+    app.init_db(db_path)
+    return db_path
+
+
+def copy_database(source, target):
+    """Consistent copy of a (possibly WAL mode) database"""
+    target.parent.mkdir(parents=True, exist_ok=True)
+    src = sqlite3.connect(source)
+    dst = sqlite3.connect(target)
+    try:
+        src.backup(dst)
+    finally:
+        dst.close()
+        src.close()
+
+
+def exercise_app(recorder, work_dir):
+    """Call every route (and the background jobs) against a small database"""
+    import app
+    import housekeeping
+    import retention
+
+    db_path = work_dir / 'app' / 'aquarium.db'
+    db_path.parent.mkdir(parents=True)
+    generate_data.generate(db_path, 5000, seed=7, progress=None)
+    app.DB_PATH = db_path
+    client = app.app.test_client()
+
+    recorder.source = 'retention.py'
+    retention.archive_old_readings(db_path, 14)
+
+    urls = app.app.url_map.bind('localhost')
+
+    def call(method, path, body=None, headers=None):
+        # Statements are grouped by route, not by the ids in the URL
+        rule = urls.match(path.split('?')[0], method=method, return_rule=True)[0].rule
+        recorder.source = f'{method} {rule}'
+        response = client.open(path, method=method, json=body, headers=headers)
+        response.get_data()
+        response.close()
+        return response.get_json(silent=True) or {}
+
+    week_ago = quote(clock.iso(clock.now_ms() - 7 * clock.DAY_MS))
+    month_ago = quote(clock.iso(clock.now_ms() - 30 * clock.DAY_MS))
+    newest = call('GET', '/api/parameters?limit=1')[0]['id']
+
+    for path in ['/', '/api/stats', '/api/parameters', '/api/parameters?limit=1000',
+                 f'/api/parameters?since={week_ago}', f'/api/parameters?since={month_ago}&until={week_ago}',
+                 f'/api/parameters?before_id={newest - 100}&limit=100', '/api/parameters?fields=timestamp,ph',
+                 '/api/parameters?format=columnar', '/api/parameters/daily',
+                 f'/api/parameters/daily?since={month_ago}&until={week_ago}', '/api/maintenance',
+                 '/api/maintenance?before_id=50', '/api/scheduled', '/api/fish', '/api/changes?since=0',
+                 f'/api/changes?since={newest}', '/metrics']:
+        call('GET', path)
+
+    reading = call('POST', '/api/parameters', {'temperature': 78.5, 'ph': 7.2})['id']
+    call('POST', '/api/maintenance', {'task_type': 'Water Change', 'description': '25%'})
+    task = call('POST', '/api/scheduled', {'task_name': 'Rinse sponge', 'frequency_days': 14})['id']
+    once = call('POST', '/api/scheduled', {'task_name': 'Dose', 'is_recurring': False,
+                                           'specific_date': clock.iso(clock.now_ms() + clock.DAY_MS)})['id']
+    fish = call('POST', '/api/fish', {'species': 'Corydoras panda', 'quantity': 6})['id']
+    call('PUT', '/api/scheduled', {'id': task, 'task_name': 'Rinse sponge'})
+    call('PUT', '/api/scheduled', {'id': once, 'task_name': 'Dose'})
+    for path in ['/api/scheduled?status=overdue', '/api/scheduled?status=week&q=sponge',
+                 f'/api/scheduled?due_since={week_ago}&after_id={task}&limit=20',
+                 '/api/scheduled/buckets', '/api/scheduled/buckets?q=sponge',
+                 f'/api/scheduled/{task}/history', f'/api/scheduled/{task}/history?before_id=1']:
+        call('GET', path)
+    call('POST', '/api/fish', {'species': 'Otocinclus'}, {'Idempotency-Key': 'audit-1'})
+    call('POST', '/api/fish', {'species': 'Otocinclus'}, {'Idempotency-Key': 'audit-1'})
+    call('POST', '/api/sync', {'requests': [
+        {'key': 'audit-2', 'method': 'POST', 'path': '/api/parameters', 'body': {'ph': 7.0}},
+        {'key': 'audit-2', 'method': 'POST', 'path': '/api/parameters', 'body': {'ph': 7.0}},
+    ]})
+    call('DELETE', f'/api/parameters?id={reading}')
+    call('DELETE', '/api/parameters?id=1')  # archived
+    call('DELETE', f'/api/scheduled?id={task}')
+    call('DELETE', f'/api/fish?id={fish}')
+    call('GET', '/api/changes?since=0')
+
+    # The backfill's workers are other processes, out of the recorder's
+    # reach; a thread runs the same compute() calls here
+    recorder.source = 'backfill.py'
+    with ThreadPoolExecutor(1, initializer=backfill.open_reader, initargs=(str(db_path),)) as pool:
+        for name in backfill.DERIVATIONS:
+            backfill.backfill(db_path, name, pool, 1)
+
+    recorder.source = 'housekeeping.py'
+    housekeeping.run_once(db_path, analyze=True)
+    return db_path
+
+
+def run_scripts(recorder, work_dir, source_db):
+    """Run each script in a scratch directory holding a copy of source_db"""
+    for script in SCRIPTS:
+        # Scripts look for ./aquarium.db, then ~/waterscribe/aquarium.db
+        home = work_dir / Path(script).stem
+        copy_database(source_db, home / 'waterscribe' / 'aquarium.db')
+        cwd, environ_home, argv = os.getcwd(), os.environ.get('HOME'), sys.argv
+        os.chdir(home / 'waterscribe')
+        os.environ['HOME'] = str(home)
+        sys.argv = [script]
+        recorder.source = script
+        output = io.StringIO()
+        try:
+            with contextlib.redirect_stdout(output):
+                runpy.run_path(str(HERE / script), run_name='__main__')
+        except SystemExit as e:
+            if e.code:
+                print(f"  ! {script} exited with status {e.code}")
+        except Exception as e:
+            print(f"  ! {script} failed: {e}")
+        finally:
+            os.chdir(cwd)
+            sys.argv = argv
+            if environ_home is None:
+                os.environ.pop('HOME', None)
+            else:
+                os.environ['HOME'] = environ_home
+
+
+def plan_issues(plan, tables):
+    """Scans, temp B-trees and automatic indexes in an EXPLAIN QUERY PLAN
+
+    Only scans of real tables count: a view or subquery scan reads rows its
+    own (separately listed) steps produce.
+    """
+    issues = []
+    for detail in plan:
+        words = detail.split()
+        if words[0] == 'SCAN' and words[1].rpartition('.')[2] in tables:
+            issues.append(detail)
+        elif 'TEMP B-TREE' in detail or 'AUTOMATIC' in detail:
+            issues.append(detail)
+    return sorted(set(issues))
+
+
+def explain(db_path, statements):
+    """{normalized sql: {'sources', 'plan', 'issues' | 'error'}}"""
+    import retention
+
+    conn = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True)
+    retention.attach_archive(conn, db_path)
+    tables = {name for schema in ('main', 'archive')
+              for (name,) in conn.execute(f"SELECT name FROM {schema}.sqlite_master WHERE type = 'table'")}
+    report = {}
+    try:
+        for key, entry in sorted(statements.items()):
+            result = {'sources': sorted(entry['sources'])}
+            try:
+                rows = conn.execute('EXPLAIN QUERY PLAN ' + entry['sql']).fetchall()
+            except sqlite3.Error as e:
+                # e.g. a migration statement for a table the current schema lacks
+                result['error'] = str(e)
+            else:
+                result['plan'] = [row[3] for row in rows]
+                result['issues'] = plan_issues(result['plan'], tables)
+            report[key] = result
+    finally:
+        conn.close()
+    return report
+
+
+def compare(report, baseline):
+    """(sql, new issues) for statements whose plans got worse"""
+    regressions = []
+    for key, result in report.items():
+        known = set(baseline.get(key, {}).get('issues', []))
+        new = [issue for issue in result.get('issues', []) if issue not in known]
+        if new:
+            regressions.append((key, new))
+    return regressions
+
+
+def print_report(report):
+    flagged = {key: result for key, result in report.items() if result.get('issues')}
+    errors = {key: result for key, result in report.items() if 'error' in result}
+    print(f"\n{len(report)} statements, {len(flagged)} with scans/temp B-trees/automatic indexes, "
+          f"{len(errors)} not explainable against the current schema\n")
+    for key, result in flagged.items():
+        print(f"{key}\n    from: {', '.join(result['sources'])}")
+        for issue in result['issues']:
+            print(f"    - {issue}")
+    for key, result in errors.items():
+        print(f"{key}\n    from: {', '.join(result['sources'])}\n    ! {result['error']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Audit query plans of every SQL statement in the project.')
+    parser.add_argument('--size', default='1m', choices=benchmark.SIZES,
+                        help='readings in the database the plans are taken against (default 1m)')
+    parser.add_argument('--data-dir', type=Path, default=benchmark.DEFAULT_DATA_DIR)
+    parser.add_argument('--reseed', action='store_true', help='rebuild the cached database')
+    parser.add_argument('--baseline', type=Path, default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--json', type=Path, help='also write the full report to this file')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work:
+        work_dir = Path(work)
+        os.environ.setdefault('WATERSCRIBE_METRICS_DIR', str(work_dir / 'metrics'))
+        os.environ.setdefault('WATERSCRIBE_HOUSEKEEPING', '0')
+        os.environ.setdefault('WATERSCRIBE_RATE_LIMIT', '0')
+        db_path = prepare_database(args.data_dir, args.size, args.reseed)
+
+        recorder = Recorder()
+        with recorder.capture():
+            app_db = exercise_app(recorder, work_dir)
+            run_scripts(recorder, work_dir, app_db)
+        report = explain(db_path, recorder.statements)
+
+    print_report(report)
+    if args.json:
+        args.json.write_text(json.dumps(report, indent=2, sort_keys=True))
+
+    if args.save_baseline:
+        baseline = {key: {'sources': result['sources'], 'issues': result['issues']}
+                    for key, result in report.items() if 'issues' in result}
+        args.baseline.write_text(json.dumps(baseline, indent=2, sort_keys=True) + '\n')
+        print(f"\n✓ Baseline saved to {args.baseline}")
+        return 0
+
+    if not args.baseline.exists():
+        print(f"\nNo baseline at {args.baseline} - run with --save-baseline to create one")
+        return 0
+
+    regressions = compare(report, json.loads(args.baseline.read_text()))
+    if regressions:
+        print(f"\n✗ {len(regressions)} statement(s) with worse plans than the baseline:")
+        for key, issues in regressions:
+            print(f"  {key}")
+            for issue in issues:
+                print(f"    + {issue}")
+        return 1
+    print("\n✓ No plan regressions")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
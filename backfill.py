@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+"""
+Backfill Derived Data
+Rebuilds data derived from the history tables for an existing database,
+e.g. after upgrading to a version that adds a new summary:
+
+    daily        water_parameters_daily, from the archived readings
+    completions  task_completions (and task_stats), from the completed-task
+                 entries in maintenance_log from before completions were
+                 recorded; due dates are worked out from each task's
+                 frequency (a recurring task's first completion has none,
+                 so it is not rated), entries whose name matches no single
+                 task are skipped
+
+The source table is split into time ranges of whole local days. A process
+pool (one worker per core by default, at low priority) computes each
+range's rows on its own read-only connection, which never blocks the app.
+The results go to a single writer here, one short transaction per range,
+with a pause in between so request writes get their turn. Each transaction
+also records how far the run got in sync_state, so a killed run picks up
+from there when started again; --restart starts over.
+
+Run it against the primary; a standby receives the new rows through
+replication, but seed it again afterwards to pick up the recomputed task
+streaks.
+
+Usage:
+    python3 backfill.py --db aquarium.db [daily] [completions] [--workers 4] [--chunk-days 30]
+"""
+
+import argparse
+import multiprocessing
+import os
+import sqlite3
+import time
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import clock
+import replication
+import repository
+import retention
+
+CHUNK_DAYS = 30
+WRITE_PAUSE = 0.05
+
+_reader = None  # each worker's read-only connection
+
+
+# A derivation's range() gives the (since, until) it covers, prepare() sets
+# up a run from since and returns what compute() needs in the workers,
+# write() stores one range's rows in the writer's transaction, reset()
+# undoes an earlier run and finish() runs once the last range is written
+
+class DailySummaries:
+    """water_parameters_daily from the archive"""
+
+    def range(self, conn, db_path):
+        if not retention.attach_archive(conn, db_path):
+            return None
+        # Separately, so each is a single index lookup
+        first = conn.execute('SELECT MIN(timestamp) FROM archive.water_parameters').fetchone()[0]
+        last = conn.execute('SELECT MAX(timestamp) FROM archive.water_parameters').fetchone()[0]
+        if first is None:
+            return None
+        return clock.local_midnight(first), clock.local_midnight(last, 1)
+
+    def prepare(self, conn, since):
+        return None
+
+    def compute(self, conn, since, until, context):
+        return retention.day_summaries(conn, since, until)
+
+    def write(self, conn, since, until, rows):
+        retention.replace_day_summaries(conn, since, until, rows)
+
+    def reset(self, conn, until):
+        pass
+
+    def finish(self, conn, until):
+        pass
+
+
+class TaskCompletions:
+    """task_completions from maintenance_log entries older than the first recorded completion"""
+
+    def range(self, conn, db_path):
+        first = conn.execute('SELECT MIN(timestamp) FROM maintenance_log').fetchone()[0]
+        until = conn.execute('SELECT MIN(completed_at) FROM task_completions').fetchone()[0]
+        if first is None:
+            return None
+        return clock.local_midnight(first), until if until is not None else clock.now_ms()
+
+    def prepare(self, conn, since):
+        """Load the tasks for write(); returns compute()'s map of task ids by name
+
+        Only names that belong to a single task are in the map.
+        """
+        tasks = conn.execute('''
+            SELECT id, task_name, is_recurring, frequency_days, specific_date FROM scheduled_tasks
+        ''').fetchall()
+        self.tasks = {row[0]: tuple(row[2:]) for row in tasks}
+        # Each task's latest completion so far, e.g. from an interrupted run
+        self.last = dict(conn.execute('''
+            SELECT task_id, MAX(completed_at) FROM task_completions
+            WHERE completed_at < ? GROUP BY task_id
+        ''', (since,)).fetchall())
+        names = Counter(row[1] for row in tasks)
+        return {row[1]: row[0] for row in tasks if names[row[1]] == 1}
+
+    def compute(self, conn, since, until, context):
+        return [(context[name], timestamp) for timestamp, name in conn.execute('''
+            SELECT timestamp, task_type FROM maintenance_log
+            WHERE timestamp >= ? AND timestamp < ? AND description = ?
+            ORDER BY timestamp, id
+        ''', (since, until, repository.COMPLETED_TASK)) if name in context]
+
+    def write(self, conn, since, until, rows):
+        for task_id, completed_at in rows:
+            if task_id not in self.tasks:  # deleted since the run started
+                continue
+            is_recurring, frequency_days, specific_date = self.tasks[task_id]
+            if not is_recurring:
+                due_at = specific_date
+            elif task_id in self.last and frequency_days:
+                # Completing a task sets its next due date this far ahead
+                due_at = self.last[task_id] + frequency_days * clock.DAY_MS
+            else:
+                # The first completion on record: when it was due is not
+                # known, so it is stored without on_time and not rated
+                due_at = None
+            conn.execute('''
+                INSERT INTO task_completions (task_id, due_at, completed_at, on_time)
+                VALUES (?, ?, ?, ?)
+            ''', (task_id, due_at, completed_at, repository.on_time(due_at, completed_at)))
+            self.last[task_id] = completed_at
+
+    def _backfilled_tasks(self, conn, until):
+        return [row[0] for row in conn.execute('''
+            SELECT DISTINCT task_id FROM task_completions WHERE completed_at < ?
+        ''', (until,))]
+
+    def _recompute_stats(self, conn, task_ids):
+        """Rebuild task_stats for task_ids from their completions, in order
+
+        Completions without a due date are left out, as the trigger does;
+        a task with none left loses its task_stats row.
+        """
+        for task_id in task_ids:
+            totals = {'completions': 0, 'on_time': 0, 'late_ms': 0, 'streak': 0, 'best_streak': 0}
+            for due_at, completed_at, done in conn.execute('''
+                SELECT due_at, completed_at, on_time FROM task_completions
+                WHERE task_id = ? ORDER BY completed_at, id
+            ''', (task_id,)).fetchall():
+                if done is None:
+                    continue
+                totals['completions'] += 1
+                totals['on_time'] += done
+                totals['late_ms'] += 0 if done else completed_at - due_at
+                totals['streak'] = totals['streak'] + 1 if done else 0
+                totals['best_streak'] = max(totals['best_streak'], totals['streak'])
+            if totals['completions']:
+                conn.execute('''
+                    INSERT OR REPLACE INTO task_stats (task_id, completions, on_time, late_ms, streak, best_streak)
+                    VALUES (:task_id, :completions, :on_time, :late_ms, :streak, :best_streak)
+                ''', {'task_id': task_id, **totals})
+            else:
+                conn.execute('DELETE FROM task_stats WHERE task_id = ?', (task_id,))
+
+    def reset(self, conn, until):
+        """Delete an earlier run's completions, and their share of task_stats"""
+        task_ids = self._backfilled_tasks(conn, until)
+        conn.execute('DELETE FROM task_completions WHERE completed_at < ?', (until,))
+        # A task whose entries no longer match (renamed, or its name now
+        # shared) gets no rows in the new run, so is not recomputed by finish()
+        self._recompute_stats(conn, task_ids)
+
+    def finish(self, conn, until):
+        """Recompute task_stats in completion order for the tasks given history"""
+        self._recompute_stats(conn, self._backfilled_tasks(conn, until))
+
+
+DERIVATIONS = {
+    'daily': DailySummaries(),
+    'completions': TaskCompletions(),
+}
+
+
+def _connect(db_path):
+    conn = sqlite3.connect(db_path, timeout=10.0, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def _state(conn, name):
+    """(done, until) checkpoint of a derivation, or None if it has not started"""
+    rows = dict(conn.execute('SELECT name, value FROM sync_state WHERE name IN (?, ?)',
+                             (f'backfill_{name}_done', f'backfill_{name}_until')).fetchall())
+    if f'backfill_{name}_until' not in rows:
+        return None
+    return rows[f'backfill_{name}_done'], rows[f'backfill_{name}_until']
+
+
+def _save_state(conn, name, done, until):
+    conn.executemany('''
+        INSERT INTO sync_state (name, value) VALUES (?, ?)
+        ON CONFLICT (name) DO UPDATE SET value = excluded.value
+    ''', [(f'backfill_{name}_done', done), (f'backfill_{name}_until', until)])
+
+
+def open_reader(db_path):
+    """Make this thread's or process's compute() calls read db_path (read-only)"""
+    global _reader
+    _reader = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True, timeout=10.0, check_same_thread=False)
+    retention.attach_archive(_reader, db_path)
+
+
+def _start_worker(db_path):
+    if hasattr(os, 'nice'):
+        os.nice(10)
+    open_reader(db_path)
+
+
+def _compute(name, since, until, context):
+    return since, until, DERIVATIONS[name].compute(_reader, since, until, context)
+
+
+def chunks(since, until, days=CHUNK_DAYS):
+    """[start, end) ranges of whole local days covering since..until"""
+    start = since
+    while start < until:
+        end = min(clock.local_midnight(start, days), until)
+        yield start, end
+        start = end
+
+
+def backfill(db_path, name, pool, workers, chunk_days=CHUNK_DAYS, restart=False, progress=None):
+    """Run one derivation to the end of its range; returns the rows written"""
+    derivation = DERIVATIONS[name]
+    conn = _connect(db_path)
+    try:
+        state = _state(conn, name)
+        if restart and state is not None:
+            conn.execute('BEGIN IMMEDIATE')
+            derivation.reset(conn, state[1])
+            conn.execute('DELETE FROM sync_state WHERE name IN (?, ?)',
+                         (f'backfill_{name}_done', f'backfill_{name}_until'))
+            conn.execute('COMMIT')
+            state = None
+        if state is None:
+            bounds = derivation.range(conn, db_path)
+            if bounds is None:
+                return 0
+            conn.execute('BEGIN IMMEDIATE')
+            _save_state(conn, name, *bounds)
+            conn.execute('COMMIT')
+            state = bounds
+        done, until = state
+        context = derivation.prepare(conn, done)
+
+        written = 0
+        pending = deque()
+
+        def write_next():
+            nonlocal written
+            since, end, rows = pending.popleft().result()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                derivation.write(conn, since, end, rows)
+                _save_state(conn, name, end, until)
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+            written += len(rows)
+            if progress:
+                progress(f"  {name}: up to {clock.iso(end)[:10]}, {written:,} rows")
+            if rows:
+                time.sleep(WRITE_PAUSE)
+
+        # Ranges are computed in parallel but written in order, so the
+        # checkpoint only ever moves past finished ranges
+        for since, end in chunks(done, until, chunk_days):
+            pending.append(pool.submit(_compute, name, since, end, context))
+            if len(pending) >= 2 * workers:
+                write_next()
+        while pending:
+            write_next()
+
+        conn.execute('BEGIN IMMEDIATE')
+        derivation.finish(conn, until)
+        conn.execute('COMMIT')
+        return written
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Rebuild derived data from the history tables.')
+    parser.add_argument('derivations', nargs='*',
+                        help=f"what to rebuild (default: all of {', '.join(DERIVATIONS)})")
+    parser.add_argument('--db', default='aquarium.db', help='database path (default: aquarium.db)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='worker processes (default: one per core)')
+    parser.add_argument('--chunk-days', type=int, default=CHUNK_DAYS,
+                        help=f'days per range, i.e. per write transaction (default: {CHUNK_DAYS})')
+    parser.add_argument('--restart', action='store_true', help='discard earlier progress and start over')
+    args = parser.parse_args()
+    unknown = set(args.derivations) - set(DERIVATIONS)
+    if unknown:
+        parser.error(f"unknown derivation: {', '.join(sorted(unknown))}")
+
+    if not Path(args.db).exists():
+        print(f"Error: Database not found at {args.db}")
+        raise SystemExit(1)
+
+    from app import init_db
+    init_db(args.db)
+
+    check = sqlite3.connect(args.db)
+    try:
+        if replication.status(check) is not None:
+            print("Error: this database is a standby; run the backfill on the primary")
+            raise SystemExit(1)
+    finally:
+        check.close()
+
+    # spawn: the workers must not inherit the app's threads or connections
+    with ProcessPoolExecutor(args.workers, mp_context=multiprocessing.get_context('spawn'),
+                             initializer=_start_worker, initargs=(str(args.db),)) as pool:
+        for name in args.derivations or DERIVATIONS:
+            print(f"Backfilling {name} with {args.workers} workers...")
+            started = time.perf_counter()
+            total = backfill(args.db, name, pool, args.workers, args.chunk_days, args.restart, progress=print)
+            print(f"✓ {name}: {total:,} rows in {time.perf_counter() - started:.1f}s")
@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+"""
+API Benchmark Suite
+Seeds databases at realistic sizes and measures every endpoint in app.py
+through the Flask test client and a real HTTP server. Each run works on a
+throwaway copy of the seeded database, so the writes it times never change
+the cached seed.
+
+Usage:
+    python3 benchmark.py                          # 10k readings, both modes
+    python3 benchmark.py --sizes 10k,1m,10m       # larger datasets (cached)
+    python3 benchmark.py --save-baseline          # record current numbers
+    python3 benchmark.py --threshold 0.25         # fail if p95 regresses >25%
+    python3 benchmark.py --storage memory         # in-memory repository
+
+Exits with status 1 when any endpoint regresses against the baseline.
+"""
+
+import argparse
+import http.client
+import itertools
+import json
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import generate_data
+
+SIZES = {'10k': 10_000, '1m': 1_000_000, '10m': 10_000_000}
+DEFAULT_DATA_DIR = Path(tempfile.gettempdir()) / 'waterscribe-bench'
+DEFAULT_BASELINE = Path(__file__).parent / 'benchmark-baseline.json'
+_refs = itertools.count(1)
+
+# Untimed requests that create the row a DELETE then removes
+NEW_READING = ('POST', '/api/parameters', {'ph': 7.0, 'notes': 'bench'})
+NEW_TASK = ('POST', '/api/scheduled', {'task_name': 'Bench task', 'frequency_days': 7})
+NEW_FISH = ('POST', '/api/fish', {'species': 'Bench fish'})
+
+# (name, method, path, body[, setup]) - writes are included so lock contention
+# shows up. path and body may be functions of a ref: the id the setup request
+# returned, or without one a number unique to each call (for idempotency keys)
+ENDPOINTS = [
+    ('index', 'GET', '/', None),
+    ('stats', 'GET', '/api/stats', None),
+    ('parameters', 'GET', '/api/parameters?limit=50', None),
+    ('parameters_1000', 'GET', '/api/parameters?limit=1000', None),
+    ('maintenance', 'GET', '/api/maintenance?limit=50', None),
+    ('scheduled', 'GET', '/api/scheduled', None),
+    ('fish', 'GET', '/api/fish', None),
+    ('parameters_daily', 'GET', '/api/parameters/daily', None),
+    ('scheduled_buckets', 'GET', '/api/scheduled/buckets', None),
+    ('changes', 'GET', '/api/changes?since=0', None),
+    ('add_parameters', 'POST', '/api/parameters',
+     {'temperature': 78.2, 'ph': 7.1, 'ammonia': 0, 'nitrite': 0, 'nitrate': 10, 'notes': 'bench'}),
+    ('add_maintenance', 'POST', '/api/maintenance',
+     {'task_type': 'Water Change', 'description': 'bench'}),
+    ('add_scheduled', 'POST', '/api/scheduled', {'task_name': 'Rinse sponge', 'frequency_days': 14}),
+    ('add_fish', 'POST', '/api/fish', {'species': 'Corydoras panda', 'quantity': 6}),
+    # Completes seeded task 1 every call, so its history below has rows to page
+    ('complete_scheduled', 'PUT', '/api/scheduled', {'id': 1, 'task_name': 'Bench'}),
+    ('task_history', 'GET', '/api/scheduled/1/history', None),
+    ('delete_parameters', 'DELETE', lambda ref: f'/api/parameters?id={ref}', None, NEW_READING),
+    ('delete_scheduled', 'DELETE', lambda ref: f'/api/scheduled?id={ref}', None, NEW_TASK),
+    ('delete_fish', 'DELETE', lambda ref: f'/api/fish?id={ref}', None, NEW_FISH),
+    ('batch', 'POST', '/api/batch', {'atomic': True, 'requests': [
+        {'method': 'POST', 'path': '/api/parameters', 'body': {'ph': 7.2}},
+        {'method': 'POST', 'path': '/api/maintenance', 'body': {'task_type': 'Water Change'}},
+        {'method': 'PUT', 'path': '/api/scheduled', 'body': {'id': 1, 'task_name': 'Bench'}},
+        {'method': 'GET', 'path': '/api/stats'},
+    ]}),
+    ('sync', 'POST', '/api/sync', lambda ref: {'requests': [
+        {'key': f'bench-{ref}-{i}', 'method': 'POST', 'path': '/api/parameters', 'body': {'ph': 7.0}}
+        for i in range(5)
+    ]}),
+]
+
+
+def volumes(readings):
+    """Maintenance, task and fish counts that scale with the reading count"""
+    return {
+        'readings': readings,
+        'maintenance': max(100, readings // 20),
+        'scheduled': max(20, readings // 5000),
+        'fish': max(10, readings // 10000),
+    }
+
+
+def prepare_database(data_dir, size_name, reseed=False):
+    """Return a seeded database for the given size, reusing a cached copy"""
+    data_dir.mkdir(parents=True, exist_ok=True)
+    db_path = data_dir / f'bench-{size_name}.db'
+    if reseed:
+        # A stale WAL left beside a new seed would be replayed into it
+        for path in (db_path, Path(f'{db_path}-wal'), Path(f'{db_path}-shm')):
+            path.unlink(missing_ok=True)
+    if not db_path.exists():
+        print(f"Seeding {size_name} database at {db_path}...")
+        started = time.perf_counter()
+        counts = volumes(SIZES[size_name])
+        generate_data.generate(db_path, counts['readings'], counts['maintenance'],
+                               counts['scheduled'], counts['fish'], seed=42, progress=None)
+        print(f"✓ Seeded in {time.perf_counter() - started:.1f}s")
+    return db_path
+
+
+def working_copy(seed_path, work_dir):
+    """Copy a seeded database into work_dir for one run to write to"""
+    work_dir.mkdir(parents=True, exist_ok=True)
+    copy_path = work_dir / 'aquarium.db'
+    source = sqlite3.connect(f'file:{seed_path}?mode=ro', uri=True)
+    target = sqlite3.connect(copy_path)
+    try:
+        source.backup(target)
+        target.execute('PRAGMA journal_mode = WAL')
+    finally:
+        target.close()
+        source.close()
+    return copy_path
+
+
+def summarize(samples):
+    """Latency percentiles in milliseconds plus throughput"""
+    cuts = statistics.quantiles(samples, n=100, method='inclusive')
+    return {
+        'p50': round(cuts[49] * 1000, 3),
+        'p95': round(cuts[94] * 1000, 3),
+        'p99': round(cuts[98] * 1000, 3),
+        # Timed requests only; setup requests are left out
+        'rps': round(len(samples) / sum(samples), 1),
+    }
+
+
+def requests_for(endpoint, setup_client):
+    """(path, body) for each call of an endpoint, running its setup first"""
+    _, _, path, body, *setup = endpoint
+    while True:
+        # Unique across modes and sizes, so no sync key is ever replayed
+        ref = next(_refs)
+        if setup:
+            setup_method, setup_path, setup_body = setup[0]
+            response = setup_client.open(setup_path, method=setup_method, json=setup_body)
+            ref = response.get_json()['id']
+            response.close()
+        yield (path(ref) if callable(path) else path,
+               body(ref) if callable(body) else body)
+
+
+def run_test_client(flask_app, endpoint, iterations, warmup):
+    client = flask_app.test_client()
+    method = endpoint[1]
+    calls = requests_for(endpoint, client)
+    for _ in range(warmup):
+        path, body = next(calls)
+        client.open(path, method=method, json=body).close()
+    samples = []
+    for _ in range(iterations):
+        path, body = next(calls)
+        t0 = time.perf_counter()
+        response = client.open(path, method=method, json=body)
+        response.get_data()
+        response.close()
+        samples.append(time.perf_counter() - t0)
+    return summarize(samples)
+
+
+def run_http(flask_app, port, endpoint, iterations, warmup):
+    method = endpoint[1]
+    calls = requests_for(endpoint, flask_app.test_client())
+
+    def call(path, body):
+        payload = json.dumps(body) if body is not None else None
+        headers = {'Content-Type': 'application/json'} if body is not None else {}
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+        conn.request(method, path, body=payload, headers=headers)
+        conn.getresponse().read()
+        conn.close()
+
+    for _ in range(warmup):
+        call(*next(calls))
+    samples = []
+    for _ in range(iterations):
+        path, body = next(calls)
+        t0 = time.perf_counter()
+        call(path, body)
+        samples.append(time.perf_counter() - t0)
+    return summarize(samples)
+
+
+def start_server(flask_app):
+    """Serve the app from a background thread on a free port"""
+    from werkzeug.serving import WSGIRequestHandler, make_server
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    server = make_server('127.0.0.1', 0, flask_app, threaded=True, request_handler=QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def compare(results, baseline, threshold):
+    """Return the keys whose p95 regressed beyond the threshold"""
+    regressions = []
+    for key, current in results.items():
+        previous = baseline.get(key)
+        if not previous:
+            continue
+        if current['p95'] > previous['p95'] * (1 + threshold):
+            regressions.append((key, previous['p95'], current['p95']))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the WaterScribe API')
+    parser.add_argument('--sizes', default='10k', help='comma separated: 10k,1m,10m')
+    parser.add_argument('--modes', default='client,http', help='comma separated: client,http')
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--warmup', type=int, default=20)
+    parser.add_argument('--endpoints', help='comma separated endpoint names to run')
+    parser.add_argument('--data-dir', type=Path, default=DEFAULT_DATA_DIR)
+    parser.add_argument('--reseed', action='store_true', help='rebuild cached databases')
+    parser.add_argument('--baseline', type=Path, default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--threshold', type=float, default=0.20,
+                        help='allowed p95 slowdown as a fraction (default 0.20)')
+    parser.add_argument('--json', type=Path, help='also write results to this file')
+    parser.add_argument('--storage', choices=('sqlite', 'memory'), default='sqlite',
+                        help='memory loads each seeded database into the in-memory repository')
+    args = parser.parse_args()
+
+    sizes = [s.strip().lower() for s in args.sizes.split(',')]
+    for size in sizes:
+        if size not in SIZES:
+            parser.error(f"unknown size '{size}' (choose from {', '.join(SIZES)})")
+    modes = [m.strip() for m in args.modes.split(',')]
+    endpoints = ENDPOINTS
+    if args.endpoints:
+        wanted = set(args.endpoints.split(','))
+        endpoints = [e for e in ENDPOINTS if e[0] in wanted]
+
+    args.data_dir.mkdir(parents=True, exist_ok=True)
+    work = tempfile.TemporaryDirectory(dir=args.data_dir)
+    work_dir = Path(work.name)
+    copies = {size: work_dir / size / 'aquarium.db' for size in sizes}
+
+    # app reads these when imported (seeding imports it too), so they are
+    # set first. Housekeeping would archive and vacuum in the middle of a run.
+    os.environ['WATERSCRIBE_DB'] = str(copies[sizes[0]])
+    os.environ['WATERSCRIBE_HOUSEKEEPING'] = '0'
+    # Keep benchmark metrics out of the service's metrics directory
+    os.environ.setdefault('WATERSCRIBE_METRICS_DIR', str(args.data_dir / 'metrics'))
+    # One client in a tight loop is exactly what the rate limiter stops
+    os.environ.setdefault('WATERSCRIBE_RATE_LIMIT', '0')
+    seeds = {size: prepare_database(args.data_dir, size, args.reseed) for size in sizes}
+    import app
+    import repository
+
+    results = {}
+    print(f"{'size':<5} {'mode':<7} {'endpoint':<18} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'req/s':>9}")
+    try:
+        for size in sizes:
+            # Later sizes swap the database under the imported app; with
+            # housekeeping off only requests use DB_PATH
+            app.DB_PATH = working_copy(seeds[size], copies[size].parent)
+            if args.storage == 'memory':
+                app.REPOSITORY = repository.MemoryRepository.from_sqlite(app.DB_PATH)
+            label = size if args.storage == 'sqlite' else f'{size}-mem'
+            server = start_server(app.app) if 'http' in modes else None
+            try:
+                for endpoint in endpoints:
+                    name = endpoint[0]
+                    for mode in modes:
+                        if mode == 'client':
+                            stats = run_test_client(app.app, endpoint, args.iterations, args.warmup)
+                        else:
+                            stats = run_http(app.app, server.server_port, endpoint, args.iterations, args.warmup)
+                        results[f'{label}/{mode}/{name}'] = stats
+                        print(f"{label:<5} {mode:<7} {name:<18} {stats['p50']:>9.2f} {stats['p95']:>9.2f} "
+                              f"{stats['p99']:>9.2f} {stats['rps']:>9.1f}")
+            finally:
+                if server:
+                    server.shutdown()
+    finally:
+        work.cleanup()
+
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2, sort_keys=True))
+
+    if args.save_baseline:
+        baseline = json.loads(args.baseline.read_text()) if args.baseline.exists() else {}
+        baseline.update(results)
+        args.baseline.write_text(json.dumps(baseline, indent=2, sort_keys=True) + '\n')
+        print(f"\n✓ Baseline saved to {args.baseline}")
+        return 0
+
+    if not args.baseline.exists():
+        print(f"\nNo baseline at {args.baseline} - run with --save-baseline to create one")
+        return 0
+
+    regressions = compare(results, json.loads(args.baseline.read_text()), args.threshold)
+    if regressions:
+        print(f"\n✗ {len(regressions)} regression(s) beyond {args.threshold:.0%}:")
+        for key, before, after in regressions:
+            print(f"  {key}: p95 {before:.2f}ms -> {after:.2f}ms")
+        return 1
+    print(f"\n✓ No regressions beyond {args.threshold:.0%}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Change Log for Delta Sync
+Triggers on the base tables record every insert, update and delete in the
+changes table (seq, table_name, op, row_id). Clients remember the last seq
+they saw and ask /api/changes?since=<seq> for what happened after it.
+
+The log is compacted as it is written: each row keeps only its latest
+entry, so the log never holds more entries than there are rows (plus
+tombstones), and since=0 doubles as a full snapshot. Tombstones for
+deleted rows are dropped after TOMBSTONE_DAYS; a client whose since is
+older than that horizon is told to reset and sync from 0.
+"""
+
+import os
+
+import clock
+
+TOMBSTONE_DAYS = int(os.environ.get('WATERSCRIBE_TOMBSTONE_DAYS', '30'))
+MAX_LIMIT = 5000
+
+TRACKED_TABLES = ('water_parameters', 'maintenance_log', 'scheduled_tasks', 'fish_inventory', 'task_completions')
+
+NOW_MS_SQL = "(CAST((julianday('now') - 2440587.5) * 86400000 AS INTEGER))"
+
+TRIGGERS = '''
+    CREATE TRIGGER IF NOT EXISTS {table}_changes_insert AFTER INSERT ON {table}
+    BEGIN
+        INSERT INTO changes (table_name, op, row_id, changed_at)
+        VALUES ('{table}', 'insert', NEW.id, {now});
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS {table}_changes_update AFTER UPDATE ON {table}
+    BEGIN
+        DELETE FROM changes WHERE table_name = '{table}' AND row_id = NEW.id;
+        INSERT INTO changes (table_name, op, row_id, changed_at)
+        VALUES ('{table}', 'update', NEW.id, {now});
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS {table}_changes_delete AFTER DELETE ON {table}
+    BEGIN
+        DELETE FROM changes WHERE table_name = '{table}' AND row_id = OLD.id;
+        INSERT INTO changes (table_name, op, row_id, changed_at)
+        VALUES ('{table}', 'delete', OLD.id, {now});
+    END;
+'''
+
+
+def install(c):
+    """Create the changes table and triggers (called from init_db)
+
+    When the table is first created, every existing row is logged as an
+    insert so a client syncing from 0 receives the full data set.
+    """
+    c.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'changes'")
+    is_new = c.fetchone() is None
+
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            table_name TEXT NOT NULL,
+            op TEXT NOT NULL,
+            row_id INTEGER NOT NULL,
+            changed_at INTEGER NOT NULL
+        ) STRICT
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_changes_table_row ON changes (table_name, row_id)')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_changes_tombstones ON changes (changed_at) WHERE op = 'delete'")
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS sync_state (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        ) STRICT
+    ''')
+
+    for table in TRACKED_TABLES:
+        for statement in TRIGGERS.format(table=table, now=NOW_MS_SQL).split('END;'):
+            if statement.strip():
+                c.execute(statement + 'END;')
+        if is_new:
+            c.execute(f'''
+                INSERT INTO changes (table_name, op, row_id, changed_at)
+                SELECT '{table}', 'insert', id, {NOW_MS_SQL} FROM {table} ORDER BY id
+            ''')
+
+
+def horizon(conn):
+    """Highest seq whose tombstones may have been compacted away"""
+    row = conn.execute("SELECT value FROM sync_state WHERE name = 'tombstone_horizon'").fetchone()
+    return row[0] if row else 0
+
+
+def changes_since(conn, since, limit):
+    """Changes after seq since, oldest first: (rows, last_seq, more)
+
+    rows are (seq, table_name, op, row_id). Call inside a read transaction
+    so the rows fetched for them afterwards come from the same snapshot.
+    """
+    rows = conn.execute('''
+        SELECT seq, table_name, op, row_id FROM changes
+        WHERE seq > ?
+        ORDER BY seq
+        LIMIT ?
+    ''', (since, limit + 1)).fetchall()
+    more = len(rows) > limit
+    rows = rows[:limit]
+    last_seq = rows[-1][0] if rows else since
+    return rows, last_seq, more
+
+
+def record_delete(conn, table, row_id):
+    """Log a delete the triggers cannot see (e.g. a row in the archive)"""
+    conn.execute('DELETE FROM main.changes WHERE table_name = ? AND row_id = ?', (table, row_id))
+    conn.execute('''
+        INSERT INTO main.changes (table_name, op, row_id, changed_at)
+        VALUES (?, 'delete', ?, ?)
+    ''', (table, row_id, clock.now_ms()))
+
+
+def compact_tombstones(conn, max_age_days=TOMBSTONE_DAYS):
+    """Drop tombstones older than max_age_days and advance the horizon
+
+    Returns the number removed. Runs in its own transaction.
+    """
+    cutoff = clock.now_ms() - max_age_days * clock.DAY_MS
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        newest = conn.execute('''
+            SELECT MAX(seq) FROM changes WHERE op = 'delete' AND changed_at < ?
+        ''', (cutoff,)).fetchone()[0]
+        if newest is None:
+            conn.execute('COMMIT')
+            return 0
+        removed = conn.execute('''
+            DELETE FROM changes WHERE op = 'delete' AND changed_at < ?
+        ''', (cutoff,)).rowcount
+        conn.execute('''
+            INSERT INTO sync_state (name, value) VALUES ('tombstone_horizon', ?)
+            ON CONFLICT (name) DO UPDATE SET value = MAX(value, excluded.value)
+        ''', (newest,))
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+    return removed
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Clock and Timestamp Helpers
+All time columns are stored as integer milliseconds since the Unix epoch
+(UTC). The API still speaks ISO 8601: values are rendered in the display
+time zone, and naive input strings are interpreted in it.
+
+Set WATERSCRIBE_TZ to an IANA zone name (e.g. America/Chicago) to pick the
+display zone; by default the server's local zone is used.
+"""
+
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+TIMEZONE = os.environ.get('WATERSCRIBE_TZ') or None
+DAY_MS = 86_400_000
+
+_zone = ZoneInfo(TIMEZONE) if TIMEZONE else None
+
+
+def now_ms():
+    """Current time as epoch milliseconds"""
+    return time.time_ns() // 1_000_000
+
+
+def to_ms(dt):
+    """Epoch milliseconds for a datetime; naive values are display-zone local"""
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=_zone) if _zone else dt.astimezone()
+    return round(dt.timestamp() * 1000)
+
+
+def from_ms(ms):
+    """Aware datetime in the display zone for epoch milliseconds"""
+    dt = datetime.fromtimestamp(ms / 1000, timezone.utc)
+    return dt.astimezone(_zone) if _zone else dt.astimezone()
+
+
+def local_midnight(ms, days=0):
+    """Epoch milliseconds of display-zone midnight for the day of ms, plus days"""
+    day = from_ms(ms).date() + timedelta(days=days)
+    return to_ms(datetime(day.year, day.month, day.day))
+
+
+def iso(ms):
+    """ISO 8601 string with UTC offset for epoch milliseconds"""
+    if ms % 1000:
+        return from_ms(ms).isoformat(timespec='milliseconds')
+    return from_ms(ms).isoformat(timespec='seconds')
+
+
+def parse(value):
+    """Epoch milliseconds for an ISO 8601 string or a number
+
+    Date-only strings mean local midnight. Raises ValueError for anything
+    that is not a valid timestamp.
+    """
+    if isinstance(value, bool):
+        raise ValueError('Invalid timestamp')
+    if isinstance(value, (int, float)):
+        return int(value)
+    if not isinstance(value, str) or not value.strip():
+        raise ValueError('Invalid timestamp')
+    return to_ms(datetime.fromisoformat(value.strip()))
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Response Compression
+gzip for JSON, HTML and other text responses when the client accepts it.
+
+Buffered responses are compressed once they pass a size threshold;
+streamed responses are compressed chunk by chunk with a sync flush so the
+client still sees the first rows immediately. Responses that carry an
+ETag (static pages) have their compressed bytes cached by path and ETag;
+an ETag alone only names a version of one resource, and two routes may
+share it.
+"""
+
+import os
+import threading
+import zlib
+from collections import OrderedDict
+
+from flask import request
+
+GZIP_ENABLED = os.environ.get('WATERSCRIBE_GZIP', '1') == '1'
+GZIP_MIN_SIZE = int(os.environ.get('WATERSCRIBE_GZIP_MIN_SIZE', '1024'))
+GZIP_LEVEL = int(os.environ.get('WATERSCRIBE_GZIP_LEVEL', '6'))
+
+COMPRESSIBLE_TYPES = frozenset({
+    'text/html',
+    'text/css',
+    'text/plain',
+    'text/javascript',
+    'application/javascript',
+    'application/json',
+    'application/manifest+json',
+    'image/svg+xml',
+})
+
+CACHE_ENTRIES = 32
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def gzip_bytes(data, level=GZIP_LEVEL):
+    """Compress a complete body into a gzip member"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    return compressor.compress(data) + compressor.flush()
+
+
+def _cached_gzip(key, data):
+    with _cache_lock:
+        body = _cache.get(key)
+        if body is not None:
+            _cache.move_to_end(key)
+            return body
+    body = gzip_bytes(data)
+    with _cache_lock:
+        _cache[key] = body
+        while len(_cache) > CACHE_ENTRIES:
+            _cache.popitem(last=False)
+    return body
+
+
+def _gzip_stream(iterable, level=GZIP_LEVEL):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    try:
+        for chunk in iterable:
+            if isinstance(chunk, str):
+                chunk = chunk.encode()
+            data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            if data:
+                yield data
+        yield compressor.flush()
+    finally:
+        close = getattr(iterable, 'close', None)
+        if close is not None:
+            close()
+
+
+def _should_compress(response):
+    if request.method == 'HEAD' or response.status_code != 200:
+        return False
+    if response.direct_passthrough or 'Content-Encoding' in response.headers:
+        return False
+    if response.mimetype not in COMPRESSIBLE_TYPES:
+        return False
+    return request.accept_encodings['gzip'] > 0
+
+
+def compress_response(response):
+    """after_request hook: gzip the body if the client and content allow it"""
+    if not _should_compress(response):
+        return response
+    response.vary.add('Accept-Encoding')
+
+    if response.is_streamed:
+        response.response = _gzip_stream(response.response)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < GZIP_MIN_SIZE:
+            return response
+        etag, weak = response.get_etag()
+        response.set_data(_cached_gzip((request.path, etag), data) if etag else gzip_bytes(data))
+        if etag:
+            # The gzip body is a different representation; a weak ETag still
+            # matches If-None-Match so conditional requests keep working
+            response.set_etag(etag, weak=True)
+
+    response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+
+def init_app(app):
+    """Register the compression hook when enabled"""
+    if GZIP_ENABLED:
+        app.after_request(compress_response)
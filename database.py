@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""
+Database Connections
+Writes go through one writer thread per process and database file. Each
+request hands its write to the thread as a function of a connection and
+waits for the result; jobs that arrive while the previous transaction is
+committing are run together in the next one (group commit), each inside
+its own SAVEPOINT so a failing job only rolls back its own changes. A
+burst of POSTs therefore costs one commit instead of one lock fight each.
+
+Reads use a small pool of read-only (mode=ro) connections. The database is
+switched to WAL mode, so readers never wait for the writer.
+
+Other processes (extra gunicorn workers, cron jobs) still take SQLite's
+write lock in turn; the writer waits for it with a busy timeout and retries
+a batch that still finds the database locked.
+"""
+
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+
+import metrics
+import profiling
+import retention
+
+READER_POOL_SIZE = int(os.environ.get('WATERSCRIBE_READERS', '8'))
+MAX_BATCH = int(os.environ.get('WATERSCRIBE_WRITE_BATCH', '64'))
+
+BUSY_TIMEOUT = 10.0
+LOCKED_RETRIES = 3
+
+_lock = threading.Lock()
+_pid = None
+_readers = {}   # db path -> ReaderPool
+_writers = {}   # db path -> Writer
+
+
+class PooledConnection(profiling.connection_factory):
+    """Read-only connection that goes back to its pool when closed"""
+
+    pool = None
+
+    def close(self):
+        if self.pool is None:
+            super().close()
+        else:
+            self.pool.release(self)
+
+
+class ReaderPool:
+    """Read-only connections to one database, reused between requests"""
+
+    def __init__(self, db_path, size=READER_POOL_SIZE):
+        self.uri = f'file:{db_path}?mode=ro'
+        self.idle = queue.LifoQueue(maxsize=size)
+
+    def connect(self):
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            pass
+        conn = sqlite3.connect(self.uri, uri=True, timeout=BUSY_TIMEOUT,
+                               factory=PooledConnection, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.pool = self
+        return conn
+
+    def release(self, conn):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            conn.row_factory = sqlite3.Row
+            self.idle.put_nowait(conn)
+        except (sqlite3.Error, queue.Full):
+            conn.pool = None
+            conn.close()
+
+
+class Writer:
+    """Runs write jobs for one database on a dedicated thread"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.jobs = queue.Queue()
+        self.thread = threading.Thread(target=self._loop, name='db-writer', daemon=True)
+        self.thread.start()
+
+    def run(self, job):
+        """Run job(conn) in the next group transaction and return its result
+
+        The job must not commit or roll back; its changes are committed with
+        the rest of the batch before run() returns. An exception raised by
+        the job undoes only its own changes and is re-raised here.
+        """
+        return self.submit(job).result()
+
+    def submit(self, job, profiled=False):
+        """Queue job(conn) without waiting; returns a Future for its result
+
+        With profiled, the job's SQL is timed and the future's profile set
+        to its RequestProfile once it has run.
+        """
+        future = Future()
+        future.profile = None
+        self.jobs.put((job, future, profiled))
+        return future
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=BUSY_TIMEOUT, isolation_level=None,
+                               factory=profiling.connection_factory)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode = WAL')
+        return conn
+
+    def _loop(self):
+        conn = None
+        while True:
+            batch = [self.jobs.get()]
+            while len(batch) < MAX_BATCH:
+                try:
+                    batch.append(self.jobs.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                if conn is None:
+                    conn = self._connect()
+                self._commit_batch(conn, batch)
+            except Exception as e:
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                if conn is not None and conn.in_transaction:
+                    try:
+                        conn.execute('ROLLBACK')
+                    except sqlite3.Error:
+                        conn.close()
+                        conn = None
+
+    def _commit_batch(self, conn, batch):
+        # ATTACH is not allowed inside a transaction, so do it up front for
+        # jobs that reach into the archive (it appears once retention runs)
+        retention.attach_archive(conn, self.db_path)
+
+        for attempt in range(LOCKED_RETRIES):
+            try:
+                conn.execute('BEGIN IMMEDIATE')
+                break
+            except sqlite3.OperationalError as e:
+                # Another process held the lock for the whole busy timeout
+                if 'locked' not in str(e) or attempt == LOCKED_RETRIES - 1:
+                    raise
+                metrics.record_db_error('retry')
+                time.sleep(0.05 * (attempt + 1))
+
+        outcomes = []
+        for job, future, profiled in batch:
+            if not future.set_running_or_notify_cancel():
+                continue
+            conn.execute('SAVEPOINT job')
+            try:
+                with profiling.charging(profiling.RequestProfile() if profiled else None) as profile:
+                    future.profile = profile
+                    result = job(conn)
+            except Exception as e:
+                conn.execute('ROLLBACK TO job')
+                conn.execute('RELEASE job')
+                outcomes.append((future, None, e))
+            else:
+                conn.execute('RELEASE job')
+                outcomes.append((future, result, None))
+        conn.execute('COMMIT')
+
+        # Only report success once the batch is durable
+        for future, result, error in outcomes:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+
+def _registry():
+    """Per-process pools; a forked worker starts with empty ones"""
+    global _pid
+    if _pid != os.getpid():
+        _pid = os.getpid()
+        _readers.clear()
+        _writers.clear()
+
+
+def read(db_path):
+    """A pooled read-only connection; close() returns it to the pool"""
+    key = str(db_path)
+    with _lock:
+        _registry()
+        pool = _readers.get(key)
+        if pool is None:
+            pool = _readers[key] = ReaderPool(key)
+    return pool.connect()
+
+
+def _writer(db_path):
+    key = str(db_path)
+    with _lock:
+        _registry()
+        writer = _writers.get(key)
+        if writer is None:
+            writer = _writers[key] = Writer(key)
+    return writer
+
+
+def write(db_path, job):
+    """Run job(conn) on the database's writer thread; see Writer.run
+
+    For a profiled request the job's SQL, and the time it waited for the
+    writer, are added to the request's profile.
+    """
+    profile = profiling.current_profile()
+    if profile is None:
+        return _writer(db_path).run(job)
+    submitted = time.perf_counter()
+    future = _writer(db_path).submit(job, profiled=True)
+    try:
+        return future.result()
+    finally:
+        if future.profile is not None:
+            profile.add_job(future.profile, future.profile.started - submitted)
+
+
+def submit(db_path, job):
+    """Queue job(conn) on the writer thread without waiting; see Writer.submit"""
+    return _writer(db_path).submit(job)
@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+"""
+Synthetic Data Generator
+Fills a WaterScribe database with realistic, reproducible data for load
+testing, capacity planning and manual QA.
+
+Readings follow a diurnal temperature and pH swing, start with a fishless
+cycle (ammonia -> nitrite -> nitrate), and nitrate builds up between water
+changes. Every water change is also written to the maintenance log.
+
+Usage:
+    python3 generate_data.py --db synthetic.db --years 3
+    python3 generate_data.py --db big.db --readings 20000000 --interval 1
+"""
+
+import argparse
+import math
+import queue
+import random
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import clock
+
+CHUNK_SIZE = 100_000
+CYCLE_DAYS = 45
+NOISE_TABLE_SIZE = 65_537
+
+# (task_type, mean interval in days, description)
+MAINTENANCE_TYPES = [
+    ('Water Change', 7, '{pct}% water change, gravel vacuumed'),
+    ('Filter Cleaning', 14, 'Rinsed filter media in tank water'),
+    ('Glass Cleaning', 7, 'Scraped algae from glass'),
+    ('Plant Trimming', 21, 'Trimmed stem plants and removed dead leaves'),
+    ('Equipment Check', 30, 'Checked heater, filter flow and air pump'),
+]
+
+TASK_TEMPLATES = [
+    ('Water Change 25%', 7, 'Perform 25% water change. Vacuum substrate.'),
+    ('Weekly Water Test', 7, 'Test ammonia, nitrite, nitrate, pH, KH.'),
+    ('Clean Filter Media', 14, 'Rinse filter media in old tank water.'),
+    ('Check Equipment', 7, 'Verify heater temperature and filter flow.'),
+    ('Algae Cleaning', 7, 'Clean algae from glass and decorations.'),
+    ('Trim Plants', 21, 'Trim stem plants and replant tops.'),
+    ('Dose Fertilizer', 3, 'Dose liquid fertilizer per label.'),
+    ('Replace Carbon', 30, 'Swap chemical filter media.'),
+]
+
+SPECIES = [
+    ('Corydoras sterbai', 'Sterbai Cory'),
+    ('Celestichthys margaritatus', 'Celestial Pearl Danio'),
+    ('Hyphessobrycon amandae', 'Ember Tetra'),
+    ('Paracheirodon innesi', 'Neon Tetra'),
+    ('Poecilia reticulata', 'Guppy'),
+    ('Trigonostigma heteromorpha', 'Harlequin Rasbora'),
+    ('Otocinclus vittatus', 'Otocinclus'),
+    ('Neocaridina davidi', 'Cherry Shrimp'),
+    ('Caridina multidentata', 'Amano Shrimp'),
+    ('Betta splendens', 'Betta'),
+    ('Apistogramma cacatuoides', 'Cockatoo Dwarf Cichlid'),
+    ('Pangio kuhlii', 'Kuhli Loach'),
+]
+
+
+def default_counts(years, interval_minutes):
+    """Row counts for the given time span at the usual event rates"""
+    days = years * 365
+    return {
+        'readings': int(days * 1440 / interval_minutes),
+        'maintenance': int(days * sum(1 / freq for _, freq, _ in MAINTENANCE_TYPES)),
+        'tasks': len(TASK_TEMPLATES),
+        'fish': len(SPECIES),
+    }
+
+
+def _maintenance_events(rng, span_minutes, count):
+    """Maintenance events as (minute offset, task_type, description), sorted by time"""
+    natural = sum(span_minutes / (freq * 1440) for _, freq, _ in MAINTENANCE_TYPES)
+    scale = count / natural if natural else 1.0
+    events = []
+    for task_type, freq, description in MAINTENANCE_TYPES:
+        interval = freq * 1440 / scale
+        t = rng.uniform(0, interval)
+        while t < span_minutes:
+            events.append((int(t), task_type, description.format(pct=rng.choice((20, 25, 30, 40, 50)))))
+            t += interval * rng.uniform(0.8, 1.2)
+    if len(events) > count:
+        events = rng.sample(events, count)
+    events.sort()
+    return events
+
+
+def _reading_rows(rng, start_ms, count, interval_minutes, water_changes):
+    """Yield water_parameters rows in time order, starting at local midnight"""
+    slots_per_day = 1440 // interval_minutes
+    interval_ms = interval_minutes * 60_000
+    # Diurnal swing: warmest mid-afternoon, pH rises while the lights are on
+    temp_swing = [1.2 * math.sin(2 * math.pi * (s * interval_minutes / 1440 - 0.375))
+                  for s in range(slots_per_day)]
+    ph_swing = [0.15 * math.sin(2 * math.pi * (s * interval_minutes / 1440 - 0.3))
+                for s in range(slots_per_day)]
+    # Gaussian noise is drawn once and replayed; far cheaper than gauss() per value
+    noise = [rng.gauss(0, 1) for _ in range(NOISE_TABLE_SIZE)]
+    n = 0
+
+    base_temp = 78.0
+    nitrate = 0.0
+    nitrate_per_reading = 1.5 * interval_minutes / 1440
+    # Water changes keyed by reading index: reading -> percent changed
+    wc_at = {}
+    for minute, pct in water_changes:
+        wc_at[-(-minute // interval_minutes)] = pct
+    temp_dip = 0.0
+
+    i = 0
+    while i < count:
+        for slot in range(min(slots_per_day, count - i)):
+            pct = wc_at.get(i)
+            if pct:
+                nitrate *= 1 - pct / 100
+                temp_dip = -1.5 * pct / 50
+
+            days_in = i * interval_minutes / 1440
+            if days_in < CYCLE_DAYS:
+                # Fishless cycle: dosed ammonia falls as bacteria establish,
+                # nitrite peaks around day 20, nitrate climbs afterwards
+                ammonia = max(0.0, 3.0 / (1 + math.exp((days_in - 18) / 3)) + 0.05 * noise[n])
+                nitrite = max(0.0, 4.5 * math.exp(-((days_in - 20) / 6) ** 2) + 0.05 * noise[n + 1])
+                nitrate = max(nitrate, 25 / (1 + math.exp(-(days_in - 26) / 4)))
+            else:
+                ammonia = abs(0.02 * noise[n])
+                nitrite = abs(0.01 * noise[n + 1])
+                nitrate += nitrate_per_reading
+            base_temp += 0.01 * noise[n + 2] + (78.0 - base_temp) * 0.01
+
+            yield (
+                start_ms + i * interval_ms,
+                round(base_temp + temp_swing[slot] + temp_dip + 0.1 * noise[n + 3], 1),
+                round(7.2 + ph_swing[slot] - nitrate * 0.004 + 0.03 * noise[n + 4], 2),
+                round(ammonia, 2),
+                round(nitrite, 2),
+                round(abs(nitrate + 0.5 * noise[n + 5]), 1),
+                None,
+            )
+
+            n += 6
+            if n >= NOISE_TABLE_SIZE - 6:
+                n = int(rng.random() * 997)
+            if temp_dip:
+                temp_dip = temp_dip * 0.9 if temp_dip < -0.01 else 0.0
+            i += 1
+
+
+def _chunks(rows):
+    chunk = []
+    append = chunk.append
+    for row in rows:
+        append(row)
+        if len(chunk) >= CHUNK_SIZE:
+            yield chunk
+            chunk = []
+            append = chunk.append
+    if chunk:
+        yield chunk
+
+
+def _insert_chunked(conn, sql, rows, progress=None, label=''):
+    """executemany in fixed-size chunks while the next chunk is generated
+
+    sqlite3 releases the GIL while stepping statements, so building rows on
+    a producer thread overlaps Python work with SQLite's B-tree inserts.
+    """
+    pending = queue.Queue(maxsize=4)
+
+    def produce():
+        try:
+            for chunk in _chunks(rows):
+                pending.put(chunk)
+        finally:
+            pending.put(None)
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    total = 0
+    while True:
+        chunk = pending.get()
+        if chunk is None:
+            break
+        conn.executemany(sql, chunk)
+        total += len(chunk)
+        if progress and total % (CHUNK_SIZE * 10) == 0:
+            progress(f"  {label}: {total:,} rows")
+    producer.join()
+    return total
+
+
+def generate(db_path, readings, maintenance=None, tasks=None, fish=None,
+             interval_minutes=15, seed=1, end=None, progress=print):
+    """Write a full synthetic dataset into db_path using the app's schema"""
+    from app import init_db
+
+    rng = random.Random(seed)
+    end = end or datetime.now().replace(second=0, microsecond=0)
+    span_minutes = readings * interval_minutes
+    start = (end - timedelta(minutes=span_minutes)).replace(hour=0, minute=0)
+    start_ms = clock.to_ms(start)
+    end_ms = clock.to_ms(end)
+    if maintenance is None:
+        maintenance = int(span_minutes / 1440 * sum(1 / f for _, f, _ in MAINTENANCE_TYPES))
+    tasks = len(TASK_TEMPLATES) if tasks is None else tasks
+    fish = len(SPECIES) if fish is None else fish
+
+    init_db(db_path)
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    previous_journal = conn.execute('PRAGMA journal_mode').fetchone()[0]
+    # Relaxed for the bulk load only; a crash mid-load just means re-running
+    conn.execute('PRAGMA journal_mode = OFF')
+    conn.execute('PRAGMA synchronous = OFF')
+    conn.execute('PRAGMA locking_mode = EXCLUSIVE')
+    conn.execute('PRAGMA temp_store = MEMORY')
+    conn.execute('PRAGMA cache_size = -262144')
+
+    events = _maintenance_events(rng, span_minutes, maintenance)
+    water_changes = [(t, int(desc.split('%')[0])) for t, kind, desc in events if kind == 'Water Change']
+
+    counts = {}
+    conn.execute('BEGIN')
+    counts['readings'] = _insert_chunked(conn, '''
+        INSERT INTO water_parameters (timestamp, temperature, ph, ammonia, nitrite, nitrate, notes)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', _reading_rows(rng, start_ms, readings, interval_minutes, water_changes), progress, 'readings')
+
+    counts['maintenance'] = _insert_chunked(conn, '''
+        INSERT INTO maintenance_log (timestamp, task_type, description, completed)
+        VALUES (?, ?, ?, 1)
+    ''', ((start_ms + t * 60_000, kind, desc) for t, kind, desc in events), progress, 'maintenance')
+
+    def task_rows():
+        midnight = clock.to_ms(end.replace(hour=0, minute=0))
+        for i in range(tasks):
+            name, freq, description = TASK_TEMPLATES[i % len(TASK_TEMPLATES)]
+            if i >= len(TASK_TEMPLATES):
+                name = f'{name} #{i // len(TASK_TEMPLATES) + 1}'
+            if rng.random() < 0.1:
+                due = midnight + rng.randint(1, 60) * clock.DAY_MS
+                yield (name, None, None, due, description, 0, due)
+            else:
+                last = end_ms - int(rng.uniform(0, freq * 1.5) * clock.DAY_MS)
+                yield (name, freq, last, last + freq * clock.DAY_MS, description, 1, None)
+
+    counts['tasks'] = _insert_chunked(conn, '''
+        INSERT INTO scheduled_tasks (task_name, frequency_days, last_completed, next_due,
+                                     description, is_recurring, specific_date)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', task_rows())
+
+    def fish_rows():
+        for i in range(fish):
+            species, common = SPECIES[i % len(SPECIES)]
+            added_days = CYCLE_DAYS + rng.uniform(0, max(1, span_minutes / 1440 - CYCLE_DAYS))
+            yield (species, common, rng.choice((1, 1, 2, 3, 6, 8, 10, 12, 25)),
+                   start_ms + int(added_days * clock.DAY_MS), f'Group {i + 1}' if i >= len(SPECIES) else None)
+
+    counts['fish'] = _insert_chunked(conn, '''
+        INSERT INTO fish_inventory (species, common_name, quantity, added_date, notes)
+        VALUES (?, ?, ?, ?, ?)
+    ''', fish_rows())
+    conn.execute('COMMIT')
+
+    conn.execute('PRAGMA synchronous = FULL')
+    conn.execute(f'PRAGMA journal_mode = {previous_journal}')
+    conn.execute('PRAGMA locking_mode = NORMAL')
+    conn.execute('ANALYZE')
+    conn.close()
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate synthetic WaterScribe data')
+    parser.add_argument('--db', type=Path, required=True, help='database file to create')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--years', type=float, default=1.0, help='span of readings (default 1)')
+    parser.add_argument('--interval', type=int, default=15, help='minutes between readings (default 15)')
+    parser.add_argument('--readings', type=int, help='exact reading count (overrides --years)')
+    parser.add_argument('--maintenance', type=int, help='maintenance log rows (default: realistic rate)')
+    parser.add_argument('--tasks', type=int, help='scheduled task rows')
+    parser.add_argument('--fish', type=int, help='fish inventory rows')
+    parser.add_argument('--end', type=datetime.fromisoformat,
+                        help='timestamp of the newest reading (default: now); pin for identical output')
+    parser.add_argument('--force', action='store_true', help='overwrite an existing database')
+    args = parser.parse_args()
+
+    if 1440 % args.interval:
+        parser.error('--interval must divide evenly into a day')
+    if args.db.exists():
+        if not args.force:
+            print(f"Error: {args.db} already exists (use --force to overwrite)")
+            return 1
+        args.db.unlink()
+
+    readings = args.readings or default_counts(args.years, args.interval)['readings']
+    print(f"Generating {readings:,} readings into {args.db} (seed {args.seed})...")
+    started = time.perf_counter()
+    counts = generate(args.db, readings, args.maintenance, args.tasks, args.fish,
+                      interval_minutes=args.interval, seed=args.seed, end=args.end)
+    elapsed = time.perf_counter() - started
+    total = sum(counts.values())
+    print()
+    for table, count in counts.items():
+        print(f"✓ {table}: {count:,} rows")
+    print(f"✓ {total:,} rows in {elapsed:.1f}s ({total / elapsed:,.0f} rows/s)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
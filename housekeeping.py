@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+Database Housekeeping
+Background job that keeps the SQLite file compact and the query planner's
+statistics fresh: moves readings past the retention window to the archive
+(when retention is configured), drops expired change log tombstones and
+idempotency keys, returns free pages with incremental_vacuum, then runs
+PRAGMA optimize and (less often) a bounded ANALYZE.
+
+Vacuuming happens a few hundred pages at a time, each step in its own short
+write transaction with a pause in between, so request writes are never
+stuck behind it. If the database is busy the job gives up until next time.
+
+Every worker process starts the thread; a lock file next to the database
+makes sure only one of them actually runs a pass per interval.
+
+Usage (run a pass now, e.g. from cron):
+    python3 housekeeping.py [--db aquarium.db]
+"""
+
+import argparse
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+import changelog
+import idempotency
+import repository
+import retention
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows; every worker runs the job
+    fcntl = None
+
+HOUSEKEEPING_ENABLED = os.environ.get('WATERSCRIBE_HOUSEKEEPING', '1') == '1'
+HOUSEKEEPING_INTERVAL = float(os.environ.get('WATERSCRIBE_HOUSEKEEPING_INTERVAL', '3600'))
+ANALYZE_INTERVAL = float(os.environ.get('WATERSCRIBE_ANALYZE_INTERVAL', '86400'))
+
+STARTUP_DELAY = 60.0
+VACUUM_STEP_PAGES = 256
+VACUUM_STEP_PAUSE = 0.05
+ANALYSIS_LIMIT = 1000
+
+_started_pid = None
+_start_lock = threading.Lock()
+
+
+def _read_state(lock_file):
+    """Last run times stored in the lock file as 'pass analyze'"""
+    lock_file.seek(0)
+    try:
+        last_pass, last_analyze = (float(v) for v in lock_file.read().split())
+    except ValueError:
+        return 0.0, 0.0
+    return last_pass, last_analyze
+
+
+def _write_state(lock_file, last_pass, last_analyze):
+    lock_file.seek(0)
+    lock_file.truncate()
+    lock_file.write(f'{last_pass} {last_analyze}')
+    lock_file.flush()
+
+
+def incremental_vacuum(conn, step_pages=VACUUM_STEP_PAGES):
+    """Release free pages in small steps; returns the number of pages freed"""
+    if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+        return 0
+    initial = free = conn.execute('PRAGMA freelist_count').fetchone()[0]
+    while free:
+        # execute() would step this pragma only once, releasing one page;
+        # executescript runs it to completion
+        conn.executescript(f'PRAGMA incremental_vacuum({min(free, step_pages)});')
+        time.sleep(VACUUM_STEP_PAUSE)
+        remaining = conn.execute('PRAGMA freelist_count').fetchone()[0]
+        if remaining >= free:
+            break
+        free = remaining
+    return initial - free
+
+
+def run_once(db_path, analyze=True):
+    """One housekeeping pass; returns a summary dict"""
+    summary = {'archived_rows': 0, 'compacted_tombstones': 0, 'expired_keys': 0, 'freed_pages': 0,
+               'optimized': False, 'analyzed': False}
+    if retention.RETENTION_DAYS > 0:
+        summary['archived_rows'] = retention.archive_old_readings(db_path)
+    # Short busy timeout: requests have priority, the job can wait an hour
+    conn = sqlite3.connect(db_path, timeout=1.0, isolation_level=None)
+    try:
+        summary['compacted_tombstones'] = changelog.compact_tombstones(conn)
+        summary['expired_keys'] = repository.expire_idempotency_keys(conn, idempotency.TTL_MS)
+        summary['freed_pages'] = incremental_vacuum(conn)
+        conn.execute('PRAGMA optimize')
+        summary['optimized'] = True
+        if analyze:
+            conn.execute(f'PRAGMA analysis_limit = {ANALYSIS_LIMIT}')
+            conn.execute('ANALYZE')
+            summary['analyzed'] = True
+    finally:
+        conn.close()
+    return summary
+
+
+def run_if_due(db_path, now=None):
+    """Run a pass unless another worker has done so within the interval"""
+    now = now or time.time()
+    lock_path = Path(f'{db_path}.housekeeping')
+    with open(lock_path, 'a+') as lock_file:
+        if fcntl is not None:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return None
+        last_pass, last_analyze = _read_state(lock_file)
+        if now - last_pass < HOUSEKEEPING_INTERVAL:
+            return None
+        analyze = now - last_analyze >= ANALYZE_INTERVAL
+        try:
+            summary = run_once(db_path, analyze=analyze)
+        except sqlite3.OperationalError:
+            # Busy or locked: note the attempt and try again next interval
+            summary = None
+        _write_state(lock_file, now, now if analyze and summary else last_analyze)
+        return summary
+
+
+def _loop(db_path):
+    time.sleep(STARTUP_DELAY)
+    while True:
+        try:
+            run_if_due(db_path)
+        except (OSError, sqlite3.Error):
+            pass
+        time.sleep(min(HOUSEKEEPING_INTERVAL, 300))
+
+
+def start(db_path):
+    """Start the housekeeping thread for this process (once per pid)"""
+    global _started_pid
+    with _start_lock:
+        if _started_pid == os.getpid():
+            return
+        _started_pid = os.getpid()
+    threading.Thread(target=_loop, args=(db_path,), name='housekeeping', daemon=True).start()
+
+
+def init_app(app, db_path):
+    """Start the job with the first request, so forked workers each get one"""
+    if HOUSEKEEPING_ENABLED:
+        app.before_request(lambda: start(db_path))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run one database housekeeping pass.')
+    parser.add_argument('--db', default='aquarium.db', help='database path (default: aquarium.db)')
+    args = parser.parse_args()
+
+    if not Path(args.db).exists():
+        print(f"Error: Database not found at {args.db}")
+        raise SystemExit(1)
+
+    print(f"Running housekeeping on {args.db}...")
+    started = time.perf_counter()
+    result = run_once(args.db)
+    print(f"✓ {result['freed_pages']} free pages released")
+    print("✓ PRAGMA optimize")
+    print("✓ ANALYZE")
+    print(f"Done in {time.perf_counter() - started:.1f}s")
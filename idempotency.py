@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+Idempotency Keys
+Remembers the response to each client-supplied key so a write that is
+sent twice (a flaky mobile connection retrying a POST, an offline
+submission replayed after a reconnect) is only executed once; the repeat
+gets the stored response instead.
+
+Any POST or PUT may carry an Idempotency-Key header; /api/sync passes the
+key of each queued request. The key row is inserted by the request's first
+write job, in the same transaction as the change itself, so a committed
+write always has its key and a concurrent duplicate fails on the primary
+key instead of writing twice. The response is stored afterwards without
+making the request wait for another commit.
+
+Recent responses are also kept in a small per-process LRU cache, and keys
+in flight in this process are tracked in memory, so most repeats never
+touch the database. Keys expire after WATERSCRIBE_IDEMPOTENCY_TTL hours
+(default 24); the housekeeping job deletes them in batches.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+
+from flask import g, has_app_context, jsonify, request
+
+import clock
+
+MAX_KEY_LENGTH = 255
+TTL_MS = int(float(os.environ.get('WATERSCRIBE_IDEMPOTENCY_TTL', '24')) * 3_600_000)
+CACHE_SIZE = 1024
+METHODS = ('POST', 'PUT')
+
+_lock = threading.Lock()
+_cache = OrderedDict()  # key -> (method, path, status, body, created)
+_in_flight = set()
+
+
+class KeyConflict(Exception):
+    """The key is in use by a different request, or still running"""
+
+    def __init__(self, message, status):
+        super().__init__(message)
+        self.status = status
+
+
+def in_progress():
+    return KeyConflict('A request with this idempotency key is still in progress', 409)
+
+
+def valid_key(key):
+    return isinstance(key, str) and 0 < len(key) <= MAX_KEY_LENGTH
+
+
+def _check(entry, method, path):
+    """(status, body) from a stored (method, path, status, body, created)
+
+    None if the entry has expired. Raises KeyConflict if it belongs to
+    another request or its first attempt has not finished yet.
+    """
+    if entry is None or entry[4] < clock.now_ms() - TTL_MS:
+        return None
+    if entry[:2] != (method, path):
+        raise KeyConflict('Idempotency key was already used for a different request', 422)
+    if entry[2] is None:
+        raise in_progress()
+    return entry[2], entry[3]
+
+
+def stored_response(repo, key, method, path):
+    """Stored (status, body) for a completed key, or None if the key is new
+
+    Checks the in-memory cache and the keys running in this process before
+    the repository. Raises KeyConflict like _check().
+    """
+    with _lock:
+        entry = _cache.get(key)
+        if entry is not None:
+            _cache.move_to_end(key)
+        running = key in _in_flight
+    stored = _check(entry, method, path)
+    if stored is not None:
+        return stored
+    if running:
+        raise in_progress()
+    return _check(repo.idempotency_key(key), method, path)
+
+
+def begin(key, method, path):
+    """Mark key as running for the current request
+
+    The first write job passed through bind() afterwards reserves it in
+    the repository. Raises KeyConflict if the key is already running here.
+    """
+    with _lock:
+        if key in _in_flight:
+            raise in_progress()
+        _in_flight.add(key)
+    g._idempotency = {'key': key, 'method': method, 'path': path, 'reserved': False}
+
+
+def pending():
+    """The current request's key state, or None"""
+    return g.get('_idempotency') if has_app_context() else None
+
+
+def bind(job, reserve):
+    """Wrap a write job so it also reserves the current request's key
+
+    reserve(target, key, method, path) runs first with the job's argument
+    and returns False if the key is taken.
+    """
+    state = pending()
+    if state is None or state['reserved']:
+        return job
+
+    def reserve_and_run(target):
+        if not reserve(target, state['key'], state['method'], state['path']):
+            raise in_progress()
+        result = job(target)
+        state['reserved'] = True
+        return result
+    return reserve_and_run
+
+
+def finish(repo, status, body):
+    """Record the current request's response (or forget its key on a 5xx)"""
+    state = g.pop('_idempotency', None)
+    if state is None:
+        return
+    key = state['key']
+    if status >= 500:
+        if state['reserved']:
+            repo.release_key(key)
+    else:
+        repo.save_response(key, state['method'], state['path'], status, body)
+        with _lock:
+            _cache[key] = (state['method'], state['path'], status, body, clock.now_ms())
+            _cache.move_to_end(key)
+            while len(_cache) > CACHE_SIZE:
+                _cache.popitem(last=False)
+    with _lock:
+        _in_flight.discard(key)
+
+
+def abandon(repo):
+    """Forget the current request's key after an unhandled error"""
+    finish(repo, 500, None)
+
+
+def conflict(e):
+    """Error response for a KeyConflict; nothing is recorded for the key"""
+    state = g.pop('_idempotency', None)
+    if state is not None:
+        with _lock:
+            _in_flight.discard(state['key'])
+    return jsonify({'success': False, 'error': str(e)}), e.status
+
+
+def init_app(app, get_repository, exclude=()):
+    """Honour the Idempotency-Key header on POST and PUT requests
+
+    get_repository() returns the repository for the current request.
+    Endpoints in exclude (e.g. /api/sync, which handles keys per queued
+    request) ignore the header.
+    """
+    def start():
+        key = request.headers.get('Idempotency-Key')
+        if key is None or request.method not in METHODS or request.endpoint in exclude:
+            return None
+        if not valid_key(key):
+            return jsonify({'success': False, 'error': 'Invalid Idempotency-Key header'}), 400
+        stored = stored_response(get_repository(), key, request.method, request.path)
+        if stored is not None:
+            response = jsonify(stored[1])
+            response.status_code = stored[0]
+            response.headers['Idempotent-Replayed'] = 'true'
+            return response
+        begin(key, request.method, request.path)
+        return None
+
+    def record(response):
+        if '_idempotency' in g:
+            finish(get_repository(), response.status_code, response.get_json(silent=True))
+        return response
+
+    def cleanup(exception):
+        if '_idempotency' in g:
+            abandon(get_repository())
+
+    app.register_error_handler(KeyConflict, conflict)
+    app.before_request(start)
+    app.after_request(record)
+    app.teardown_request(cleanup)
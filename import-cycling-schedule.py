@@ -6,9 +6,11 @@ This script adds all the cycling tasks and schedule to the WaterScribe
 
 import sqlite3
 import sys
-from datetime import datetime, timedelta
+from datetime import timedelta
 from pathlib import Path
 
+import clock
+
 # Find the database
 db_path = Path.home() / 'waterscribe' / 'aquarium.db'
 
@@ -20,12 +22,13 @@ if not db_path.exists():
 def add_scheduled_task(conn, task_name, frequency_days, description):
     """Add a scheduled task to the database"""
     c = conn.cursor()
-    next_due = datetime.now() + timedelta(days=frequency_days)
+    # Now in the display zone (WATERSCRIBE_TZ), not the host's
+    next_due = clock.from_ms(clock.now_ms()) + timedelta(days=frequency_days)
     
     c.execute('''
         INSERT INTO scheduled_tasks (task_name, frequency_days, next_due, description, active)
         VALUES (?, ?, ?, ?, ?)
-    ''', (task_name, frequency_days, next_due.isoformat(), description, 1))
+    ''', (task_name, frequency_days, clock.to_ms(next_due), description, 1))
     
     print(f"✓ Added: {task_name} (every {frequency_days} days)")
 
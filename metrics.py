@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+"""
+Prometheus Metrics
+Per-route latency histograms, status counters and database health gauges
+served in the Prometheus text format at /metrics.
+
+Each worker process keeps its counters in memory and periodically writes a
+snapshot to its own file in WATERSCRIBE_METRICS_DIR (default: aquarium.db.metrics
+next to the database, so a primary and standby on one host stay apart). A
+scrape merges every snapshot in that directory, so totals are correct no
+matter which worker answers. Clear the directory when the service starts
+(see waterscribe.service).
+
+/metrics answers only clients in WATERSCRIBE_METRICS_ALLOW, a comma
+separated list of addresses or networks (default: loopback only), so an
+install serving port 5000 directly does not expose it; others get 403.
+"""
+
+import atexit
+import ipaddress
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from flask import Response, abort, g, got_request_exception, request
+
+import clock
+import ratelimit
+import replication
+
+METRICS_ENABLED = os.environ.get('WATERSCRIBE_METRICS', '1') == '1'
+FLUSH_INTERVAL = float(os.environ.get('WATERSCRIBE_METRICS_FLUSH_INTERVAL', '1.0'))
+METRICS_ALLOW = os.environ.get('WATERSCRIBE_METRICS_ALLOW', '127.0.0.1,::1')
+
+# Upper bounds in seconds; +Inf is implied
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_lock = threading.Lock()
+_requests = {}      # (route, method, status) -> count
+_latency = {}       # (route, method) -> [bucket counts..., +Inf count, sum]
+_db_errors = {}     # kind -> count
+_last_flush = 0.0
+_snapshot_path = None
+_metrics_dir = None   # set by init_app()
+
+
+def _observe(route, method, status, duration):
+    global _last_flush
+    with _lock:
+        key = (route, method, str(status))
+        _requests[key] = _requests.get(key, 0) + 1
+
+        series = _latency.get((route, method))
+        if series is None:
+            series = _latency[(route, method)] = [0] * (len(LATENCY_BUCKETS) + 1) + [0.0]
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if duration <= bound:
+                series[i] += 1
+                break
+        else:
+            series[len(LATENCY_BUCKETS)] += 1
+        series[-1] += duration
+
+        due = time.monotonic() - _last_flush >= FLUSH_INTERVAL
+    if due:
+        flush()
+
+
+def record_db_error(kind):
+    """Count a database busy/locked event (kind is 'locked', 'busy' or 'retry')"""
+    with _lock:
+        _db_errors[kind] = _db_errors.get(kind, 0) + 1
+
+
+def flush():
+    """Write this process's counters to its snapshot file"""
+    global _last_flush, _snapshot_path
+    with _lock:
+        _last_flush = time.monotonic()
+        snapshot = {
+            'requests': [[*key, count] for key, count in _requests.items()],
+            'latency': [[*key, series] for key, series in _latency.items()],
+            'db_errors': dict(_db_errors),
+        }
+    if _metrics_dir is None:
+        return
+    try:
+        _metrics_dir.mkdir(parents=True, exist_ok=True)
+        if _snapshot_path is None:
+            # pid plus start time so a recycled pid never overwrites old totals
+            _snapshot_path = _metrics_dir / f'{os.getpid()}-{time.time_ns()}.json'
+        tmp_path = _snapshot_path.with_suffix('.tmp')
+        tmp_path.write_text(json.dumps(snapshot))
+        os.replace(tmp_path, _snapshot_path)
+    except OSError:
+        pass
+
+
+def _collect():
+    """Merge the snapshots written by every worker process"""
+    requests = {}
+    latency = {}
+    db_errors = {}
+    for path in _metrics_dir.glob('*.json'):
+        try:
+            snapshot = json.loads(path.read_text())
+        except (OSError, ValueError):
+            continue
+        for route, method, status, count in snapshot['requests']:
+            key = (route, method, status)
+            requests[key] = requests.get(key, 0) + count
+        for route, method, series in snapshot['latency']:
+            merged = latency.setdefault((route, method), [0] * len(series))
+            for i, value in enumerate(series):
+                merged[i] += value
+        for kind, count in snapshot['db_errors'].items():
+            db_errors[kind] = db_errors.get(kind, 0) + count
+    return requests, latency, db_errors
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _db_gauges(db_path):
+    """Read size and page statistics straight from the database file"""
+    gauges = {}
+    wal_path = Path(f'{db_path}-wal')
+    gauges['wal_bytes'] = wal_path.stat().st_size if wal_path.exists() else 0
+    if not Path(db_path).exists():
+        return gauges
+    gauges['file_bytes'] = Path(db_path).stat().st_size
+    try:
+        conn = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True, timeout=1.0)
+        try:
+            gauges['page_count'] = conn.execute('PRAGMA page_count').fetchone()[0]
+            gauges['freelist_count'] = conn.execute('PRAGMA freelist_count').fetchone()[0]
+            gauges['page_size'] = conn.execute('PRAGMA page_size').fetchone()[0]
+            gauges['replica'] = replication.status(conn)
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        pass
+    return gauges
+
+
+def render(db_path):
+    """Render all metrics in the Prometheus text exposition format"""
+    flush()
+    requests, latency, db_errors = _collect()
+    lines = []
+
+    lines.append('# HELP waterscribe_http_requests_total HTTP requests by route, method and status.')
+    lines.append('# TYPE waterscribe_http_requests_total counter')
+    for (route, method, status), count in sorted(requests.items()):
+        lines.append(f'waterscribe_http_requests_total{{route="{_label(route)}",'
+                     f'method="{method}",status="{status}"}} {count}')
+
+    lines.append('# HELP waterscribe_http_request_duration_seconds Request latency by route.')
+    lines.append('# TYPE waterscribe_http_request_duration_seconds histogram')
+    for (route, method), series in sorted(latency.items()):
+        labels = f'route="{_label(route)}",method="{method}"'
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS, series):
+            cumulative += count
+            lines.append(f'waterscribe_http_request_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+        cumulative += series[len(LATENCY_BUCKETS)]
+        lines.append(f'waterscribe_http_request_duration_seconds_bucket{{{labels},le="+Inf"}} {cumulative}')
+        lines.append(f'waterscribe_http_request_duration_seconds_sum{{{labels}}} {series[-1]:.6f}')
+        lines.append(f'waterscribe_http_request_duration_seconds_count{{{labels}}} {cumulative}')
+
+    lines.append('# HELP waterscribe_db_lock_events_total SQLite busy/locked errors and retries.')
+    lines.append('# TYPE waterscribe_db_lock_events_total counter')
+    for kind in ('busy', 'locked', 'retry'):
+        lines.append(f'waterscribe_db_lock_events_total{{kind="{kind}"}} {db_errors.get(kind, 0)}')
+
+    gauges = _db_gauges(db_path)
+    for name, help_text in (
+        ('wal_bytes', 'Size of the write-ahead log file.'),
+        ('file_bytes', 'Size of the main database file.'),
+        ('page_count', 'Total pages in the database.'),
+        ('freelist_count', 'Unused pages in the database.'),
+        ('page_size', 'Database page size in bytes.'),
+    ):
+        if name in gauges:
+            lines.append(f'# HELP waterscribe_db_{name} {help_text}')
+            lines.append(f'# TYPE waterscribe_db_{name} gauge')
+            lines.append(f'waterscribe_db_{name} {gauges[name]}')
+
+    replica = gauges.get('replica')
+    if replica is not None:
+        for name, kind, help_text, value in (
+            ('lag_seconds', 'gauge', 'Seconds since the replica last had every primary change.',
+             round((clock.now_ms() - replica['synced_at']) / 1000, 3)),
+            ('pending_changes', 'gauge', 'Change log seqs the replica is behind at its last poll.',
+             max(0, replica['primary_seq'] - replica['seq'])),
+            ('applied_changes_total', 'counter', 'Change log entries applied since the replica was seeded.',
+             replica['applied']),
+        ):
+            lines.append(f'# HELP waterscribe_replication_{name} {help_text}')
+            lines.append(f'# TYPE waterscribe_replication_{name} {kind}')
+            lines.append(f'waterscribe_replication_{name} {value}')
+
+    return '\n'.join(lines) + '\n'
+
+
+def _start_timer():
+    g._metrics_start = time.perf_counter()
+
+
+def _record_response(response):
+    start = g.pop('_metrics_start', None)
+    if start is None:
+        return response
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    method = request.method
+    status = response.status_code
+    # Observed on close so streamed bodies count towards latency
+    response.call_on_close(lambda: _observe(route, method, status, time.perf_counter() - start))
+    return response
+
+
+def _record_exception(sender, exception, **extra):
+    if isinstance(exception, sqlite3.OperationalError):
+        message = str(exception)
+        if 'locked' in message:
+            record_db_error('locked')
+        elif 'busy' in message:
+            record_db_error('busy')
+
+
+def parse_allow(spec):
+    """Networks from a WATERSCRIBE_METRICS_ALLOW value; raises ValueError for a bad entry"""
+    return [ipaddress.ip_network(entry.strip(), strict=False) for entry in spec.split(',') if entry.strip()]
+
+
+def allowed(address, networks):
+    """Whether a client address is in one of networks"""
+    try:
+        address = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    if address.version == 6 and address.ipv4_mapped:
+        address = address.ipv4_mapped
+    return any(address in network for network in networks)
+
+
+def init_app(app, db_path):
+    """Register metric hooks and the /metrics endpoint when enabled"""
+    global _metrics_dir
+    if not METRICS_ENABLED:
+        return
+    # Read here, not at import: the benchmark and auditor set it after importing this
+    _metrics_dir = Path(os.environ.get('WATERSCRIBE_METRICS_DIR') or f'{db_path}.metrics')
+    app.before_request(_start_timer)
+    app.after_request(_record_response)
+    got_request_exception.connect(_record_exception, app)
+    networks = parse_allow(METRICS_ALLOW)
+
+    def serve():
+        # Behind Nginx this is the X-Real-IP it passes on (see ratelimit)
+        if not allowed(ratelimit.client_id(), networks):
+            abort(403)
+        return Response(render(db_path), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+    app.add_url_rule('/metrics', 'metrics', serve)
+    atexit.register(flush)
@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+"""
+Database Migration Script - STRICT Tables
+Rebuilds every table as a STRICT table with exact column types and switches
+the file to incremental auto-vacuum, then compacts it.
+
+Older databases used loose type affinity, so values posted from the web
+form could be stored as text ('7.2', or '' for a blank field) in numeric
+columns. Numeric text is converted to numbers; blank or unparseable values
+are cleared.
+
+Run migrate-timestamps.py first if you have not already.
+A copy of the database is saved next to it before anything changes.
+"""
+
+import sqlite3
+import sys
+from datetime import datetime
+from pathlib import Path
+
+# Find the database
+db_path = Path('aquarium.db')
+
+if not db_path.exists():
+    # Try alternate location
+    db_path = Path.home() / 'waterscribe' / 'aquarium.db'
+    if not db_path.exists():
+        print("Error: Database not found at aquarium.db or ~/waterscribe/aquarium.db")
+        print("Please run this script from the directory containing aquarium.db")
+        sys.exit(1)
+
+print(f"Found database at: {db_path}")
+print()
+
+NOW_MS_SQL = "(CAST((julianday('now') - 2440587.5) * 86400000 AS INTEGER))"
+
+# table -> (new schema, indexes)
+TABLES = {
+    'water_parameters': (f'''
+        CREATE TABLE water_parameters_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp INTEGER NOT NULL DEFAULT {NOW_MS_SQL},
+            temperature REAL,
+            ph REAL,
+            ammonia REAL,
+            nitrite REAL,
+            nitrate REAL,
+            notes TEXT
+        ) STRICT
+    ''', [
+        'CREATE INDEX IF NOT EXISTS idx_water_parameters_timestamp ON water_parameters (timestamp)',
+    ]),
+    'maintenance_log': (f'''
+        CREATE TABLE maintenance_log_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp INTEGER NOT NULL DEFAULT {NOW_MS_SQL},
+            task_type TEXT NOT NULL,
+            description TEXT,
+            completed INTEGER DEFAULT 1
+        ) STRICT
+    ''', [
+        'CREATE INDEX IF NOT EXISTS idx_maintenance_log_timestamp ON maintenance_log (timestamp)',
+    ]),
+    'scheduled_tasks': ('''
+        CREATE TABLE scheduled_tasks_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            task_name TEXT NOT NULL,
+            frequency_days INTEGER,
+            last_completed INTEGER,
+            next_due INTEGER,
+            description TEXT,
+            active INTEGER DEFAULT 1,
+            is_recurring INTEGER DEFAULT 1,
+            specific_date INTEGER
+        ) STRICT
+    ''', [
+        'CREATE INDEX IF NOT EXISTS idx_scheduled_tasks_active_next_due ON scheduled_tasks (active, next_due)',
+    ]),
+    'fish_inventory': (f'''
+        CREATE TABLE fish_inventory_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            species TEXT NOT NULL,
+            common_name TEXT,
+            quantity INTEGER DEFAULT 1,
+            added_date INTEGER NOT NULL DEFAULT {NOW_MS_SQL},
+            notes TEXT
+        ) STRICT
+    ''', [
+        'CREATE INDEX IF NOT EXISTS idx_fish_inventory_added_date ON fish_inventory (added_date)',
+    ]),
+}
+
+# Columns that must hold integers before this migration can run
+TIME_COLUMNS = ('timestamp', 'last_completed', 'next_due', 'specific_date', 'added_date')
+
+
+def coerce(value, column_type):
+    """Value converted for a STRICT column; returns (value, was_cleared)"""
+    if value is None or column_type in ('TEXT', 'ANY'):
+        return value, False
+    if column_type == 'REAL' and isinstance(value, (int, float)):
+        return float(value), False
+    if column_type == 'INTEGER' and isinstance(value, int):
+        return value, False
+    try:
+        number = float(str(value).strip())
+    except ValueError:
+        return None, True
+    if column_type == 'INTEGER':
+        if not number.is_integer():
+            return None, True
+        return int(number), False
+    return number, False
+
+
+def is_strict(c, table):
+    c.execute("SELECT strict FROM pragma_table_list WHERE name = ?", (table,))
+    row = c.fetchone()
+    return row is not None and row[0] == 1
+
+
+def check_timestamps(c, table):
+    c.execute(f"PRAGMA table_info({table})")
+    return all(row[2].upper() == 'INTEGER' for row in c.fetchall() if row[1] in TIME_COLUMNS)
+
+
+def migrate_table(c, table, create_sql, indexes):
+    c.execute(f"PRAGMA table_info({table})")
+    old_columns = [row[1] for row in c.fetchall()]
+
+    c.execute(create_sql)
+    c.execute(f"PRAGMA table_info({table}_new)")
+    new_types = {row[1]: row[2].upper() for row in c.fetchall()}
+    columns = [column for column in old_columns if column in new_types]
+    types = [new_types[column] for column in columns]
+
+    c.execute(f"SELECT {', '.join(columns)} FROM {table}")
+    placeholders = ', '.join('?' * len(columns))
+    insert = f"INSERT INTO {table}_new ({', '.join(columns)}) VALUES ({placeholders})"
+
+    copied = 0
+    cleared = 0
+    while True:
+        rows = c.fetchmany(10000)
+        if not rows:
+            break
+        converted = []
+        for row in rows:
+            values = []
+            for value, column_type in zip(row, types):
+                value, was_cleared = coerce(value, column_type)
+                cleared += was_cleared
+                values.append(value)
+            converted.append(values)
+        c.connection.executemany(insert, converted)
+        copied += len(converted)
+
+    c.execute(f"DROP TABLE {table}")
+    c.execute(f"ALTER TABLE {table}_new RENAME TO {table}")
+    for index_sql in indexes:
+        c.execute(index_sql)
+    return copied, cleared
+
+
+def migrate():
+    """Rebuild tables as STRICT and enable incremental auto-vacuum"""
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    c = conn.cursor()
+
+    print("Checking database schema...")
+    pending = [table for table in TABLES if not is_strict(c, table)]
+    auto_vacuum = c.execute("PRAGMA auto_vacuum").fetchone()[0]
+
+    if not pending and auto_vacuum == 2:
+        print()
+        print("=" * 60)
+        print("Database already up to date - no changes needed")
+        print("=" * 60)
+        print()
+        conn.close()
+        return
+
+    not_converted = [table for table in pending if not check_timestamps(c, table)]
+    if not_converted:
+        print(f"Error: {', '.join(not_converted)} still store text timestamps")
+        print("Run migrate-timestamps.py first, then run this script again")
+        conn.close()
+        sys.exit(1)
+
+    backup_path = db_path.with_name(db_path.name + f".pre-strict-{datetime.now():%Y%m%d-%H%M%S}.bak")
+    print(f"Backing up to {backup_path}...")
+    backup = sqlite3.connect(backup_path)
+    conn.backup(backup)
+    backup.close()
+    print("✓ Backup saved")
+    print()
+
+    c.execute("BEGIN IMMEDIATE")
+    try:
+        for table in pending:
+            create_sql, indexes = TABLES[table]
+            print(f"Rebuilding {table}...")
+            copied, cleared = migrate_table(c, table, create_sql, indexes)
+            print(f"✓ {copied} rows copied")
+            if cleared:
+                print(f"  ! {cleared} non-numeric values in numeric columns were cleared")
+        c.execute("COMMIT")
+    except Exception:
+        c.execute("ROLLBACK")
+        raise
+
+    # auto_vacuum can only change on an existing file through a full VACUUM
+    print("Compacting database (this can take a while on large files)...")
+    size_before = db_path.stat().st_size
+    c.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    c.execute("VACUUM")
+    size_after = db_path.stat().st_size
+    print(f"✓ {size_before / 1e6:.1f} MB -> {size_after / 1e6:.1f} MB")
+
+    print()
+    print("=" * 60)
+    print("✓ Migration Complete!")
+    print("=" * 60)
+    print()
+    print("Tables are now STRICT and free pages are reclaimed automatically")
+    print("by the app's housekeeping job.")
+    print()
+    print("Restart your app to use the new format:")
+    print("  sudo systemctl restart waterscribe")
+    print()
+
+    conn.close()
+
+if __name__ == '__main__':
+    try:
+        migrate()
+    except Exception as e:
+        print(f"Error during migration: {e}")
+        sys.exit(1)
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+Database Migration Script - Epoch Timestamps
+Converts every time column to integer epoch milliseconds (UTC) and adds the
+time indexes used by the app.
+
+Old databases mix formats: readings and maintenance entries were written in
+server-local time ('YYYY-MM-DD HH:MM:SS'), scheduled tasks as local ISO
+strings ('YYYY-MM-DDTHH:MM:SS.ffffff'), and fish added dates by SQLite's
+CURRENT_TIMESTAMP (UTC). Local values are read in WATERSCRIBE_TZ if set,
+otherwise in this machine's time zone, so run it on the server itself.
+
+A copy of the database is saved next to it before anything changes.
+"""
+
+import sqlite3
+import sys
+from datetime import datetime, timezone
+from pathlib import Path
+
+from clock import to_ms
+
+# Find the database
+db_path = Path('aquarium.db')
+
+if not db_path.exists():
+    # Try alternate location
+    db_path = Path.home() / 'waterscribe' / 'aquarium.db'
+    if not db_path.exists():
+        print("Error: Database not found at aquarium.db or ~/waterscribe/aquarium.db")
+        print("Please run this script from the directory containing aquarium.db")
+        sys.exit(1)
+
+print(f"Found database at: {db_path}")
+print()
+
+NOW_MS_SQL = "(CAST((julianday('now') - 2440587.5) * 86400000 AS INTEGER))"
+
+# table -> (new schema, {time column: stored as UTC?}, indexes)
+TABLES = {
+    'water_parameters': (f'''
+        CREATE TABLE water_parameters_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp INTEGER NOT NULL DEFAULT {NOW_MS_SQL},
+            temperature REAL,
+            ph REAL,
+            ammonia REAL,
+            nitrite REAL,
+            nitrate REAL,
+            notes TEXT
+        )
+    ''', {'timestamp': False}, [
+        'CREATE INDEX IF NOT EXISTS idx_water_parameters_timestamp ON water_parameters (timestamp)',
+    ]),
+    'maintenance_log': (f'''
+        CREATE TABLE maintenance_log_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp INTEGER NOT NULL DEFAULT {NOW_MS_SQL},
+            task_type TEXT NOT NULL,
+            description TEXT,
+            completed BOOLEAN DEFAULT 1
+        )
+    ''', {'timestamp': False}, [
+        'CREATE INDEX IF NOT EXISTS idx_maintenance_log_timestamp ON maintenance_log (timestamp)',
+    ]),
+    'scheduled_tasks': ('''
+        CREATE TABLE scheduled_tasks_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            task_name TEXT NOT NULL,
+            frequency_days INTEGER,
+            last_completed INTEGER,
+            next_due INTEGER,
+            description TEXT,
+            active BOOLEAN DEFAULT 1,
+            is_recurring BOOLEAN DEFAULT 1,
+            specific_date INTEGER
+        )
+    ''', {'last_completed': False, 'next_due': False, 'specific_date': False}, [
+        'CREATE INDEX IF NOT EXISTS idx_scheduled_tasks_active_next_due ON scheduled_tasks (active, next_due)',
+    ]),
+    'fish_inventory': (f'''
+        CREATE TABLE fish_inventory_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            species TEXT NOT NULL,
+            common_name TEXT,
+            quantity INTEGER DEFAULT 1,
+            added_date INTEGER NOT NULL DEFAULT {NOW_MS_SQL},
+            notes TEXT
+        )
+    ''', {'added_date': True}, [
+        'CREATE INDEX IF NOT EXISTS idx_fish_inventory_added_date ON fish_inventory (added_date)',
+    ]),
+}
+
+
+def convert(value, is_utc):
+    """Epoch ms for a legacy text timestamp; None if it cannot be parsed"""
+    if value is None or isinstance(value, int):
+        return value
+    try:
+        dt = datetime.fromisoformat(str(value).strip())
+    except ValueError:
+        return None
+    if is_utc and dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return to_ms(dt)
+
+
+def needs_migration(c, table, time_columns):
+    c.execute(f"PRAGMA table_info({table})")
+    types = {row[1]: row[2].upper() for row in c.fetchall()}
+    if not types:
+        return False
+    return any(types.get(column) != 'INTEGER' for column in time_columns)
+
+
+def migrate_table(c, table, create_sql, time_columns, indexes):
+    c.execute(f"PRAGMA table_info({table})")
+    columns = [row[1] for row in c.fetchall()]
+    positions = {column: columns.index(column) for column in time_columns if column in columns}
+
+    c.execute(create_sql)
+    c.execute(f"SELECT {', '.join(columns)} FROM {table}")
+    placeholders = ', '.join('?' * len(columns))
+    insert = f"INSERT INTO {table}_new ({', '.join(columns)}) VALUES ({placeholders})"
+
+    copied = 0
+    unparsed = 0
+    fallback_ms = to_ms(datetime.now())
+    while True:
+        rows = c.fetchmany(10000)
+        if not rows:
+            break
+        converted = []
+        for row in rows:
+            row = list(row)
+            for column, index in positions.items():
+                original = row[index]
+                row[index] = convert(original, time_columns[column])
+                if original is not None and row[index] is None:
+                    unparsed += 1
+            # NOT NULL time columns fall back to the migration time
+            for column, index in positions.items():
+                if row[index] is None and column in ('timestamp', 'added_date'):
+                    row[index] = fallback_ms
+            converted.append(row)
+        c.connection.executemany(insert, converted)
+        copied += len(converted)
+
+    c.execute(f"DROP TABLE {table}")
+    c.execute(f"ALTER TABLE {table}_new RENAME TO {table}")
+    for index_sql in indexes:
+        c.execute(index_sql)
+    return copied, unparsed
+
+
+def migrate():
+    """Convert all time columns to epoch milliseconds"""
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    c = conn.cursor()
+
+    print("Checking database schema...")
+    pending = [table for table, (_, time_columns, _) in TABLES.items()
+               if needs_migration(c, table, time_columns)]
+
+    if not pending:
+        print()
+        print("=" * 60)
+        print("Database already up to date - no changes needed")
+        print("=" * 60)
+        print()
+        conn.close()
+        return
+
+    backup_path = db_path.with_name(db_path.name + f".pre-timestamps-{datetime.now():%Y%m%d-%H%M%S}.bak")
+    print(f"Backing up to {backup_path}...")
+    backup = sqlite3.connect(backup_path)
+    conn.backup(backup)
+    backup.close()
+    print("✓ Backup saved")
+    print()
+
+    c.execute("BEGIN IMMEDIATE")
+    try:
+        for table in pending:
+            create_sql, time_columns, indexes = TABLES[table]
+            print(f"Migrating {table}...")
+            copied, unparsed = migrate_table(c, table, create_sql, time_columns, indexes)
+            print(f"✓ {copied} rows converted")
+            if unparsed:
+                print(f"  ! {unparsed} values could not be parsed and were cleared")
+        c.execute("COMMIT")
+    except Exception:
+        c.execute("ROLLBACK")
+        raise
+
+    print()
+    print("=" * 60)
+    print("✓ Migration Complete!")
+    print("=" * 60)
+    print()
+    print("All timestamps are now stored as UTC epoch milliseconds.")
+    print("The API still returns ISO 8601 strings.")
+    print()
+    print("Restart your app to use the new format:")
+    print("  sudo systemctl restart waterscribe")
+    print()
+
+    conn.close()
+
+if __name__ == '__main__':
+    try:
+        migrate()
+    except Exception as e:
+        print(f"Error during migration: {e}")
+        sys.exit(1)
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+Request Profiling
+Opt-in per-request timing of SQL statements and JSON serialization.
+Writes run on the database writer thread; their SQL is charged to the
+request that submitted them, and the time they waited in the writer's
+queue is reported as write_wait.
+
+Enable with WATERSCRIBE_PROFILE=1. Sampled requests get a Server-Timing
+header (except streamed ones, whose totals are only known once the body
+has been sent) and are recorded in a bounded ring buffer served at
+/api/_debug/profile. When disabled nothing is registered and connections
+use the stock sqlite3 classes.
+"""
+
+import os
+import random
+import sqlite3
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from flask import g, has_request_context, jsonify, request
+from flask.json.provider import DefaultJSONProvider
+
+PROFILE_ENABLED = os.environ.get('WATERSCRIBE_PROFILE', '0') == '1'
+PROFILE_SAMPLE_RATE = float(os.environ.get('WATERSCRIBE_PROFILE_SAMPLE_RATE', '1.0'))
+PROFILE_BUFFER_SIZE = int(os.environ.get('WATERSCRIBE_PROFILE_BUFFER', '500'))
+
+_buffer = deque(maxlen=PROFILE_BUFFER_SIZE)
+_buffer_lock = threading.Lock()
+_thread = threading.local()   # profile for writer jobs, which run outside any request
+
+
+class RequestProfile:
+    """Counters collected for a single sampled request"""
+
+    __slots__ = ('started', 'sql_count', 'sql_time', 'rows', 'json_time', 'write_wait')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.rows = 0
+        self.json_time = 0.0
+        self.write_wait = 0.0
+
+    def add_job(self, job, wait):
+        """Add a writer job's profile and the time it waited in the queue"""
+        self.sql_count += job.sql_count
+        self.sql_time += job.sql_time
+        self.rows += job.rows
+        self.write_wait += wait
+
+
+def current_profile():
+    """Return the profile for the active request or writer job, or None if not sampled"""
+    if not has_request_context():
+        return getattr(_thread, 'profile', None)
+    return g.get('_profile')
+
+
+@contextmanager
+def charging(profile):
+    """Charge SQL run on this thread (outside a request) to profile, if not None"""
+    _thread.profile = profile
+    try:
+        yield profile
+    finally:
+        _thread.profile = None
+
+
+class ProfiledCursor(sqlite3.Cursor):
+    """Cursor that charges execute and fetch time to the current request"""
+
+    def execute(self, sql, parameters=()):
+        profile = current_profile()
+        if profile is None:
+            return super().execute(sql, parameters)
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            profile.sql_time += time.perf_counter() - start
+            profile.sql_count += 1
+
+    def executemany(self, sql, seq_of_parameters):
+        profile = current_profile()
+        if profile is None:
+            return super().executemany(sql, seq_of_parameters)
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            profile.sql_time += time.perf_counter() - start
+            profile.sql_count += 1
+
+    def _timed_fetch(self, fetch, *args):
+        profile = current_profile()
+        if profile is None:
+            return fetch(*args)
+        start = time.perf_counter()
+        result = fetch(*args)
+        profile.sql_time += time.perf_counter() - start
+        if isinstance(result, list):
+            profile.rows += len(result)
+        elif result is not None:
+            profile.rows += 1
+        return result
+
+    def fetchone(self):
+        return self._timed_fetch(super().fetchone)
+
+    def fetchmany(self, size=None):
+        if size is None:
+            size = self.arraysize
+        return self._timed_fetch(super().fetchmany, size)
+
+    def fetchall(self):
+        return self._timed_fetch(super().fetchall)
+
+    def __next__(self):
+        row = self._timed_fetch(super().fetchone)
+        if row is None:
+            raise StopIteration
+        return row
+
+
+class ProfiledConnection(sqlite3.Connection):
+    """Connection whose cursors report into the request profile"""
+
+    def cursor(self, factory=ProfiledCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+# Passed as sqlite3.connect(factory=...) by get_db()
+connection_factory = ProfiledConnection if PROFILE_ENABLED else sqlite3.Connection
+
+
+class ProfilingJSONProvider(DefaultJSONProvider):
+    """JSON provider that records serialization time for sampled requests"""
+
+    def dumps(self, obj, **kwargs):
+        profile = current_profile()
+        if profile is None:
+            return super().dumps(obj, **kwargs)
+        start = time.perf_counter()
+        try:
+            return super().dumps(obj, **kwargs)
+        finally:
+            profile.json_time += time.perf_counter() - start
+
+
+def _start_profile():
+    if request.path == '/api/_debug/profile':
+        return
+    if PROFILE_SAMPLE_RATE < 1.0 and random.random() >= PROFILE_SAMPLE_RATE:
+        return
+    g._profile = RequestProfile()
+
+
+def _finish_profile(response):
+    # Stays on g: a streamed body is fetched and encoded after this runs
+    profile = g.get('_profile')
+    if profile is None:
+        return response
+
+    rule = request.url_rule.rule if request.url_rule else request.path
+    method = request.method
+    status = response.status_code
+    if not response.is_streamed:
+        # Headers go out before a streamed body, when its totals are not known
+        response.headers['Server-Timing'] = (
+            f'db;dur={profile.sql_time * 1000:.2f};desc="{profile.sql_count} queries", '
+            f'json;dur={profile.json_time * 1000:.2f}, '
+            f'wait;dur={profile.write_wait * 1000:.2f};desc="write queue", '
+            f'app;dur={(time.perf_counter() - profile.started) * 1000:.2f}'
+        )
+
+    def record():
+        # Runs once the body has been sent, so streamed responses are included
+        entry = {
+            'timestamp': time.time(),
+            'route': rule,
+            'method': method,
+            'status': status,
+            'total_ms': round((time.perf_counter() - profile.started) * 1000, 3),
+            'sql_count': profile.sql_count,
+            'sql_ms': round(profile.sql_time * 1000, 3),
+            'rows': profile.rows,
+            'json_ms': round(profile.json_time * 1000, 3),
+            'write_wait_ms': round(profile.write_wait * 1000, 3),
+        }
+        with _buffer_lock:
+            _buffer.append(entry)
+
+    response.call_on_close(record)
+    return response
+
+
+def profile_endpoint():
+    """Return recorded request profiles, newest first"""
+    if request.method == 'DELETE':
+        with _buffer_lock:
+            _buffer.clear()
+        return jsonify({'success': True})
+
+    route = request.args.get('route')
+    limit = request.args.get('limit', 100, type=int)
+    with _buffer_lock:
+        entries = list(_buffer)
+    entries.reverse()
+    if route:
+        entries = [e for e in entries if e['route'] == route]
+    return jsonify({
+        'sample_rate': PROFILE_SAMPLE_RATE,
+        'capacity': PROFILE_BUFFER_SIZE,
+        'entries': entries[:limit],
+    })
+
+
+def init_app(app):
+    """Register profiling hooks on the Flask app when enabled"""
+    if not PROFILE_ENABLED:
+        return
+    app.json = ProfilingJSONProvider(app)
+    app.before_request(_start_profile)
+    app.after_request(_finish_profile)
+    app.add_url_rule('/api/_debug/profile', 'debug_profile', profile_endpoint,
+                     methods=['GET', 'DELETE'])
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+Rate Limiting and Write Admission
+Token buckets per client and rule keep one runaway script from starving
+everyone else: each /api/ request takes a token from its client's bucket
+for the matching rule, and a client whose bucket is empty gets 429 with
+Retry-After until it refills. Reads and writes have separate buckets, so a
+client flooding POSTs can still load its pages.
+
+Rules come from WATERSCRIBE_RATE_LIMITS, a comma separated list of
+name=rate/burst (tokens per second / bucket size). name is 'read', 'write'
+or a specific route such as 'POST /api/parameters', which takes precedence:
+    WATERSCRIBE_RATE_LIMITS="read=20/60,write=5/20,POST /api/sync=1/5"
+
+A view decorated with @cost(function) takes function(json body) tokens
+instead of one, so /api/batch and /api/sync pay one write token per write
+they carry. A client with at least one token left is let through and its
+bucket goes into debt for the rest; it waits until that is paid off.
+
+Buckets live in a small memory-mapped file next to the database (a fixed
+table of hashed slots, updated under flock), so every worker process
+enforces the same limits. Where fcntl is unavailable each process keeps
+its own buckets in that mapping.
+
+Separately, at most WATERSCRIBE_MAX_CONCURRENT_WRITES write requests per
+process are admitted at once; beyond that requests get 503 with
+Retry-After instead of queueing behind the writer thread.
+"""
+
+import hashlib
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+from pathlib import Path
+
+from flask import current_app, g, jsonify, request
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows
+    fcntl = None
+
+RATE_LIMIT_ENABLED = os.environ.get('WATERSCRIBE_RATE_LIMIT', '1') == '1'
+RATE_LIMITS = os.environ.get('WATERSCRIBE_RATE_LIMITS', 'read=20/60,write=5/20')
+MAX_CONCURRENT_WRITES = int(os.environ.get('WATERSCRIBE_MAX_CONCURRENT_WRITES', '16'))
+
+WRITE_METHODS = ('POST', 'PUT', 'PATCH', 'DELETE')
+TRUSTED_PROXIES = ('127.0.0.1', '::1')
+
+SLOTS = 4096
+PROBE = 8
+_SLOT = struct.Struct('<Qdd')  # key hash, tokens, last refill (epoch seconds)
+
+
+def parse_rules(spec):
+    """{name: (rate, burst)} from a WATERSCRIBE_RATE_LIMITS value
+
+    Raises ValueError for a malformed entry.
+    """
+    rules = {}
+    for entry in filter(None, (part.strip() for part in spec.split(','))):
+        name, sep, value = entry.rpartition('=')
+        rate, _, burst = value.partition('/')
+        try:
+            rate, burst = float(rate), float(burst or rate)
+        except ValueError:
+            raise ValueError(f'Invalid rate limit: {entry!r}') from None
+        if not sep or not name.strip() or rate <= 0 or burst < 1:
+            raise ValueError(f'Invalid rate limit: {entry!r}')
+        rules[' '.join(name.split())] = (rate, burst)
+    return rules
+
+
+class BucketTable:
+    """Token buckets in a shared memory-mapped file"""
+
+    def __init__(self, path, slots=SLOTS):
+        self.path = path
+        self.slots = slots
+        self.lock = threading.Lock()
+        self.pid = None
+
+    def _open(self):
+        # Per process: flock only excludes other open files, and a file
+        # opened before a fork would be shared with the workers
+        if self.pid != os.getpid():
+            self.pid = os.getpid()
+            self.file = open(self.path, 'a+b')
+            if os.fstat(self.file.fileno()).st_size < self.slots * _SLOT.size:
+                self.file.truncate(self.slots * _SLOT.size)
+            self.map = mmap.mmap(self.file.fileno(), self.slots * _SLOT.size)
+
+    def take(self, key, rate, burst, now=None, tokens=1):
+        """Take tokens; returns seconds until one is available (0 if taken)
+
+        Taking more tokens than are left is allowed while at least one is,
+        leaving the bucket negative.
+        """
+        now = now or time.time()
+        digest = int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'little') or 1
+        start = digest % self.slots
+        with self.lock:
+            self._open()
+            if fcntl is not None:
+                fcntl.flock(self.file, fcntl.LOCK_EX)
+            try:
+                window = []
+                for i in range(PROBE):
+                    index = (start + i) % self.slots
+                    window.append((index, *_SLOT.unpack_from(self.map, index * _SLOT.size)))
+                match = next((entry for entry in window if entry[1] == digest), None)
+                if match is not None:
+                    slot = match[0]
+                    left = min(burst, match[2] + max(0.0, now - match[3]) * rate)
+                else:
+                    # A new client takes an empty slot, or the least recently used
+                    slot = min(window, key=lambda entry: (entry[1] != 0, entry[3]))[0]
+                    left = burst
+
+                wait = 0.0
+                if left >= 1:
+                    left -= tokens
+                else:
+                    wait = (1 - left) / rate
+                _SLOT.pack_into(self.map, slot * _SLOT.size, digest, left, now)
+                return wait
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(self.file, fcntl.LOCK_UN)
+
+
+def cost(tokens):
+    """Decorator for a view whose requests take tokens(json body) tokens, at least one"""
+    def decorate(view):
+        view.rate_limit_cost = tokens
+        return view
+    return decorate
+
+
+def client_id():
+    """Client address, taken from the proxy's X-Real-IP behind Nginx"""
+    address = request.remote_addr or ''
+    if address in TRUSTED_PROXIES:
+        return request.headers.get('X-Real-IP', address)
+    return address
+
+
+def too_many(status, message, wait):
+    response = jsonify({'success': False, 'error': message})
+    response.status_code = status
+    response.headers['Retry-After'] = str(max(1, math.ceil(wait)))
+    return response
+
+
+def init_app(app, db_path):
+    """Check rate limits and write admission before each /api/ request"""
+    if not RATE_LIMIT_ENABLED:
+        return
+    rules = parse_rules(RATE_LIMITS)
+    table = BucketTable(Path(f'{db_path}.ratelimit'))
+    writes = threading.BoundedSemaphore(MAX_CONCURRENT_WRITES)
+
+    def admit():
+        if not request.path.startswith('/api/'):
+            return None
+        is_write = request.method in WRITE_METHODS
+        route = f'{request.method} {request.url_rule.rule if request.url_rule else request.path}'
+        name = route if route in rules else ('write' if is_write else 'read')
+        if name in rules:
+            rate, burst = rules[name]
+            tokens = getattr(current_app.view_functions.get(request.endpoint), 'rate_limit_cost', None)
+            tokens = 1 if tokens is None else max(1, tokens(request.get_json(silent=True)))
+            wait = table.take(f'{client_id()} {name}', rate, burst, tokens=tokens)
+            if wait:
+                return too_many(429, 'Too many requests', wait)
+        if is_write:
+            if not writes.acquire(blocking=False):
+                return too_many(503, 'Server busy, try again shortly', 1)
+            g._write_admitted = True
+        return None
+
+    def leave(exception):
+        if g.pop('_write_admitted', False):
+            writes.release()
+
+    app.before_request(admit)
+    app.teardown_request(leave)
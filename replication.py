@@ -0,0 +1,430 @@
+#!/usr/bin/env python3
+"""
+Standby Replication
+Keeps a warm standby copy of the database up to date by shipping the
+change log (see changelog.py) instead of files: the standby starts as an
+online backup of the primary, then repeatedly reads the entries after the
+last seq it applied, together with the current rows they point at, and
+applies them in one transaction per batch. Change log entries are copied
+with their original seq, so clients doing delta sync can switch between
+the primary and the standby, and keep going after a promotion.
+
+A database is a replica while its sync_state holds replica_seq. The app
+refuses writes to a replica (503) and, when it last caught up more than
+WATERSCRIBE_REPLICA_MAX_LAG seconds ago, reads as well, so a load balancer
+can send that traffic to the primary. Lag and throughput are published
+through /metrics.
+
+Run the standby as a second app instance with WATERSCRIBE_DB pointing at
+the standby file and WATERSCRIBE_REPLICA_OF at the primary; one worker
+applies changes every WATERSCRIBE_REPLICATION_INTERVAL seconds. Or run the
+applier on its own:
+    python3 replication.py --primary aquarium.db --standby /srv/standby/aquarium.db
+Promote the standby (after a last catch-up, if the primary is readable):
+    python3 replication.py --primary aquarium.db --standby /srv/standby/aquarium.db --promote
+
+Not replicated: idempotency keys and readings archived on the primary
+after the standby was seeded (they stay in the standby's main table).
+Daily summaries are copied whenever they differ.
+"""
+
+import argparse
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from flask import jsonify, request
+
+import changelog
+import clock
+import retention
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows; every worker applies
+    fcntl = None
+
+REPLICA_OF = os.environ.get('WATERSCRIBE_REPLICA_OF')
+REPLICATION_INTERVAL = float(os.environ.get('WATERSCRIBE_REPLICATION_INTERVAL', '1.0'))
+REPLICA_MAX_LAG = float(os.environ.get('WATERSCRIBE_REPLICA_MAX_LAG', '60'))
+
+BATCH_SIZE = 2000
+FETCH_CHUNK = 500
+WRITE_METHODS = ('POST', 'PUT', 'PATCH', 'DELETE')
+STATE_KEYS = ('replica_seq', 'replica_synced_at', 'replica_applied', 'replica_primary_seq')
+
+_started_pid = None
+_start_lock = threading.Lock()
+_status_lock = threading.Lock()
+_status_cache = {}  # db path -> (checked, status)
+
+
+class FellBehind(Exception):
+    """Tombstones the standby has not applied were compacted on the primary"""
+
+
+class NotReplica(Exception):
+    """The standby has been promoted (or was never seeded)"""
+
+
+def _connect(db_path, readonly=False):
+    if readonly:
+        conn = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True, timeout=10.0, isolation_level=None)
+    else:
+        conn = sqlite3.connect(db_path, timeout=10.0, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def _set_state(conn, **values):
+    conn.executemany('''
+        INSERT INTO sync_state (name, value) VALUES (?, ?)
+        ON CONFLICT (name) DO UPDATE SET value = excluded.value
+    ''', values.items())
+
+
+def status(conn):
+    """Replication state of a database, or None if it is not a replica
+
+    {'seq', 'synced_at', 'applied', 'primary_seq'}; synced_at is when the
+    standby last had every change the primary had (epoch ms).
+    """
+    try:
+        rows = dict(conn.execute(f'''
+            SELECT name, value FROM sync_state WHERE name IN ({', '.join('?' * len(STATE_KEYS))})
+        ''', STATE_KEYS).fetchall())
+    except sqlite3.OperationalError:  # no sync_state yet
+        return None
+    if 'replica_seq' not in rows:
+        return None
+    return {key.removeprefix('replica_'): rows.get(key, 0) for key in STATE_KEYS}
+
+
+def _head(conn):
+    row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'changes'").fetchone()
+    return row[0] if row else 0
+
+
+def seed(primary, standby):
+    """Make standby a fresh replica: an online backup of primary (and its archive)
+
+    Written to a temporary file first and then copied over the standby in
+    one step, so readers never see a half-made replica.
+    """
+    primary_archive, standby_archive = retention.archive_path(primary), retention.archive_path(standby)
+    if primary_archive.exists():
+        if primary_archive.resolve() == standby_archive.resolve():
+            raise ValueError('The standby would share the primary archive; unset WATERSCRIBE_ARCHIVE_DB')
+        _backup(primary_archive, standby_archive)
+
+    staging = Path(f'{standby}.seed')
+    staging.unlink(missing_ok=True)
+    source = sqlite3.connect(primary)
+    try:
+        copy = sqlite3.connect(staging, isolation_level=None)
+        try:
+            source.backup(copy)
+            head = _head(copy)
+            _set_state(copy, replica_seq=head, replica_primary_seq=head,
+                       replica_synced_at=clock.now_ms(), replica_applied=0)
+        finally:
+            copy.close()
+    finally:
+        source.close()
+    _backup(staging, standby)
+    staging.unlink()
+
+
+def _backup(source_path, target_path):
+    source = sqlite3.connect(source_path)
+    target = sqlite3.connect(target_path)
+    try:
+        source.backup(target)
+        target.execute('PRAGMA journal_mode = WAL')
+    finally:
+        target.close()
+        source.close()
+
+
+def _daily_fingerprint(conn):
+    return tuple(conn.execute('''
+        SELECT COUNT(*), MAX(day), TOTAL(readings), TOTAL(temperature_avg), TOTAL(ph_avg)
+        FROM water_parameters_daily
+    ''').fetchone())
+
+
+def _read_batch(primary, since, limit, daily_fingerprint):
+    """Entries after since and the rows they point at, from one snapshot
+
+    Once caught up, also the daily summaries if their fingerprint differs
+    from daily_fingerprint (the standby's).
+    """
+    conn = _connect(primary, readonly=True)
+    try:
+        retention.attach_archive(conn, primary)
+        conn.execute('BEGIN')
+        if changelog.horizon(conn) > since:
+            raise FellBehind()
+        entries = conn.execute('''
+            SELECT seq, table_name, op, row_id, changed_at FROM changes
+            WHERE seq > ? ORDER BY seq LIMIT ?
+        ''', (since, limit + 1)).fetchall()
+        more = len(entries) > limit
+        entries = entries[:limit]
+
+        rows = {}
+        for table in changelog.TRACKED_TABLES:
+            ids = [e['row_id'] for e in entries if e['table_name'] == table and e['op'] != 'delete']
+            # Readings may have moved to the archive since they changed
+            source = 'water_parameters_all' if table == 'water_parameters' else table
+            for start in range(0, len(ids), FETCH_CHUNK):
+                chunk = ids[start:start + FETCH_CHUNK]
+                for row in conn.execute(f'SELECT * FROM {source} WHERE id IN ({", ".join("?" * len(chunk))})',
+                                        chunk):
+                    rows[table, row['id']] = row
+
+        daily = None
+        if not more and _daily_fingerprint(conn) != daily_fingerprint:
+            daily = conn.execute('SELECT * FROM water_parameters_daily').fetchall()
+        return entries, rows, more, _head(conn), changelog.horizon(conn), daily
+    finally:
+        conn.close()
+
+
+def _apply_row(conn, standby, table, row_id, row, has_archive):
+    if table == 'water_parameters' and has_archive:
+        if row is None:
+            retention.delete_archived_reading(conn, standby, row_id)
+        else:
+            conn.execute('DELETE FROM archive.water_parameters WHERE id = ?', (row_id,))
+    if row is None:
+        conn.execute(f'DELETE FROM main.{table} WHERE id = ?', (row_id,))
+        return
+    columns = row.keys()
+    conn.execute(f'''
+        INSERT INTO main.{table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})
+        ON CONFLICT (id) DO UPDATE SET {', '.join(f'{c} = excluded.{c}' for c in columns if c != 'id')}
+    ''', tuple(row))
+
+
+def apply_batch(primary, standby, limit=BATCH_SIZE):
+    """Apply the next batch of primary changes to standby
+
+    Returns (applied, more). Raises NotReplica once the standby has been
+    promoted and FellBehind when it has to be seeded again.
+    """
+    conn = _connect(standby)
+    try:
+        state = status(conn)
+        if state is None:
+            raise NotReplica()
+        entries, rows, more, head, horizon, daily = _read_batch(primary, state['seq'], limit,
+                                                                _daily_fingerprint(conn))
+        has_archive = retention.attach_archive(conn, standby)
+
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if status(conn)['seq'] != state['seq']:
+                # Another applier got here first
+                conn.execute('ROLLBACK')
+                return 0, True
+            before = _head(conn)
+            for entry in entries:
+                row = rows.get((entry['table_name'], entry['row_id']))
+                if entry['op'] != 'delete' and row is None:
+                    continue  # gone from the primary without a tombstone (archive moves)
+                _apply_row(conn, standby, entry['table_name'], entry['row_id'],
+                           None if entry['op'] == 'delete' else row, has_archive)
+            # Replace the entries the standby's own triggers just wrote with
+            # the primary's, seq included
+            conn.execute('DELETE FROM main.changes WHERE seq > ?', (before,))
+            for entry in entries:
+                conn.execute('DELETE FROM main.changes WHERE table_name = ? AND row_id = ?',
+                             (entry['table_name'], entry['row_id']))
+                conn.execute('''
+                    INSERT INTO main.changes (seq, table_name, op, row_id, changed_at)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', tuple(entry))
+
+            if daily is not None:
+                conn.execute('DELETE FROM main.water_parameters_daily')
+                if daily:
+                    columns = daily[0].keys()
+                    conn.executemany(f'''
+                        INSERT INTO main.water_parameters_daily ({', '.join(columns)})
+                        VALUES ({', '.join('?' * len(columns))})
+                    ''', [tuple(row) for row in daily])
+
+            conn.execute('''
+                INSERT INTO sync_state (name, value) VALUES ('tombstone_horizon', ?)
+                ON CONFLICT (name) DO UPDATE SET value = MAX(value, excluded.value)
+            ''', (horizon,))
+            values = {'replica_seq': entries[-1]['seq'] if entries else state['seq'],
+                      'replica_applied': state['applied'] + len(entries),
+                      'replica_primary_seq': head}
+            if not more:
+                values['replica_synced_at'] = clock.now_ms()
+            _set_state(conn, **values)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return len(entries), more
+    finally:
+        conn.close()
+
+
+def catch_up(primary, standby):
+    """Apply batches until the standby has everything; returns the number applied"""
+    total = 0
+    while True:
+        applied, more = apply_batch(primary, standby)
+        total += applied
+        if not more:
+            return total
+
+
+def follow(primary, standby, interval=REPLICATION_INTERVAL, progress=None):
+    """Keep standby up to date until it is promoted
+
+    Seeds the standby first if it does not exist, and again whenever it
+    falls behind the primary's tombstone horizon.
+    """
+    if not Path(standby).exists():
+        seed(primary, standby)
+    while True:
+        try:
+            applied = catch_up(primary, standby)
+            if applied and progress:
+                progress(f"  {applied:,} changes applied")
+        except NotReplica:
+            return
+        except FellBehind:
+            if progress:
+                progress("  standby fell behind the tombstone horizon, seeding again")
+            seed(primary, standby)
+        except sqlite3.OperationalError:
+            pass  # busy; try again next interval
+        time.sleep(interval)
+
+
+def promote(standby, primary=None):
+    """Stop replicating and make standby writable
+
+    Applies what it can from primary first, if given and still readable.
+    Returns the number of changes applied in that last catch-up.
+    """
+    applied = 0
+    if primary is not None:
+        try:
+            applied = catch_up(primary, standby)
+        except (sqlite3.Error, OSError, FellBehind):
+            pass  # the primary is gone; promote with what we have
+    conn = _connect(standby)
+    try:
+        conn.execute(f"DELETE FROM sync_state WHERE name IN ({', '.join('?' * len(STATE_KEYS))})", STATE_KEYS)
+    finally:
+        conn.close()
+    with _status_lock:
+        _status_cache.clear()
+    return applied
+
+
+def _loop(primary, standby):
+    lock_file = open(f'{standby}.replication', 'a+')
+    while True:
+        try:
+            if fcntl is not None:
+                # One applier per standby; the others wait to take over
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            follow(primary, standby)
+            return
+        except BlockingIOError:
+            pass
+        except (OSError, sqlite3.Error):
+            pass
+        time.sleep(REPLICATION_INTERVAL)
+
+
+def start(primary, standby):
+    """Start the applier thread for this process (once per pid)"""
+    global _started_pid
+    with _start_lock:
+        if _started_pid == os.getpid():
+            return
+        _started_pid = os.getpid()
+    threading.Thread(target=_loop, args=(primary, standby), name='replication', daemon=True).start()
+
+
+def cached_status(db_path):
+    """status() of db_path, re-read at most once per replication interval"""
+    key = str(db_path)
+    now = time.monotonic()
+    with _status_lock:
+        checked, state = _status_cache.get(key, (None, None))
+    if checked is None or now - checked >= REPLICATION_INTERVAL:
+        try:
+            conn = _connect(db_path, readonly=True)
+            try:
+                state = status(conn)
+            finally:
+                conn.close()
+        except sqlite3.Error:
+            state = None
+        with _status_lock:
+            _status_cache[key] = (now, state)
+    return state
+
+
+def init_app(app, db_path):
+    """Serve a replica read-only, and apply changes when WATERSCRIBE_REPLICA_OF is set"""
+    def guard():
+        if not request.path.startswith('/api/'):
+            return None
+        if REPLICA_OF:
+            start(REPLICA_OF, db_path)
+        state = cached_status(db_path)
+        if state is None:
+            if REPLICA_OF and not Path(db_path).exists():
+                return jsonify({'success': False, 'error': 'Replica is not seeded yet'}), 503
+            return None
+        if request.method in WRITE_METHODS:
+            return jsonify({'success': False, 'error': 'This server is a read-only replica'}), 503
+        lag = (clock.now_ms() - state['synced_at']) / 1000
+        if REPLICA_MAX_LAG and lag > REPLICA_MAX_LAG:
+            return jsonify({'success': False, 'error': 'Replica is behind the primary'}), 503
+        return None
+
+    app.before_request(guard)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replicate the database to a warm standby.')
+    parser.add_argument('--primary', default='aquarium.db', help='primary database (default: aquarium.db)')
+    parser.add_argument('--standby', required=True, help='standby database path')
+    parser.add_argument('--interval', type=float, default=REPLICATION_INTERVAL,
+                        help='seconds between polls (default: WATERSCRIBE_REPLICATION_INTERVAL or 1)')
+    parser.add_argument('--seed', action='store_true', help='seed the standby again even if it exists')
+    parser.add_argument('--promote', action='store_true', help='catch up once and make the standby writable')
+    args = parser.parse_args()
+
+    if args.promote:
+        applied = promote(args.standby, args.primary if Path(args.primary).exists() else None)
+        print(f"✓ {args.standby} promoted ({applied:,} changes applied first)")
+        raise SystemExit(0)
+
+    if not Path(args.primary).exists():
+        print(f"Error: Database not found at {args.primary}")
+        raise SystemExit(1)
+    if args.seed or not Path(args.standby).exists():
+        print(f"Seeding {args.standby} from {args.primary}...")
+        seed(args.primary, args.standby)
+        print("✓ Seeded")
+    print(f"Replicating every {args.interval:g}s (Ctrl-C to stop)...")
+    try:
+        follow(args.primary, args.standby, args.interval, progress=print)
+        print("Standby promoted; stopping")
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,914 @@
+#!/usr/bin/env python3
+"""
+Storage Repository
+Everything the routes read or write goes through a repository, so the
+handlers in app.py carry no SQL. Two backends implement the same methods:
+
+    SQLiteRepository  the real database: writes through the writer thread,
+                      reads from the read-only pool (see database.py)
+    MemoryRepository  plain Python structures (dicts by id, sorted
+                      (time, id) lists for the time-ordered tables), for
+                      tests and benchmarks that should not touch disk
+
+Set WATERSCRIBE_STORAGE=memory to run the app on the in-memory backend
+(data is lost on restart). MemoryRepository.from_sqlite() copies an
+existing database into memory, e.g. to benchmark the handlers without I/O.
+
+List methods return Rows, which streaming.stream_rows() encodes. Time
+columns hold epoch milliseconds; rendering them is the caller's job.
+"""
+
+import bisect
+import contextlib
+import json
+import math
+import sqlite3
+import threading
+from itertools import islice
+
+import changelog
+import clock
+import database
+import idempotency
+import retention
+
+# Columns of each listed table, in order (also what ?fields= accepts)
+COLUMNS = {
+    'water_parameters': ('id', 'timestamp', 'temperature', 'ph', 'ammonia', 'nitrite', 'nitrate', 'notes'),
+    'maintenance_log': ('id', 'timestamp', 'task_type', 'description', 'completed'),
+    'scheduled_tasks': ('id', 'task_name', 'frequency_days', 'last_completed', 'next_due',
+                        'description', 'active', 'is_recurring', 'specific_date'),
+    'fish_inventory': ('id', 'species', 'common_name', 'quantity', 'added_date', 'notes'),
+    'task_completions': ('id', 'task_id', 'due_at', 'completed_at', 'on_time'),
+    'water_parameters_daily': ('day', 'readings') + tuple(
+        f'{m}_{agg}' for m in retention.METRICS for agg in ('min', 'avg', 'max')),
+}
+
+UPCOMING_DAYS = 7
+RECENT_DAYS = 30
+# Description of the maintenance log entry written for a completed task
+COMPLETED_TASK = 'Completed scheduled task'
+
+
+def task_buckets(now):
+    """{status: (since, until)} next_due ranges of the task status buckets
+
+    Days are display-zone days: overdue tasks were due before today, week
+    covers the UPCOMING_DAYS after today and later everything after that.
+    Tasks without a due date are in no bucket.
+    """
+    today, tomorrow, week_end = (clock.local_midnight(now, days) for days in (0, 1, 1 + UPCOMING_DAYS))
+    return {
+        'overdue': (None, today),
+        'today': (today, tomorrow),
+        'week': (tomorrow, week_end),
+        'later': (week_end, None),
+    }
+
+
+def on_time(due_at, completed_at):
+    """Whether a task was done by the end of the display-zone day it was due
+
+    None without a due date; such completions do not count towards task_stats.
+    """
+    if due_at is None:
+        return None
+    return completed_at < clock.local_midnight(due_at, 1)
+
+
+def task_summary(stats):
+    """Adherence figures from a task_stats row (None: never completed)"""
+    if stats is None:
+        stats = {'completions': 0, 'on_time': 0, 'late_ms': 0, 'streak': 0, 'best_streak': 0}
+    completions = stats['completions']
+    return {
+        'completions': completions,
+        'on_time': stats['on_time'],
+        'on_time_rate': round(stats['on_time'] / completions, 3) if completions else None,
+        'average_days_late': round(stats['late_ms'] / completions / clock.DAY_MS, 2) if completions else None,
+        'current_streak': stats['streak'],
+        'best_streak': stats['best_streak'],
+    }
+
+
+def like_pattern(text):
+    """LIKE pattern (with ESCAPE '\\') matching text anywhere"""
+    return '%' + text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+
+class Rows:
+    """Result rows for streaming: a cursor-like description and fetchmany()"""
+
+    def __init__(self, description, fetchmany, close=None):
+        self.description = description
+        self.fetchmany = fetchmany
+        self._close = close
+
+    @classmethod
+    def from_values(cls, columns, values):
+        """Rows over an iterable of value tuples"""
+        values = iter(values)
+        return cls(tuple((column,) + (None,) * 6 for column in columns),
+                   lambda size=1: list(islice(values, size)))
+
+    def without_leading(self, count):
+        """These rows minus their first count columns"""
+        fetchmany = self.fetchmany
+        return Rows(self.description[count:], lambda size=1: [row[count:] for row in fetchmany(size)],
+                    self._close)
+
+    def close(self):
+        if self._close is not None:
+            self._close()
+
+
+def _reserve_key(conn, key, method, path):
+    """Insert a pending idempotency key; False if it already exists
+
+    An expired key that housekeeping has not deleted yet is taken over.
+    """
+    now = clock.now_ms()
+    return conn.execute('''
+        INSERT INTO idempotency_keys (key, method, path, created)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT (key) DO UPDATE SET
+            method = excluded.method, path = excluded.path, status = NULL, response = NULL,
+            created = excluded.created
+        WHERE created < ?
+    ''', (key, method, path, now, now - idempotency.TTL_MS)).rowcount == 1
+
+
+def expire_idempotency_keys(conn, ttl_ms, batch=1000, now=None):
+    """Delete expired idempotency keys, batch rows per transaction
+
+    conn must be in autocommit mode (isolation_level=None). Returns the
+    number of keys removed.
+    """
+    cutoff = (now or clock.now_ms()) - ttl_ms
+    removed = 0
+    while True:
+        deleted = conn.execute('''
+            DELETE FROM idempotency_keys WHERE rowid IN (
+                SELECT rowid FROM idempotency_keys WHERE created < ? LIMIT ?
+            )
+        ''', (cutoff, batch)).rowcount
+        removed += deleted
+        if deleted < batch:
+            return removed
+
+
+def _insert_sql(table, values):
+    columns = ', '.join(values)
+    return f"INSERT INTO {table} ({columns}) VALUES ({', '.join('?' * len(values))})", tuple(values.values())
+
+
+class SQLiteRepository:
+    """Repository backed by the SQLite database at db_path"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+
+    def _read(self, sql, params=(), archive=False):
+        conn = database.read(self.db_path)
+        try:
+            if archive:
+                retention.attach_archive(conn, self.db_path)
+            cursor = conn.cursor()
+            cursor.row_factory = None
+            cursor.execute(sql, params)
+        except Exception:
+            conn.close()
+            raise
+        return Rows(cursor.description, cursor.fetchmany, conn.close)
+
+    @contextlib.contextmanager
+    def _connection(self):
+        """A read connection for several queries"""
+        conn = database.read(self.db_path)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def _write(self, job):
+        """Run job(conn) on the writer thread; the first write of a request
+        with an idempotency key also reserves the key"""
+        return database.write(self.db_path, idempotency.bind(job, _reserve_key))
+
+    def batch(self, fn, write=True):
+        """Run fn(repository) with all its reads and writes on one connection
+
+        With write, fn runs as one job on the writer thread, in a single
+        transaction that an exception from fn rolls back entirely; use
+        isolated() on the repository it is given to contain smaller steps.
+        Otherwise fn gets a read-only connection and one consistent snapshot.
+        """
+        if write:
+            return self._write(lambda conn: fn(_BoundRepository(self.db_path, conn, writable=True)))
+        with self._connection() as conn:
+            retention.attach_archive(conn, self.db_path)
+            conn.execute('BEGIN')
+            return fn(_BoundRepository(self.db_path, conn, writable=False))
+
+    def _insert(self, table, values):
+        sql, params = _insert_sql(table, values)
+        return self._write(lambda conn: conn.execute(sql, params).lastrowid)
+
+    def _delete(self, table, row_id):
+        self._write(lambda conn: conn.execute(f'DELETE FROM {table} WHERE id = ?', (row_id,)))
+
+    @staticmethod
+    def _range(column, since, until, conditions, params):
+        if since is not None:
+            conditions.append(f'{column} >= ?')
+            params.append(since)
+        if until is not None:
+            conditions.append(f'{column} < ?')
+            params.append(until)
+
+    @staticmethod
+    def _where(conditions):
+        return 'WHERE ' + ' AND '.join(conditions) if conditions else ''
+
+    # Water parameters
+
+    def parameters(self, columns, since=None, until=None, before_id=None, limit=50):
+        """Readings newest first, archived ones included; before_id continues a page"""
+        conditions, params = [], []
+        self._range('timestamp', since, until, conditions, params)
+        if before_id is not None:
+            conditions.append('(timestamp, id) < (SELECT timestamp, id FROM water_parameters_all WHERE id = ?)')
+            params.append(before_id)
+        # The view is read as a merge of both tiers' timestamp indexes only
+        # when the ORDER BY columns are selected; otherwise both get sorted
+        hidden = tuple(column for column in ('timestamp', 'id') if column not in columns)
+        rows = self._read(f'''
+            SELECT {', '.join(hidden + tuple(columns))} FROM water_parameters_all
+            {self._where(conditions)}
+            ORDER BY timestamp DESC, id DESC
+            LIMIT ?
+        ''', (*params, limit), archive=True)
+        return rows.without_leading(len(hidden)) if hidden else rows
+
+    def daily_parameters(self, columns, since=None, until=None):
+        """Daily summaries of archived readings, newest first"""
+        conditions, params = [], []
+        self._range('day', since, until, conditions, params)
+        return self._read(f'''
+            SELECT {', '.join(columns)} FROM water_parameters_daily
+            {self._where(conditions)}
+            ORDER BY day DESC
+        ''', params)
+
+    def add_reading(self, values):
+        return self._insert('water_parameters', values)
+
+    def delete_reading(self, reading_id):
+        def delete(conn):
+            if conn.execute('DELETE FROM water_parameters WHERE id = ?', (reading_id,)).rowcount:
+                return
+            # Older readings may have moved to the archive, out of sight of
+            # the change log triggers
+            if retention.delete_archived_reading(conn, self.db_path, reading_id):
+                changelog.record_delete(conn, 'water_parameters', reading_id)
+        self._write(delete)
+
+    # Maintenance log
+
+    def maintenance(self, columns, before_id=None, limit=50):
+        conditions, params = [], []
+        if before_id is not None:
+            conditions.append('(timestamp, id) < (SELECT timestamp, id FROM maintenance_log WHERE id = ?)')
+            params.append(before_id)
+        return self._read(f'''
+            SELECT {', '.join(columns)} FROM maintenance_log
+            {self._where(conditions)}
+            ORDER BY timestamp DESC, id DESC
+            LIMIT ?
+        ''', (*params, limit))
+
+    def add_maintenance(self, values):
+        return self._insert('maintenance_log', values)
+
+    # Scheduled tasks
+
+    def scheduled(self, columns, since=None, until=None, text=None, after_id=None, limit=-1):
+        """Active tasks, soonest due first
+
+        since/until bound next_due, text matches the name or description
+        and after_id continues a page.
+        """
+        conditions, params = ['active = 1'], []
+        self._range('next_due', since, until, conditions, params)
+        self._match_task(text, conditions, params)
+        if after_id is not None:
+            conditions.append('(next_due, id) > (SELECT next_due, id FROM scheduled_tasks WHERE id = ?)')
+            params.append(after_id)
+        return self._read(f'''
+            SELECT {', '.join(columns)} FROM scheduled_tasks
+            {self._where(conditions)}
+            ORDER BY next_due ASC, id ASC
+            LIMIT ?
+        ''', (*params, limit))
+
+    def task_counts(self, now, text=None):
+        """Number of active tasks in each of task_buckets(now)
+
+        One range count per bucket, each a seek into the (active, next_due)
+        index rather than a pass over every active task; a bounded range
+        already leaves out tasks without a due date.
+        """
+        counts, params = [], []
+        for since, until in task_buckets(now).values():
+            conditions = ['active = 1']
+            self._range('next_due', since, until, conditions, params)
+            self._match_task(text, conditions, params)
+            counts.append(f'(SELECT COUNT(*) FROM scheduled_tasks {self._where(conditions)})')
+        with self._connection() as conn:
+            row = conn.execute(f"SELECT {', '.join(counts)}", params).fetchone()
+        return dict(zip(task_buckets(now), row))
+
+    @staticmethod
+    def _match_task(text, conditions, params):
+        if text:
+            conditions.append("(task_name LIKE ? ESCAPE '\\' OR description LIKE ? ESCAPE '\\')")
+            params.extend([like_pattern(text)] * 2)
+
+    def add_task(self, values):
+        return self._insert('scheduled_tasks', values)
+
+    def complete_task(self, task_id, task_name, now):
+        """Reschedule a recurring task (or retire a one-time one) and log it
+
+        The completion goes into task_completions against the due date it
+        met or missed (and, for the UI, into the maintenance log). Returns
+        False if there is no such task.
+        """
+        def complete(conn):
+            row = conn.execute('SELECT frequency_days, is_recurring, next_due FROM scheduled_tasks WHERE id = ?',
+                               (task_id,)).fetchone()
+            if not row:
+                return False
+            if row['is_recurring']:
+                conn.execute('''
+                    UPDATE scheduled_tasks
+                    SET last_completed = ?, next_due = ?
+                    WHERE id = ?
+                ''', (now, now + row['frequency_days'] * clock.DAY_MS, task_id))
+            else:
+                conn.execute('''
+                    UPDATE scheduled_tasks
+                    SET last_completed = ?, active = 0
+                    WHERE id = ?
+                ''', (now, task_id))
+            conn.execute('''
+                INSERT INTO task_completions (task_id, due_at, completed_at, on_time)
+                VALUES (?, ?, ?, ?)
+            ''', (task_id, row['next_due'], now, on_time(row['next_due'], now)))
+            conn.execute('''
+                INSERT INTO maintenance_log (timestamp, task_type, description)
+                VALUES (?, ?, ?)
+            ''', (now, task_name, COMPLETED_TASK))
+            return True
+        return self._write(complete)
+
+    def delete_task(self, task_id):
+        """Delete a task along with its completion history"""
+        self._delete('scheduled_tasks', task_id)
+
+    def task_history(self, task_id, before_id=None, limit=50):
+        """(stats, completions newest first) for a task, or None if there is no such task
+
+        stats is the task_stats row, None if it was never completed.
+        """
+        conditions, params = ['task_id = ?'], [task_id]
+        if before_id is not None:
+            conditions.append('(completed_at, id) < (SELECT completed_at, id FROM task_completions WHERE id = ?)')
+            params.append(before_id)
+        with self._connection() as conn:
+            if not conn.in_transaction:
+                conn.execute('BEGIN')
+            if conn.execute('SELECT 1 FROM scheduled_tasks WHERE id = ?', (task_id,)).fetchone() is None:
+                return None
+            stats = conn.execute('SELECT * FROM task_stats WHERE task_id = ?', (task_id,)).fetchone()
+            completions = conn.execute(f'''
+                SELECT {', '.join(COLUMNS['task_completions'])} FROM task_completions
+                {self._where(conditions)}
+                ORDER BY completed_at DESC, id DESC
+                LIMIT ?
+            ''', (*params, limit)).fetchall()
+        return dict(stats) if stats else None, [dict(row) for row in completions]
+
+    # Fish inventory
+
+    def fish(self, columns):
+        return self._read(f'SELECT {", ".join(columns)} FROM fish_inventory ORDER BY added_date DESC')
+
+    def add_fish(self, values):
+        return self._insert('fish_inventory', values)
+
+    def delete_fish(self, fish_id):
+        self._delete('fish_inventory', fish_id)
+
+    # Summaries and sync
+
+    def stats(self, now):
+        with self._connection() as conn:
+            latest = conn.execute('SELECT * FROM water_parameters ORDER BY timestamp DESC LIMIT 1').fetchone()
+            upcoming = conn.execute('''
+                SELECT COUNT(*) FROM scheduled_tasks
+                WHERE active = 1 AND next_due <= ?
+            ''', (now + UPCOMING_DAYS * clock.DAY_MS,)).fetchone()[0]
+            total_fish = conn.execute('SELECT SUM(quantity) FROM fish_inventory').fetchone()[0]
+            recent = conn.execute('''
+                SELECT COUNT(*) FROM maintenance_log
+                WHERE timestamp >= ?
+            ''', (now - RECENT_DAYS * clock.DAY_MS,)).fetchone()[0]
+        return {
+            'latest_parameters': dict(latest) if latest else None,
+            'upcoming_tasks': upcoming,
+            'total_fish': total_fish or 0,
+            'recent_maintenance': recent
+        }
+
+    def changes(self, since, limit, horizon=None):
+        """Change log entries after seq since, with current rows
+
+        Returns None if since is older than the tombstone horizon (the
+        client must start again from 0), else (entries, last_seq, more,
+        horizon) where entries are (seq, table, op, id, row or None).
+
+        A client paging through a copy it started from 0 passes back the
+        horizon it was given: while that is still the horizon, no tombstone
+        it has not seen was dropped, even if its since is older.
+        """
+        with self._connection() as conn:
+            # One snapshot for the log and the rows it points at; a batch's
+            # connection is already attached and in its transaction
+            if not conn.in_transaction:
+                retention.attach_archive(conn, self.db_path)
+                conn.execute('BEGIN')
+            current = changelog.horizon(conn)
+            if 0 < since < current and horizon != current:
+                return None
+            log, last_seq, more = changelog.changes_since(conn, since, limit)
+            ids = {}
+            for _, table, op, row_id in log:
+                if op != 'delete':
+                    ids.setdefault(table, []).append(row_id)
+            rows = {}
+            for table, table_ids in ids.items():
+                placeholders = ', '.join('?' * len(table_ids))
+                # Readings may have moved to the archive since they changed
+                source = 'water_parameters_all' if table == 'water_parameters' else table
+                for row in conn.execute(f'SELECT * FROM {source} WHERE id IN ({placeholders})', table_ids):
+                    rows[table, row['id']] = dict(row)
+        entries = [(seq, table, op, row_id, rows.get((table, row_id))) for seq, table, op, row_id in log]
+        return entries, last_seq, more, current
+
+    # Idempotency keys (see idempotency.py)
+
+    def idempotency_key(self, key):
+        """(method, path, status, body, created) for a key, or None"""
+        with self._connection() as conn:
+            row = conn.execute('SELECT method, path, status, response, created FROM idempotency_keys WHERE key = ?',
+                               (key,)).fetchone()
+        if row is None:
+            return None
+        return row[0], row[1], row[2], json.loads(row[3]) if row[3] is not None else None, row[4]
+
+    def save_response(self, key, method, path, status, body):
+        """Store the response for a key; queued, the caller does not wait"""
+        def save(conn):
+            conn.execute('''
+                INSERT INTO idempotency_keys (key, method, path, status, response, created)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (key) DO UPDATE SET status = excluded.status, response = excluded.response
+            ''', (key, method, path, status, json.dumps(body), clock.now_ms()))
+        database.submit(self.db_path, save)
+
+    def release_key(self, key):
+        """Forget a pending key whose request failed; queued"""
+        database.submit(self.db_path, lambda conn: conn.execute(
+            'DELETE FROM idempotency_keys WHERE key = ? AND status IS NULL', (key,)))
+
+
+class _BoundRepository(SQLiteRepository):
+    """SQLiteRepository running everything on one connection (see batch())"""
+
+    def __init__(self, db_path, conn, writable):
+        super().__init__(db_path)
+        self.conn = conn
+        self.writable = writable
+
+    def _read(self, sql, params=(), archive=False):
+        cursor = self.conn.cursor()
+        cursor.row_factory = None
+        cursor.execute(sql, params)
+        return Rows(cursor.description, cursor.fetchmany)
+
+    @contextlib.contextmanager
+    def _connection(self):
+        yield self.conn
+
+    def _write(self, job):
+        return job(self.conn)
+
+    def batch(self, fn, write=True):
+        return fn(self)
+
+    @contextlib.contextmanager
+    def isolated(self):
+        """Undo the changes made inside the block if it raises"""
+        if not self.writable:
+            yield
+            return
+        self.conn.execute('SAVEPOINT isolated')
+        try:
+            yield
+        except BaseException:
+            self.conn.execute('ROLLBACK TO isolated')
+            raise
+        finally:
+            self.conn.execute('RELEASE isolated')
+
+
+# Stands in for NULL in index keys; SQLite sorts NULL first
+NULL_KEY = -math.inf
+
+
+class _Table:
+    """Rows by id, plus a sorted (order columns..., id) index when ordered
+
+    order is a column or a tuple of columns. With where, only the rows it
+    accepts are indexed (e.g. active tasks).
+    """
+
+    def __init__(self, name, order=None, where=None):
+        self.name = name
+        self.columns = COLUMNS[name]
+        self.order = (order,) if isinstance(order, str) else order
+        self.where = where
+        self.rows = {}
+        self.index = []
+        self.next_id = 1
+
+    def key(self, row):
+        return (*(NULL_KEY if row[column] is None else row[column] for column in self.order), row['id'])
+
+    def _indexed(self, row):
+        return self.order is not None and (self.where is None or self.where(row))
+
+    def insert(self, values, row_id=None):
+        row = dict.fromkeys(self.columns)
+        row.update({k: int(v) if isinstance(v, bool) else v for k, v in values.items()})
+        row['id'] = row_id or self.next_id
+        self.next_id = max(self.next_id, row['id'] + 1)
+        self.rows[row['id']] = row
+        if self._indexed(row):
+            bisect.insort(self.index, self.key(row))
+        return row['id']
+
+    def update(self, row_id, values):
+        row = self.rows[row_id]
+        # A new dict, so copies made by snapshot() keep the old values
+        new = {**row, **{k: int(v) if isinstance(v, bool) else v for k, v in values.items()}}
+        if self._indexed(row):
+            del self.index[bisect.bisect_left(self.index, self.key(row))]
+        if self._indexed(new):
+            bisect.insort(self.index, self.key(new))
+        self.rows[row_id] = new
+
+    def snapshot(self):
+        return dict(self.rows), list(self.index), self.next_id
+
+    def restore(self, snapshot):
+        self.rows, self.index, self.next_id = snapshot
+
+    def delete(self, row_id):
+        row = self.rows.pop(row_id, None)
+        if row is None:
+            return False
+        if self._indexed(row):
+            del self.index[bisect.bisect_left(self.index, self.key(row))]
+        return True
+
+    def span(self, prefix=(), since=None, until=None):
+        """Index positions [low, high) of the keys starting with prefix whose
+        next order column is in [since, until); a bound leaves out NULLs"""
+        low, high = 0, len(self.index)
+        if prefix:
+            low = bisect.bisect_left(self.index, prefix)
+            high = bisect.bisect_left(self.index, (*prefix[:-1], prefix[-1] + 1))
+        if since is not None or until is not None:
+            low = max(low, bisect.bisect_right(self.index, (*prefix, NULL_KEY, math.inf)))
+        if since is not None:
+            low = max(low, bisect.bisect_left(self.index, (*prefix, since)))
+        if until is not None:
+            high = min(high, bisect.bisect_left(self.index, (*prefix, until)))
+        return low, max(low, high)
+
+    def page(self, since=None, until=None, before_id=None, limit=-1, prefix=()):
+        """Rows newest first in index order, like the SQL list queries
+
+        prefix limits them to keys starting with it (an id column, such as
+        task_completions.task_id).
+        """
+        low, high = self.span(prefix, since, until)
+        if before_id is not None:
+            before = self.rows.get(before_id)
+            if before is None:
+                return []
+            high = min(high, bisect.bisect_left(self.index, (*prefix, *self.key(before)[len(prefix):])))
+        if limit >= 0:
+            low = max(low, high - limit)
+        return [self.rows[key[-1]] for key in reversed(self.index[low:high])]
+
+
+class MemoryRepository:
+    """Repository that keeps everything in process memory
+
+    Not persistent and not shared between worker processes. There is no
+    archive, so daily summaries are always empty.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.tables = {
+            'water_parameters': _Table('water_parameters', 'timestamp'),
+            'maintenance_log': _Table('maintenance_log', 'timestamp'),
+            # Active tasks soonest due first, for the filters and buckets
+            'scheduled_tasks': _Table('scheduled_tasks', 'next_due', where=lambda row: row['active'] == 1),
+            'fish_inventory': _Table('fish_inventory', 'added_date'),
+            # Each task's completions together, like idx_task_completions_task
+            'task_completions': _Table('task_completions', ('task_id', 'completed_at')),
+        }
+        self.task_stats = {}  # task id -> task_stats row
+        self.log = {}       # seq -> (table, op, id), in seq order
+        self.latest = {}    # (table, id) -> seq of its log entry
+        self.seq = 0
+        self.keys = {}      # idempotency key -> [method, path, status, body, created]
+
+    @classmethod
+    def from_sqlite(cls, db_path):
+        """A MemoryRepository holding a copy of an existing database"""
+        repo = cls()
+        conn = sqlite3.connect(db_path)
+        conn.row_factory = sqlite3.Row
+        try:
+            for name, table in repo.tables.items():
+                for row in conn.execute(f'SELECT * FROM {name}'):
+                    repo._insert(name, dict(row), row_id=row['id'])
+            repo.task_stats = {row['task_id']: dict(row) for row in conn.execute('SELECT * FROM task_stats')}
+        finally:
+            conn.close()
+        return repo
+
+    def _record(self, table, op, row_id):
+        previous = self.latest.pop((table, row_id), None)
+        if previous is not None:
+            del self.log[previous]
+        self.seq += 1
+        self.log[self.seq] = (table, op, row_id)
+        self.latest[table, row_id] = self.seq
+
+    def _write(self, job):
+        """Run job() under the lock; reserves the request's idempotency key"""
+        pending = idempotency.pending()
+        with self.lock:
+            try:
+                return idempotency.bind(lambda _: job(), self._reserve_key)(None)
+            except Exception:
+                if pending is not None and not pending['reserved']:
+                    self.keys.pop(pending['key'], None)
+                raise
+
+    def batch(self, fn, write=True):
+        """Run fn(self) holding the lock
+
+        With write, the data is copied first and put back if fn raises, so
+        the batch is all or nothing. Steps inside it are not isolated.
+        """
+        with self.lock:
+            if not write:
+                return fn(self)
+            tables = {name: table.snapshot() for name, table in self.tables.items()}
+            log = (dict(self.log), dict(self.latest), self.seq, dict(self.task_stats))
+            try:
+                return self._write(lambda: fn(self))
+            except Exception:
+                for name, table in self.tables.items():
+                    table.restore(tables[name])
+                self.log, self.latest, self.seq, self.task_stats = log
+                raise
+
+    def isolated(self):
+        return contextlib.nullcontext()
+
+    def _insert(self, name, values, row_id=None):
+        row_id = self.tables[name].insert(values, row_id)
+        self._record(name, 'insert', row_id)
+        return row_id
+
+    def _delete(self, name, row_id):
+        if self.tables[name].delete(row_id):
+            self._record(name, 'delete', row_id)
+
+    @staticmethod
+    def _rows(columns, rows):
+        return Rows.from_values(columns, (tuple(row[c] for c in columns) for row in rows))
+
+    # Water parameters
+
+    def parameters(self, columns, since=None, until=None, before_id=None, limit=50):
+        with self.lock:
+            rows = self.tables['water_parameters'].page(since, until, before_id, limit)
+        return self._rows(columns, rows)
+
+    def daily_parameters(self, columns, since=None, until=None):
+        return Rows.from_values(columns, ())
+
+    def add_reading(self, values):
+        return self._write(lambda: self._insert('water_parameters', values))
+
+    def delete_reading(self, reading_id):
+        self._write(lambda: self._delete('water_parameters', reading_id))
+
+    # Maintenance log
+
+    def maintenance(self, columns, before_id=None, limit=50):
+        with self.lock:
+            rows = self.tables['maintenance_log'].page(before_id=before_id, limit=limit)
+        return self._rows(columns, rows)
+
+    def add_maintenance(self, values):
+        return self._write(lambda: self._insert('maintenance_log', {'completed': 1, **values}))
+
+    # Scheduled tasks
+
+    def _active_tasks(self, low, high, text):
+        """Active tasks at index positions [low, high) matching text"""
+        tasks = self.tables['scheduled_tasks']
+        rows = (tasks.rows[tasks.index[i][-1]] for i in range(low, high))
+        if not text:
+            return rows
+        needle = text.lower()
+        return (row for row in rows
+                if any(needle in (row[column] or '').lower() for column in ('task_name', 'description')))
+
+    def scheduled(self, columns, since=None, until=None, text=None, after_id=None, limit=-1):
+        with self.lock:
+            tasks = self.tables['scheduled_tasks']
+            low, high = tasks.span(since=since, until=until)
+            if after_id is not None:
+                after = tasks.rows.get(after_id)
+                if after is None or after['next_due'] is None:
+                    high = low
+                else:
+                    low = max(low, bisect.bisect_right(tasks.index, (after['next_due'], after_id)))
+            rows = list(islice(self._active_tasks(low, high, text), None if limit < 0 else limit))
+        return self._rows(columns, rows)
+
+    def task_counts(self, now, text=None):
+        counts = {}
+        with self.lock:
+            for name, (since, until) in task_buckets(now).items():
+                low, high = self.tables['scheduled_tasks'].span(since=since, until=until)
+                counts[name] = max(0, high - low) if not text else sum(1 for _ in self._active_tasks(low, high, text))
+        return counts
+
+    def add_task(self, values):
+        return self._write(lambda: self._insert('scheduled_tasks', {'active': 1, 'is_recurring': 1, **values}))
+
+    def complete_task(self, task_id, task_name, now):
+        def complete():
+            tasks = self.tables['scheduled_tasks']
+            row = tasks.rows.get(task_id)
+            if row is None:
+                return False
+            if row['is_recurring']:
+                tasks.update(task_id, {'last_completed': now, 'next_due': now + row['frequency_days'] * clock.DAY_MS})
+            else:
+                tasks.update(task_id, {'last_completed': now, 'active': 0})
+            self._record('scheduled_tasks', 'update', task_id)
+            self._add_completion(task_id, row['next_due'], now)
+            self._insert('maintenance_log', {'timestamp': now, 'task_type': task_name,
+                                             'description': COMPLETED_TASK, 'completed': 1})
+            return True
+        return self._write(complete)
+
+    def _add_completion(self, task_id, due_at, completed_at):
+        """Log a completion and update task_stats like the SQLite trigger"""
+        done = on_time(due_at, completed_at)
+        self._insert('task_completions', {'task_id': task_id, 'due_at': due_at, 'completed_at': completed_at,
+                                          'on_time': None if done is None else int(done)})
+        if done is None:
+            return
+        done = int(done)
+        stats = self.task_stats.get(task_id) or {'task_id': task_id, 'completions': 0, 'on_time': 0,
+                                                 'late_ms': 0, 'streak': 0, 'best_streak': 0}
+        streak = stats['streak'] + 1 if done else 0
+        self.task_stats[task_id] = {
+            **stats,
+            'completions': stats['completions'] + 1,
+            'on_time': stats['on_time'] + done,
+            'late_ms': stats['late_ms'] + (0 if done else completed_at - due_at),
+            'streak': streak,
+            'best_streak': max(stats['best_streak'], streak),
+        }
+
+    def delete_task(self, task_id):
+        def delete():
+            self._delete('scheduled_tasks', task_id)
+            completions = self.tables['task_completions']
+            low, high = completions.span((task_id,))
+            for key in completions.index[low:high]:
+                self._delete('task_completions', key[-1])
+            self.task_stats.pop(task_id, None)
+        self._write(delete)
+
+    def task_history(self, task_id, before_id=None, limit=50):
+        with self.lock:
+            if task_id not in self.tables['scheduled_tasks'].rows:
+                return None
+            completions = self.tables['task_completions'].page(before_id=before_id, limit=limit, prefix=(task_id,))
+            stats = self.task_stats.get(task_id)
+        return stats, [dict(row) for row in completions]
+
+    # Fish inventory
+
+    def fish(self, columns):
+        with self.lock:
+            rows = self.tables['fish_inventory'].page()
+        return self._rows(columns, rows)
+
+    def add_fish(self, values):
+        return self._write(lambda: self._insert('fish_inventory', {'quantity': 1, **values}))
+
+    def delete_fish(self, fish_id):
+        self._write(lambda: self._delete('fish_inventory', fish_id))
+
+    # Summaries and sync
+
+    def stats(self, now):
+        with self.lock:
+            readings = self.tables['water_parameters']
+            latest = readings.rows[readings.index[-1][1]] if readings.index else None
+            # Active tasks due by the horizon (next_due <= it)
+            low, high = self.tables['scheduled_tasks'].span(until=now + UPCOMING_DAYS * clock.DAY_MS + 1)
+            upcoming = high - low
+            total_fish = sum(row['quantity'] or 0 for row in self.tables['fish_inventory'].rows.values())
+            log = self.tables['maintenance_log'].index
+            recent = len(log) - bisect.bisect_left(log, (now - RECENT_DAYS * clock.DAY_MS,))
+        return {
+            'latest_parameters': dict(latest) if latest else None,
+            'upcoming_tasks': upcoming,
+            'total_fish': total_fish,
+            'recent_maintenance': recent
+        }
+
+    def changes(self, since, limit, horizon=None):
+        """See SQLiteRepository.changes; tombstones are never compacted here"""
+        with self.lock:
+            log = [(seq, *entry) for seq, entry in self.log.items() if seq > since]
+            more = len(log) > limit
+            entries = []
+            for seq, table, op, row_id in log[:limit]:
+                row = self.tables[table].rows.get(row_id) if op != 'delete' else None
+                entries.append((seq, table, op, row_id, dict(row) if row else None))
+        return entries, entries[-1][0] if entries else since, more, 0
+
+    # Idempotency keys
+
+    def idempotency_key(self, key):
+        with self.lock:
+            entry = self.keys.get(key)
+            return tuple(entry) if entry else None
+
+    def _reserve_key(self, _, key, method, path):
+        now = clock.now_ms()
+        if key in self.keys and self.keys[key][4] >= now - idempotency.TTL_MS:
+            return False
+        self.keys[key] = [method, path, None, None, now]
+        return True
+
+    def save_response(self, key, method, path, status, body):
+        with self.lock:
+            entry = self.keys.setdefault(key, [method, path, None, None, clock.now_ms()])
+            entry[2:4] = [status, body]
+
+    def release_key(self, key):
+        with self.lock:
+            if key in self.keys and self.keys[key][2] is None:
+                del self.keys[key]
+
+
+_sqlite = {}
+
+
+def sqlite(db_path):
+    """The SQLiteRepository for a database path"""
+    repo = _sqlite.get(str(db_path))
+    if repo is None:
+        repo = _sqlite[str(db_path)] = SQLiteRepository(db_path)
+    return repo
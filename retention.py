@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""
+Tiered Retention for Water Parameters
+Raw readings older than WATERSCRIBE_RETENTION_DAYS move from the main
+database into an archive file (aquarium-archive.db by default), and each
+archived day is summarised into water_parameters_daily (count plus
+min/avg/max per parameter), which stays in the main database.
+
+Whole local days move together, a few thousand rows per transaction, so
+writers are only held up briefly and a day's summary always covers all of
+its rows. Archived readings keep their change log entry, so a client
+syncing from 0 still receives them.
+The main database stays small enough to live in the page cache; old data
+is still reachable through the water_parameters_all TEMP VIEW, a UNION ALL
+of both files that attach_archive() sets up on a connection.
+
+Retention is off (WATERSCRIBE_RETENTION_DAYS=0) unless configured; when on,
+the housekeeping job archives once per pass.
+
+Usage (archive now, e.g. the first time on a large database):
+    python3 retention.py --db aquarium.db --days 90
+"""
+
+import argparse
+import os
+import sqlite3
+import time
+from pathlib import Path
+
+import clock
+
+RETENTION_DAYS = int(os.environ.get('WATERSCRIBE_RETENTION_DAYS', '0'))
+ARCHIVE_DB = os.environ.get('WATERSCRIBE_ARCHIVE_DB')
+
+BATCH_ROWS = 20_000
+BATCH_PAUSE = 0.05
+COLUMNS = 'id, timestamp, temperature, ph, ammonia, nitrite, nitrate, notes'
+METRICS = ('temperature', 'ph', 'ammonia', 'nitrite', 'nitrate')
+
+ARCHIVE_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS archive.water_parameters (
+        id INTEGER PRIMARY KEY,
+        timestamp INTEGER NOT NULL,
+        temperature REAL,
+        ph REAL,
+        ammonia REAL,
+        nitrite REAL,
+        nitrate REAL,
+        notes TEXT
+    ) STRICT
+    ''',
+    'CREATE INDEX IF NOT EXISTS archive.idx_water_parameters_timestamp ON water_parameters (timestamp)',
+]
+
+_DAILY_COLUMNS = ', '.join(f'{m}_min, {m}_avg, {m}_max' for m in METRICS)
+_DAILY_VALUES = ', '.join(f'MIN({m}), AVG({m}), MAX({m})' for m in METRICS)
+
+
+def archive_path(db_path):
+    """Archive file for a database: WATERSCRIBE_ARCHIVE_DB or <name>-archive.db alongside it"""
+    if ARCHIVE_DB:
+        return Path(ARCHIVE_DB)
+    db_path = Path(db_path)
+    return db_path.with_name(f'{db_path.stem}-archive{db_path.suffix}')
+
+
+def attach_archive(conn, db_path, create=False):
+    """ATTACH the archive as 'archive' and create the water_parameters_all view
+
+    Without an archive file (and without create) the view covers only the
+    main table and False is returned, so callers can always query the view.
+    Safe to call again on a connection that is kept open (pooled readers,
+    the writer): an archive created since the last call is picked up.
+    """
+    path = archive_path(db_path)
+    attached = any(row[1] == 'archive' for row in conn.execute('PRAGMA database_list'))
+    if not attached and not create and not path.exists():
+        conn.execute(f'''
+            CREATE TEMP VIEW IF NOT EXISTS water_parameters_all AS
+            SELECT {COLUMNS} FROM main.water_parameters
+        ''')
+        return False
+    if not attached:
+        # Replace a main-only view from before the archive existed
+        conn.execute('DROP VIEW IF EXISTS temp.water_parameters_all')
+        conn.execute('ATTACH DATABASE ? AS archive', (str(path),))
+    if create:
+        for sql in ARCHIVE_SCHEMA:
+            conn.execute(sql)
+    conn.execute(f'''
+        CREATE TEMP VIEW IF NOT EXISTS water_parameters_all AS
+        SELECT {COLUMNS} FROM main.water_parameters
+        UNION ALL
+        SELECT {COLUMNS} FROM archive.water_parameters
+    ''')
+    return True
+
+
+def summarize_day(conn, day_start, day_end):
+    """Recompute one day's row in water_parameters_daily from both databases"""
+    conn.execute(f'''
+        INSERT OR REPLACE INTO main.water_parameters_daily (day, readings, {_DAILY_COLUMNS})
+        SELECT ?, COUNT(*), {_DAILY_VALUES} FROM water_parameters_all
+        WHERE timestamp >= ? AND timestamp < ?
+    ''', (day_start, day_start, day_end))
+    conn.execute('DELETE FROM main.water_parameters_daily WHERE day = ? AND readings = 0', (day_start,))
+
+
+def day_summaries(conn, since, until):
+    """water_parameters_daily rows for the archived days in [since, until)
+
+    since is a local midnight. Rows are (day, readings, temperature_min,
+    ...) in column order, computed over both databases like summarize_day().
+    """
+    rows = []
+    day = since
+    while day < until:
+        first = conn.execute('''
+            SELECT MIN(timestamp) FROM archive.water_parameters
+            WHERE timestamp >= ? AND timestamp < ?
+        ''', (day, until)).fetchone()[0]
+        if first is None:
+            break
+        day = clock.local_midnight(first)
+        next_day = clock.local_midnight(first, 1)
+        rows.append(tuple(conn.execute(f'''
+            SELECT ?, COUNT(*), {_DAILY_VALUES} FROM water_parameters_all
+            WHERE timestamp >= ? AND timestamp < ?
+        ''', (day, day, next_day)).fetchone()))
+        day = next_day
+    return rows
+
+
+def replace_day_summaries(conn, since, until, rows):
+    """Replace the daily summaries for [since, until) with rows from day_summaries()"""
+    conn.execute('DELETE FROM main.water_parameters_daily WHERE day >= ? AND day < ?', (since, until))
+    conn.executemany(f'''
+        INSERT INTO main.water_parameters_daily (day, readings, {_DAILY_COLUMNS})
+        VALUES ({', '.join('?' * (2 + 3 * len(METRICS)))})
+    ''', rows)
+
+
+def _copy_day(conn, day_start, day_end):
+    """Copy one day's readings to the archive; safe to repeat"""
+    return conn.execute(f'''
+        INSERT OR REPLACE INTO archive.water_parameters ({COLUMNS})
+        SELECT {COLUMNS} FROM main.water_parameters
+        WHERE timestamp >= ? AND timestamp < ?
+    ''', (day_start, day_end)).rowcount
+
+
+def _remove_day(conn, day_start, day_end):
+    """Delete one day's readings that are in the archive as they are, and summarise it"""
+    matches = ' AND '.join(f'a.{c} IS m.{c}' for c in COLUMNS.split(', ') if c != 'id')
+    moved = conn.execute(f'''
+        DELETE FROM main.water_parameters AS m
+        WHERE timestamp >= ? AND timestamp < ?
+          AND EXISTS (SELECT 1 FROM archive.water_parameters AS a WHERE a.id = m.id AND {matches})
+    ''', (day_start, day_end)).rowcount
+    summarize_day(conn, day_start, day_end)
+    return moved
+
+
+def archive_old_readings(db_path, days=RETENTION_DAYS, now=None, progress=None):
+    """Move readings from before the retention window to the archive
+
+    Returns the number of rows moved.
+
+    A transaction spanning the main and archive files is not atomic across
+    them in WAL mode: a crash while committing can keep one file's half.
+    So each batch is copied to the archive and committed first, then
+    deleted from the main database in a second transaction. A crash in
+    between leaves rows in both files, which the next run copies again
+    (harmlessly) and removes; a row written in between is only removed
+    once the archive has it as it is now.
+    """
+    cutoff = clock.local_midnight(now or clock.now_ms(), -days)
+    conn = sqlite3.connect(db_path, timeout=10.0, isolation_level=None)
+    try:
+        oldest = conn.execute('SELECT MIN(timestamp) FROM water_parameters').fetchone()[0]
+        if oldest is None or oldest >= cutoff:
+            return 0
+        attach_archive(conn, db_path, create=True)
+
+        moved = 0
+        while oldest is not None and oldest < cutoff:
+            # Whole days until the batch is big enough
+            batch, ranges = 0, []
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                while oldest is not None and oldest < cutoff and batch < BATCH_ROWS:
+                    day_start = clock.local_midnight(oldest)
+                    day_end = min(clock.local_midnight(oldest, 1), cutoff)
+                    batch += _copy_day(conn, day_start, day_end)
+                    ranges.append((day_start, day_end))
+                    oldest = conn.execute('SELECT MIN(timestamp) FROM main.water_parameters WHERE timestamp >= ?',
+                                          (day_end,)).fetchone()[0]
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                first_seq = conn.execute('SELECT COALESCE(MAX(seq), 0) FROM main.changes').fetchone()[0]
+                for day_start, day_end in ranges:
+                    moved += _remove_day(conn, day_start, day_end)
+                # Archived rows are still readings, not deletes. The delete
+                # trigger dropped each row's insert/update entry for a
+                # tombstone; make that an update again, so since=0 still
+                # lists the row (served from water_parameters_all)
+                conn.execute("UPDATE main.changes SET op = 'update' WHERE seq > ? AND op = 'delete'", (first_seq,))
+                # Rows left behind (changed since the copy) go in a later batch
+                oldest = conn.execute('SELECT MIN(timestamp) FROM main.water_parameters').fetchone()[0]
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+            if progress:
+                progress(f"  up to {clock.iso(day_start)[:10]}: {moved:,} rows archived")
+            # Let request writes in between batches
+            time.sleep(BATCH_PAUSE)
+        return moved
+    finally:
+        conn.close()
+
+
+def delete_archived_reading(conn, db_path, reading_id):
+    """Delete a reading from the archive and refresh its daily summary
+
+    Returns True if the reading was found there.
+    """
+    if not archive_path(db_path).exists():
+        return False
+    attach_archive(conn, db_path)
+    row = conn.execute('SELECT timestamp FROM archive.water_parameters WHERE id = ?',
+                       (reading_id,)).fetchone()
+    if row is None:
+        return False
+    conn.execute('DELETE FROM archive.water_parameters WHERE id = ?', (reading_id,))
+    day_start = clock.local_midnight(row[0])
+    summarize_day(conn, day_start, clock.local_midnight(row[0], 1))
+    return True
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Move old water parameter readings to the archive database.')
+    parser.add_argument('--db', default='aquarium.db', help='database path (default: aquarium.db)')
+    parser.add_argument('--days', type=int, default=RETENTION_DAYS or 90,
+                        help='days of raw readings to keep (default: WATERSCRIBE_RETENTION_DAYS or 90)')
+    args = parser.parse_args()
+
+    if not Path(args.db).exists():
+        print(f"Error: Database not found at {args.db}")
+        raise SystemExit(1)
+
+    from app import init_db
+    init_db(args.db)
+
+    print(f"Archiving readings older than {args.days} days to {archive_path(args.db)}...")
+    started = time.perf_counter()
+    total = archive_old_readings(args.db, args.days, progress=print)
+    print(f"✓ {total:,} rows archived in {time.perf_counter() - started:.1f}s")
+    print("Run 'python3 housekeeping.py' to release the freed space")
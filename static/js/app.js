@@ -0,0 +1,425 @@
+// API helper
+//
+// Reads are saved to IndexedDB and served from there when the network is
+// down. Writes that cannot reach the server are queued with an idempotency
+// key and replayed through /api/sync once the connection is back.
+async function api(endpoint, method = 'GET', data = null) {
+    const options = {
+        method,
+        headers: { 'Content-Type': 'application/json' }
+    };
+    if (data) options.body = JSON.stringify(data);
+    const key = method === 'GET' ? null : newIdempotencyKey();
+    if (key) options.headers['Idempotency-Key'] = key;
+
+    let response;
+    try {
+        response = await fetch(`/api${endpoint}`, options);
+    } catch (error) {
+        if (method === 'GET') {
+            const cached = await loadResponse(endpoint).catch(() => undefined);
+            if (cached === undefined) throw error;
+            setSyncStatus();
+            return cached;
+        }
+        await queueRequest({ key, method, path: `/api${endpoint}`, body: data });
+        requestBackgroundSync();
+        setSyncStatus();
+        return { success: true, queued: true };
+    }
+
+    const result = await response.json();
+    if (method === 'GET' && response.ok && !endpoint.includes('before_id=')) {
+        saveResponse(endpoint, result).catch(() => {});
+    }
+    return result;
+}
+
+// Offline queue
+async function setSyncStatus() {
+    const status = document.getElementById('sync-status');
+    const pending = await pendingRequests().catch(() => []);
+    if (!navigator.onLine || pending.length) {
+        status.textContent = pending.length
+            ? `Offline · ${pending.length} change${pending.length === 1 ? '' : 's'} waiting to sync`
+            : 'Offline · showing saved data';
+        status.hidden = false;
+    } else {
+        status.hidden = true;
+    }
+}
+
+async function requestBackgroundSync() {
+    // Chromium only; elsewhere the 'online' event below does the flush
+    const registration = await navigator.serviceWorker?.ready;
+    await registration?.sync?.register('outbox').catch(() => {});
+}
+
+async function syncNow() {
+    try {
+        if (await flushOutbox()) {
+            loadStats();
+            loadParameters();
+            loadMaintenance();
+            loadScheduledTasks();
+            loadFish();
+        }
+    } catch (error) {
+        console.warn('Sync failed, will retry when back online:', error);
+    }
+    setSyncStatus();
+}
+
+window.addEventListener('online', syncNow);
+window.addEventListener('offline', setSyncStatus);
+
+// Service workers need HTTPS (or localhost); without one the page still
+// queues writes while it stays open
+if ('serviceWorker' in navigator) {
+    navigator.serviceWorker.register('/sw.js').catch(error => console.warn('Service worker not registered:', error));
+}
+
+// Paged lists: newest first, older pages fetched with ?before_id=
+const PAGE_SIZE = 50;
+
+// Reload the first page, keeping older rows already loaded below it
+async function refreshPaged(list, endpoint) {
+    const page = await api(`${endpoint}?limit=${PAGE_SIZE}`);
+    const last = page[page.length - 1];
+    const overlap = last ? list.items.findIndex(item => item.id === last.id) : -1;
+    if (overlap >= 0) {
+        list.setItems(page.concat(list.items.slice(overlap + 1)), list.hasMore);
+    } else {
+        list.setItems(page, page.length === PAGE_SIZE);
+    }
+}
+
+async function loadOlder(list, endpoint) {
+    const last = list.items[list.items.length - 1];
+    if (!last) return refreshPaged(list, endpoint);
+    const page = await api(`${endpoint}?limit=${PAGE_SIZE}&before_id=${last.id}`);
+    list.append(page, page.length === PAGE_SIZE);
+}
+
+// Tab switching
+function switchTab(tabName) {
+    document.querySelectorAll('.tab-btn').forEach(btn => btn.classList.remove('active'));
+    document.querySelectorAll('.tab-content').forEach(content => content.classList.remove('active'));
+
+    event.target.classList.add('active');
+    document.getElementById(`tab-${tabName}`).classList.add('active');
+}
+
+// Load dashboard stats
+async function loadStats() {
+    const stats = await api('/stats');
+    const dashboard = document.getElementById('dashboard');
+
+    const latest = stats.latest_parameters;
+
+    dashboard.innerHTML = `
+        <div class="stat-card">
+            <div class="stat-label">Temperature</div>
+            <div class="stat-value">${latest?.temperature || '--'}<span class="stat-unit">°F</span></div>
+        </div>
+        <div class="stat-card">
+            <div class="stat-label">pH Level</div>
+            <div class="stat-value">${latest?.ph || '--'}</div>
+        </div>
+        <div class="stat-card">
+            <div class="stat-label">Upcoming Tasks</div>
+            <div class="stat-value">${stats.upcoming_tasks}<span class="stat-unit">this week</span></div>
+        </div>
+        <div class="stat-card">
+            <div class="stat-label">Total Fish</div>
+            <div class="stat-value">${stats.total_fish}</div>
+        </div>
+    `;
+}
+
+// Water Parameters
+async function submitParameters() {
+    const form = document.getElementById('parameters-form');
+    const formData = new FormData(form);
+    const data = Object.fromEntries(formData);
+
+    await api('/parameters', 'POST', data);
+    form.reset();
+    loadParameters();
+    loadStats();
+}
+
+function renderParameter(p) {
+    return `
+        <div class="log-entry" style="display: flex; justify-content: space-between; align-items: flex-start;">
+            <div style="flex: 1;">
+                <div class="log-timestamp">${new Date(p.timestamp).toLocaleString()}</div>
+                <div class="log-details">
+                    Temp: ${p.temperature}°F | pH: ${p.ph} | 
+                    NH₃: ${p.ammonia}ppm | NO₂: ${p.nitrite}ppm | NO₃: ${p.nitrate}ppm
+                    ${p.notes ? `<br><em>${p.notes}</em>` : ''}
+                </div>
+            </div>
+            <button onclick="deleteParameter(${p.id})" style="padding: 8px 16px; font-size: 0.85rem; margin-left: 15px; background: rgba(255, 107, 157, 0.2); border: 1px solid var(--coral);">Delete</button>
+        </div>
+    `;
+}
+
+const parameterList = new VirtualList(document.getElementById('parameters-log'), {
+    render: renderParameter,
+    empty: 'No parameters logged yet',
+    loadMore: () => loadOlder(parameterList, '/parameters')
+});
+
+async function loadParameters() {
+    await refreshPaged(parameterList, '/parameters');
+}
+
+async function deleteParameter(id) {
+    if (!confirm('Delete this water parameter reading?')) {
+        return;
+    }
+
+    try {
+        await api(`/parameters?id=${id}`, 'DELETE');
+        parameterList.remove(id);
+        loadStats();
+    } catch (error) {
+        console.error('Error deleting parameter:', error);
+        alert('Failed to delete parameter. Please try again.');
+    }
+}
+
+// Maintenance
+async function submitMaintenance() {
+    const form = document.getElementById('maintenance-form');
+    const formData = new FormData(form);
+    const data = Object.fromEntries(formData);
+
+    await api('/maintenance', 'POST', data);
+    form.reset();
+    loadMaintenance();
+    loadStats();
+}
+
+function renderMaintenance(log) {
+    return `
+        <div class="log-entry">
+            <div class="log-timestamp">${new Date(log.timestamp).toLocaleString()}</div>
+            <div class="log-details">
+                <strong>${log.task_type}</strong>
+                ${log.description ? `<br>${log.description}` : ''}
+            </div>
+        </div>
+    `;
+}
+
+const maintenanceList = new VirtualList(document.getElementById('maintenance-log'), {
+    render: renderMaintenance,
+    empty: 'No maintenance logged yet',
+    loadMore: () => loadOlder(maintenanceList, '/maintenance')
+});
+
+async function loadMaintenance() {
+    await refreshPaged(maintenanceList, '/maintenance');
+}
+
+// Toggle between recurring and one-time task inputs
+function toggleTaskType() {
+    const taskType = document.getElementById('task-type-select').value;
+    const frequencyGroup = document.getElementById('frequency-group');
+    const dateGroup = document.getElementById('date-group');
+    const frequencyInput = document.getElementById('frequency-input');
+    const dateInput = document.getElementById('date-input');
+
+    if (taskType === 'recurring') {
+        frequencyGroup.style.display = 'flex';
+        dateGroup.style.display = 'none';
+        frequencyInput.required = true;
+        dateInput.required = false;
+    } else {
+        frequencyGroup.style.display = 'none';
+        dateGroup.style.display = 'flex';
+        frequencyInput.required = false;
+        dateInput.required = true;
+    }
+}
+
+// Scheduled Tasks
+async function submitScheduledTask() {
+    try {
+        const form = document.getElementById('schedule-form');
+        const formData = new FormData(form);
+        const data = Object.fromEntries(formData);
+        const taskType = data.task_type;
+
+        // Validate required fields
+        if (!data.task_name || data.task_name.trim() === '') {
+            alert('Please enter a task name');
+            return;
+        }
+
+        // Remove task_type from data (not needed in backend)
+        delete data.task_type;
+
+        if (taskType === 'recurring') {
+            if (!data.frequency_days) {
+                alert('Please enter a frequency in days');
+                return;
+            }
+            data.frequency_days = parseInt(data.frequency_days);
+            if (isNaN(data.frequency_days) || data.frequency_days < 1) {
+                alert('Frequency must be at least 1 day');
+                return;
+            }
+            data.is_recurring = true;
+            delete data.specific_date;
+        } else {
+            if (!data.specific_date) {
+                alert('Please select a date');
+                return;
+            }
+            data.is_recurring = false;
+            delete data.frequency_days;
+        }
+
+        const result = await api('/scheduled', 'POST', data);
+
+        if (result.success) {
+            form.reset();
+            // Reset to recurring view by default
+            document.getElementById('task-type-select').value = 'recurring';
+            toggleTaskType();
+            loadScheduledTasks();
+            loadStats();
+        } else {
+            alert('Failed to add task. Please try again.');
+        }
+    } catch (error) {
+        console.error('Error submitting task:', error);
+        alert('Error adding task: ' + error.message);
+    }
+}
+
+function renderTask(task) {
+    const now = new Date();
+    const nextDue = new Date(task.next_due);
+    const daysUntil = Math.ceil((nextDue - now) / (1000 * 60 * 60 * 24));
+    const isDueSoon = daysUntil <= 3;
+    const isOverdue = daysUntil < 0;
+
+    let taskFrequency = '';
+    if (task.is_recurring) {
+        taskFrequency = `Every ${task.frequency_days} days • Recurring`;
+    } else {
+        taskFrequency = 'One-time task';
+    }
+
+    let daysDisplay = '';
+    if (isOverdue) {
+        daysDisplay = `<strong style="color: var(--coral);">Overdue by ${Math.abs(daysUntil)} days!</strong>`;
+    } else if (daysUntil === 0) {
+        daysDisplay = '<strong style="color: var(--sand);">Due today!</strong>';
+    } else {
+        daysDisplay = `${daysUntil} days`;
+    }
+
+    return `
+        <div class="task-item ${isDueSoon || isOverdue ? 'due-soon' : ''}">
+            <div class="task-info">
+                <h3>${task.task_name} ${!task.is_recurring ? '🎯' : '🔄'}</h3>
+                <div class="task-due">
+                    Due: ${nextDue.toLocaleDateString()} 
+                    (${daysDisplay}) • 
+                    ${taskFrequency}
+                </div>
+                ${task.description ? `<p style="margin-top: 8px; opacity: 0.8;">${task.description}</p>` : ''}
+            </div>
+            <div class="task-actions">
+                <button onclick="completeTask(${task.id}, '${task.task_name}')">✓ Complete</button>
+                <button onclick="deleteTask(${task.id})">Delete</button>
+            </div>
+        </div>
+    `;
+}
+
+const taskList = new KeyedList(document.getElementById('scheduled-tasks'), {
+    render: renderTask,
+    empty: 'No scheduled tasks yet'
+});
+
+async function loadScheduledTasks() {
+    taskList.update(await api('/scheduled'));
+}
+
+async function completeTask(id, name) {
+    await api('/scheduled', 'PUT', { id, task_name: name });
+    loadScheduledTasks();
+    loadMaintenance();
+    loadStats();
+}
+
+async function deleteTask(id) {
+    if (confirm('Delete this scheduled task?')) {
+        await api(`/scheduled?id=${id}`, 'DELETE');
+        loadScheduledTasks();
+        loadStats();
+    }
+}
+
+// Fish Inventory
+async function submitFish() {
+    const form = document.getElementById('fish-form');
+    const formData = new FormData(form);
+    const data = Object.fromEntries(formData);
+    data.quantity = parseInt(data.quantity) || 1;
+
+    await api('/fish', 'POST', data);
+    form.reset();
+    loadFish();
+    loadStats();
+}
+
+function renderFish(f) {
+    return `
+        <div class="fish-card">
+            <div class="fish-info">
+                <h3>${f.common_name || f.species}</h3>
+                <div class="fish-details">
+                    ${f.species}${f.common_name ? ` (${f.species})` : ''} • 
+                    Quantity: ${f.quantity} • 
+                    Added: ${new Date(f.added_date).toLocaleDateString()}
+                    ${f.notes ? `<br>${f.notes}` : ''}
+                </div>
+            </div>
+            <button onclick="deleteFish(${f.id})">Remove</button>
+        </div>
+    `;
+}
+
+const fishList = new KeyedList(document.getElementById('fish-inventory'), {
+    render: renderFish,
+    empty: 'No fish in inventory yet'
+});
+
+async function loadFish() {
+    fishList.update(await api('/fish'));
+}
+
+async function deleteFish(id) {
+    if (confirm('Remove this fish from inventory?')) {
+        await api(`/fish?id=${id}`, 'DELETE');
+        loadFish();
+        loadStats();
+    }
+}
+
+// Initialize
+window.addEventListener('load', () => {
+    syncNow();
+    loadStats();
+    loadParameters();
+    loadMaintenance();
+    loadScheduledTasks();
+    loadFish();
+});
@@ -0,0 +1,220 @@
+// Keyed, incremental list rendering
+//
+// Rows are rendered to HTML strings and keyed by id. An update only touches
+// rows whose HTML changed: new rows are inserted, missing ones removed, and
+// unchanged rows keep their DOM nodes, so there is no full-list reflow.
+
+function htmlToNode(html) {
+    const template = document.createElement('template');
+    template.innerHTML = html.trim();
+    return template.content.firstElementChild;
+}
+
+// Make parent's children match items, in order. cache maps key -> {html, node}
+// for the rows currently rendered and is updated in place.
+function patchKeyed(parent, items, keyOf, render, cache) {
+    const seen = new Set();
+    let ref = parent.firstChild;
+
+    for (const item of items) {
+        const key = keyOf(item);
+        const html = render(item);
+        let entry = cache.get(key);
+
+        if (!entry) {
+            entry = { html, node: htmlToNode(html) };
+            cache.set(key, entry);
+        } else if (entry.html !== html) {
+            const node = htmlToNode(html);
+            if (entry.node.parentNode === parent) {
+                if (ref === entry.node) ref = node;
+                parent.replaceChild(node, entry.node);
+            }
+            entry.html = html;
+            entry.node = node;
+        }
+        seen.add(key);
+
+        if (entry.node === ref) {
+            ref = ref.nextSibling;
+        } else {
+            parent.insertBefore(entry.node, ref);
+        }
+    }
+
+    // Everything after the last row is stale: removed rows, empty-state text
+    while (ref) {
+        const next = ref.nextSibling;
+        parent.removeChild(ref);
+        ref = next;
+    }
+    for (const key of cache.keys()) {
+        if (!seen.has(key)) cache.delete(key);
+    }
+}
+
+function renderEmpty(parent, cache, message) {
+    cache.clear();
+    parent.innerHTML = `<div class="empty-state">${message}</div>`;
+}
+
+// Short lists: every row is rendered, patched in place on update
+class KeyedList {
+    constructor(container, { render, empty, key = item => item.id }) {
+        this.container = container;
+        this.render = render;
+        this.empty = empty;
+        this.key = key;
+        this.cache = new Map();
+        this.items = [];
+    }
+
+    update(items) {
+        this.items = items;
+        if (items.length === 0) {
+            renderEmpty(this.container, this.cache, this.empty);
+            return;
+        }
+        patchKeyed(this.container, items, this.key, this.render, this.cache);
+    }
+}
+
+// Long logs: only the rows in (or near) the scroll viewport exist in the DOM.
+// Row heights are measured as rows are shown; unseen rows use an estimate.
+// loadMore() is called to fetch older rows when the end comes into view.
+class VirtualList {
+    constructor(container, { render, empty, loadMore, key = item => item.id, estimate = 100, overscan = 6 }) {
+        this.container = container;
+        this.render = render;
+        this.empty = empty;
+        this.loadMore = loadMore;
+        this.key = key;
+        this.estimate = estimate;
+        this.overscan = overscan;
+
+        this.items = [];
+        this.ready = false;         // set once the first page has arrived
+        this.hasMore = false;
+        this.loading = false;
+        this.heights = new Map();   // key -> measured height incl. margin
+        this.offsets = null;        // prefix sums of heights, rebuilt lazily
+        this.cache = new Map();     // rendered rows only
+        this.gap = null;
+        this.width = 0;
+        this.frame = 0;
+
+        container.classList.add('virtual-list');
+        this.rows = document.createElement('div');
+        container.replaceChildren(this.rows);
+
+        container.addEventListener('scroll', () => this.schedule(), { passive: true });
+        // Also fires when a hidden tab becomes visible or the tablet rotates
+        new ResizeObserver(() => this.schedule()).observe(container);
+    }
+
+    setItems(items, hasMore) {
+        this.ready = true;
+        this.items = items;
+        this.hasMore = hasMore;
+        this.offsets = null;
+        this.schedule();
+    }
+
+    append(items, hasMore) {
+        this.setItems(this.items.concat(items), hasMore);
+    }
+
+    remove(key) {
+        this.heights.delete(key);
+        this.setItems(this.items.filter(item => this.key(item) !== key), this.hasMore);
+    }
+
+    schedule() {
+        if (!this.frame) {
+            this.frame = requestAnimationFrame(() => {
+                this.frame = 0;
+                this.draw();
+            });
+        }
+    }
+
+    buildOffsets() {
+        const offsets = new Float64Array(this.items.length + 1);
+        for (let i = 0; i < this.items.length; i++) {
+            offsets[i + 1] = offsets[i] + (this.heights.get(this.key(this.items[i])) ?? this.estimate);
+        }
+        this.offsets = offsets;
+    }
+
+    // Index of the row at vertical position y
+    indexAt(y) {
+        let low = 0;
+        let high = this.items.length - 1;
+        while (low < high) {
+            const mid = (low + high + 1) >> 1;
+            if (this.offsets[mid] <= y) low = mid;
+            else high = mid - 1;
+        }
+        return low;
+    }
+
+    draw() {
+        const items = this.items;
+        if (items.length === 0) {
+            if (this.ready && !this.loading) renderEmpty(this.rows, this.cache, this.empty);
+            this.rows.style.paddingTop = this.rows.style.paddingBottom = '0px';
+            this.maybeLoadMore(0);
+            return;
+        }
+
+        const visible = this.container.clientHeight > 0;
+        if (visible && this.container.clientWidth !== this.width) {
+            // Rows reflow at a new width; measure them again
+            this.width = this.container.clientWidth;
+            this.heights.clear();
+            this.offsets = null;
+        }
+        if (!this.offsets) this.buildOffsets();
+
+        const top = this.container.scrollTop;
+        const bottom = top + this.container.clientHeight;
+        const start = Math.max(0, this.indexAt(top) - this.overscan);
+        const end = Math.min(items.length, this.indexAt(bottom) + 1 + this.overscan);
+        const slice = items.slice(start, end);
+
+        this.rows.style.paddingTop = `${this.offsets[start]}px`;
+        this.rows.style.paddingBottom = `${this.offsets[items.length] - this.offsets[end]}px`;
+        patchKeyed(this.rows, slice, this.key, this.render, this.cache);
+
+        if (visible) {
+            let changed = false;
+            for (const item of slice) {
+                const key = this.key(item);
+                const node = this.cache.get(key).node;
+                if (this.gap === null) this.gap = parseFloat(getComputedStyle(node).marginBottom) || 0;
+                const height = node.offsetHeight + this.gap;
+                if (Math.abs(height - (this.heights.get(key) ?? this.estimate)) > 0.5) {
+                    this.heights.set(key, height);
+                    changed = true;
+                }
+            }
+            if (changed) {
+                // Redraw with real heights; converges once the window is measured
+                this.offsets = null;
+                this.schedule();
+            }
+        }
+
+        this.maybeLoadMore(items.length - end);
+    }
+
+    async maybeLoadMore(remaining) {
+        if (!this.hasMore || this.loading || remaining > this.overscan) return;
+        this.loading = true;
+        try {
+            await this.loadMore();
+        } finally {
+            this.loading = false;
+        }
+    }
+}
@@ -0,0 +1,138 @@
+// Offline storage, shared by the page and the service worker
+//
+// IndexedDB holds the most recent API responses (shown when the network is
+// down) and an outbox of writes made while offline. The outbox is flushed
+// to /api/sync in slices the server accepts; every entry carries an
+// idempotency key, so a flush that is retried never creates duplicate rows.
+
+const OFFLINE_DB = 'waterscribe';
+const OFFLINE_DB_VERSION = 1;
+const MAX_CACHED_RESPONSES = 100;
+// SYNC_MAX_REQUESTS in app.py
+const SYNC_BATCH = 500;
+// A key is only stored together with its write, so one still "in progress"
+// (409) after this long was committed by a request that died before saving
+// its response; resending it cannot help, and after the server's key TTL
+// it would be applied twice
+const STALE_CONFLICT_MS = 10 * 60 * 1000;
+
+let offlineDb = null;
+
+function idbRequest(request) {
+    return new Promise((resolve, reject) => {
+        request.onsuccess = () => resolve(request.result);
+        request.onerror = () => reject(request.error);
+    });
+}
+
+function openOfflineDb() {
+    if (!offlineDb) {
+        const request = indexedDB.open(OFFLINE_DB, OFFLINE_DB_VERSION);
+        request.onupgradeneeded = () => {
+            const db = request.result;
+            db.createObjectStore('responses', { keyPath: 'url' }).createIndex('saved_at', 'saved_at');
+            db.createObjectStore('outbox', { keyPath: 'key' }).createIndex('queued_at', 'queued_at');
+        };
+        offlineDb = idbRequest(request);
+    }
+    return offlineDb;
+}
+
+async function offlineStore(name, mode = 'readonly') {
+    const db = await openOfflineDb();
+    return db.transaction(name, mode).objectStore(name);
+}
+
+// Random key for a write; crypto.randomUUID() needs HTTPS, this does not
+function newIdempotencyKey() {
+    const bytes = crypto.getRandomValues(new Uint8Array(16));
+    return Array.from(bytes, b => b.toString(16).padStart(2, '0')).join('');
+}
+
+async function saveResponse(url, data) {
+    const store = await offlineStore('responses', 'readwrite');
+    await idbRequest(store.put({ url, data, saved_at: Date.now() }));
+
+    // Keep only the newest responses
+    const count = await idbRequest(store.count());
+    if (count > MAX_CACHED_RESPONSES) {
+        let excess = count - MAX_CACHED_RESPONSES;
+        const cursor = store.index('saved_at').openCursor();
+        cursor.onsuccess = () => {
+            if (cursor.result && excess-- > 0) {
+                cursor.result.delete();
+                cursor.result.continue();
+            }
+        };
+    }
+}
+
+async function loadResponse(url) {
+    const store = await offlineStore('responses');
+    const entry = await idbRequest(store.get(url));
+    return entry ? entry.data : undefined;
+}
+
+async function queueRequest(entry) {
+    const store = await offlineStore('outbox', 'readwrite');
+    await idbRequest(store.put({ ...entry, queued_at: Date.now() }));
+}
+
+async function pendingRequests() {
+    const store = await offlineStore('outbox');
+    return idbRequest(store.index('queued_at').getAll());
+}
+
+let flushing = null;
+
+// Send every queued write, oldest first; returns how many were applied
+function flushOutbox() {
+    if (!flushing) {
+        flushing = sendOutbox().finally(() => { flushing = null; });
+    }
+    return flushing;
+}
+
+async function sendOutbox() {
+    const pending = await pendingRequests();
+    let applied = 0;
+    // Each slice is dropped only once the server has answered it, so a
+    // failure part way through resends just the rest
+    for (let start = 0; start < pending.length; start += SYNC_BATCH) {
+        const slice = pending.slice(start, start + SYNC_BATCH);
+        const response = await fetch('/api/sync', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({
+                requests: slice.map(({ key, method, path, body }) => ({ key, method, path, body }))
+            })
+        });
+        if (!response.ok) throw new Error(`Sync failed: ${response.status}`);
+        const { results } = await response.json();
+        applied += await settleOutbox(slice, results);
+    }
+    return applied;
+}
+
+// Drop entries the server has settled; keep those to retry later (a server
+// error, or still in progress elsewhere unless that has gone on too long)
+async function settleOutbox(slice, results) {
+    const entries = new Map(slice.map(entry => [entry.key, entry]));
+    const store = await offlineStore('outbox', 'readwrite');
+    const now = Date.now();
+    let applied = 0;
+    for (const result of results) {
+        const entry = entries.get(result.key);
+        if (!entry || result.status >= 500) continue;
+        if (result.status === 409) {
+            if (entry.conflict_since === undefined) {
+                store.put({ ...entry, conflict_since: now });
+                continue;
+            }
+            if (now - entry.conflict_since < STALE_CONFLICT_MS) continue;
+        }
+        store.delete(result.key);
+        applied++;
+    }
+    return applied;
+}
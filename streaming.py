@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""
+Streaming JSON Responses
+Encodes query results straight from the cursor in fetchmany() chunks, so
+large list responses start immediately and never hold the whole result
+set (or its dict and JSON copies) in memory.
+
+Three shapes are supported:
+    objects   [{"id": 1, "ph": 7.1}, ...]              (default)
+    columnar  {"columns": ["id", "ph"], "data": [[1, 7.1], ...]}
+    arrays    {"id": [1, ...], "ph": [7.1, ...]}
+"""
+
+import json
+import math
+import time
+
+from flask import Response, stream_with_context
+
+import profiling
+
+CHUNK_SIZE = 500
+FORMATS = ('objects', 'columnar', 'arrays')
+
+
+def _encode_float(value):
+    # SQLite can hold +/-inf (e.g. '1e999'); JSON has no spelling for it
+    return repr(value) if math.isfinite(value) else 'null'
+
+
+_ENCODERS = {
+    str: json.encoder.encode_basestring_ascii,
+    int: int.__repr__,
+    float: _encode_float,
+    type(None): lambda value: 'null',
+}
+
+
+def _encode(value):
+    return json.dumps(value, default=str)
+
+
+def _column_encoders(columns, converters):
+    """Per-column type -> encoder tables
+
+    A converter (e.g. epoch ms -> ISO string) applies to non-null values of
+    its column; values of any other type pass through unchanged.
+    """
+    converters = converters or {}
+    tables = []
+    for column in columns:
+        convert = converters.get(column)
+        if convert is None:
+            tables.append(_ENCODERS)
+        else:
+            table = dict(_ENCODERS)
+            table[int] = table[float] = (
+                lambda value, convert=convert: _encode_value(convert(value)))
+            tables.append(table)
+    return tables
+
+
+def _encode_value(value):
+    return (_ENCODERS.get(type(value)) or _encode)(value)
+
+
+def select_columns(fields, allowed):
+    """Column names for a comma separated ?fields= value (all when empty)
+
+    Names are checked against the allowed columns, so they are safe to
+    interpolate into a query. Raises ValueError for unknown fields.
+    """
+    if not fields:
+        return tuple(allowed)
+    names = tuple(dict.fromkeys(f.strip() for f in fields.split(',') if f.strip()))
+    unknown = [name for name in names if name not in allowed]
+    if unknown or not names:
+        raise ValueError(f"Unknown field(s): {', '.join(unknown) or fields}")
+    return names
+
+
+def response_format(value):
+    """Validate a ?format= value"""
+    if not value:
+        return 'objects'
+    if value not in FORMATS:
+        raise ValueError(f"Unknown format '{value}' (expected one of: {', '.join(FORMATS)})")
+    return value
+
+
+def _object_prefixes(columns):
+    """Precomputed '{"col":' / ',"col":' fragments, one per column"""
+    keys = [json.encoder.encode_basestring_ascii(column) for column in columns]
+    return ['{' + keys[0] + ':'] + [',' + key + ':' for key in keys[1:]]
+
+
+def iter_json_array(cursor, converters=None, chunk_size=CHUNK_SIZE):
+    """Yield a JSON array of objects for the cursor's remaining rows"""
+    columns = [d[0] for d in cursor.description]
+    prefixes = _object_prefixes(columns)
+    encoders = _column_encoders(columns, converters)
+    fallback = _encode
+
+    yield '['
+    first = True
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            break
+        parts = []
+        for row in rows:
+            parts.append(''.join([
+                prefix + (table.get(type(value)) or fallback)(value)
+                for prefix, table, value in zip(prefixes, encoders, row)
+            ]) + '}')
+        chunk = ','.join(parts)
+        if first:
+            first = False
+            yield chunk
+        else:
+            yield ',' + chunk
+    yield ']'
+
+
+def iter_json_columnar(cursor, converters=None, chunk_size=CHUNK_SIZE):
+    """Yield {"columns": [...], "data": [[...], ...]} for the cursor's rows"""
+    columns = [d[0] for d in cursor.description]
+    encoders = _column_encoders(columns, converters)
+    fallback = _encode
+
+    yield '{"columns":[' + ','.join(map(json.encoder.encode_basestring_ascii, columns)) + '],"data":['
+    first = True
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            break
+        chunk = ','.join([
+            '[' + ','.join([(table.get(type(value)) or fallback)(value)
+                            for table, value in zip(encoders, row)]) + ']'
+            for row in rows
+        ])
+        if first:
+            first = False
+            yield chunk
+        else:
+            yield ',' + chunk
+    yield ']}'
+
+
+def iter_json_arrays(cursor, converters=None, chunk_size=CHUNK_SIZE):
+    """Yield {"col": [...], ...} with one array per column
+
+    Each column must be complete before the next starts, so the encoded
+    values are buffered; still far smaller than the row dicts.
+    """
+    columns = [d[0] for d in cursor.description]
+    encoders = _column_encoders(columns, converters)
+    fallback = _encode
+    buffers = [[] for _ in columns]
+
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            break
+        for buffer, table, values in zip(buffers, encoders, zip(*rows)):
+            buffer.extend([(table.get(type(value)) or fallback)(value) for value in values])
+
+    yield '{'
+    for i, (column, buffer) in enumerate(zip(columns, buffers)):
+        yield (',' if i else '') + json.encoder.encode_basestring_ascii(column) + ':[' + ','.join(buffer) + ']'
+        buffers[i] = None
+    yield '}'
+
+
+_ITERATORS = {
+    'objects': iter_json_array,
+    'columnar': iter_json_columnar,
+    'arrays': iter_json_arrays,
+}
+
+
+class _ProfiledRows:
+    """rows whose fetches are charged to a request profile"""
+
+    def __init__(self, rows, profile):
+        self.description = rows.description
+        self.fetch_time = 0.0
+        self._fetchmany = rows.fetchmany
+        self._profile = profile
+
+    def fetchmany(self, size=1):
+        profile = self._profile
+        sql_time, counted = profile.sql_time, profile.rows
+        start = time.perf_counter()
+        rows = self._fetchmany(size)
+        elapsed = time.perf_counter() - start
+        self.fetch_time += elapsed
+        # A profiled cursor may have counted this fetch already; count it once
+        profile.sql_time = sql_time + elapsed
+        profile.rows = counted + len(rows)
+        return rows
+
+
+def _timed(chunks, rows, profile):
+    """Yield chunks, adding the time spent encoding them to profile.json_time"""
+    while True:
+        start, fetch_time = time.perf_counter(), rows.fetch_time
+        chunk = next(chunks, None)
+        profile.json_time += time.perf_counter() - start - (rows.fetch_time - fetch_time)
+        if chunk is None:
+            return
+        yield chunk
+
+
+def stream_rows(rows, fmt='objects', converters=None):
+    """Stream query results as a JSON response in the given format
+
+    rows is a cursor or anything with description and fetchmany() (e.g.
+    repository.Rows). Its close(), if any, is called once the body has been
+    sent or the client disconnects; run the query before calling, so errors
+    still surface as a normal 500. converters maps column names to
+    functions applied to their non-null values before encoding. For a
+    profiled request the fetches and encoding are added to its profile as
+    the body is produced.
+    """
+    profile = profiling.current_profile()
+
+    def generate():
+        try:
+            if profile is None:
+                yield from _ITERATORS[fmt](rows, converters)
+            else:
+                profiled = _ProfiledRows(rows, profile)
+                yield from _timed(_ITERATORS[fmt](profiled, converters), profiled, profile)
+        finally:
+            close = getattr(rows, 'close', None)
+            if close is not None:
+                close()
+
+    return Response(stream_with_context(generate()), mimetype='application/json')
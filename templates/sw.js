@@ -0,0 +1,64 @@
+// WaterScribe service worker
+//
+// Rendered at startup: the version and asset list change with every
+// deploy, which makes the browser install the new worker and its cache.
+//
+// Page shell: network first, cached copy when offline.
+// Hashed assets: cache first (their URLs never change content).
+// API data is cached by the page itself in IndexedDB (see offline.js).
+
+const VERSION = '{{ version }}';
+const CACHE = `waterscribe-${VERSION}`;
+const SHELL = ['/', {% for url in asset_urls %}'{{ url }}'{{ ', ' if not loop.last }}{% endfor %}];
+
+importScripts('{{ asset_url("js/offline.js") }}');
+
+self.addEventListener('install', event => {
+    event.waitUntil(
+        caches.open(CACHE)
+            .then(cache => cache.addAll(SHELL))
+            .then(() => self.skipWaiting())
+    );
+});
+
+self.addEventListener('activate', event => {
+    event.waitUntil(
+        caches.keys()
+            .then(keys => Promise.all(
+                keys.filter(key => key.startsWith('waterscribe-') && key !== CACHE)
+                    .map(key => caches.delete(key))
+            ))
+            .then(() => self.clients.claim())
+    );
+});
+
+self.addEventListener('fetch', event => {
+    const request = event.request;
+    const url = new URL(request.url);
+    if (request.method !== 'GET' || url.origin !== self.location.origin) return;
+
+    if (url.pathname === '/') {
+        event.respondWith(
+            fetch(request)
+                .then(response => {
+                    if (response.ok) {
+                        const copy = response.clone();
+                        caches.open(CACHE).then(cache => cache.put('/', copy));
+                    }
+                    return response;
+                })
+                .catch(() => caches.match('/'))
+        );
+    } else if (url.pathname.startsWith('/assets/')) {
+        event.respondWith(
+            caches.match(request).then(cached => cached || fetch(request))
+        );
+    }
+});
+
+// Background Sync (where supported): flush writes queued while offline
+self.addEventListener('sync', event => {
+    if (event.tag === 'outbox') {
+        event.waitUntil(flushOutbox());
+    }
+});
@@ -0,0 +1,109 @@
+"""
+Fixtures for running the app's routes against both storage backends.
+
+The app reads its configuration when imported, so the environment is set
+up here first: no background jobs, rate limits or metrics files.
+"""
+
+import os
+import sys
+from collections import OrderedDict
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+os.environ['WATERSCRIBE_HOUSEKEEPING'] = '0'
+os.environ['WATERSCRIBE_RATE_LIMIT'] = '0'
+os.environ['WATERSCRIBE_METRICS'] = '0'
+os.environ.pop('WATERSCRIBE_REPLICA_OF', None)
+
+import app  # noqa: E402
+import clock  # noqa: E402
+import idempotency  # noqa: E402
+import repository  # noqa: E402
+
+START = clock.parse('2026-03-02T09:00:00+00:00')
+BACKENDS = ('memory', 'sqlite')
+
+
+class Clock:
+    """Stands in for clock.now_ms(); time only moves when told to"""
+
+    def __init__(self, now=START):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, ms=60_000):
+        self.now += ms
+
+
+class Session:
+    """A test client that records every response for comparison"""
+
+    def __init__(self, client, clock):
+        self.client = client
+        self.clock = clock
+        self.log = []
+
+    def call(self, method, path, body=None, headers=None):
+        """(status, json body) of one request, also added to the log"""
+        response = self.client.open(path, method=method, json=body, headers=headers)
+        result = (response.status_code, response.get_json(silent=True))
+        if response.headers.get('Idempotent-Replayed'):
+            result += ('replayed',)
+        response.close()
+        self.log.append((method, path, *result))
+        return result[:2]
+
+    def get(self, path):
+        return self.call('GET', path)[1]
+
+    def post(self, path, body=None, headers=None):
+        return self.call('POST', path, body, headers)
+
+    def put(self, path, body=None):
+        return self.call('PUT', path, body)
+
+    def delete(self, path):
+        return self.call('DELETE', path)
+
+
+def start(db_path, storage, monkeypatch):
+    """A Session on an empty store at db_path, with the clock frozen at START"""
+    db_path.parent.mkdir(parents=True, exist_ok=True)
+    app.init_db(db_path)
+    fake = Clock()
+    monkeypatch.setattr(clock, 'now_ms', fake)
+    monkeypatch.setattr(app, 'DB_PATH', db_path)
+    monkeypatch.setattr(app, 'REPOSITORY', repository.MemoryRepository() if storage == 'memory' else None)
+    monkeypatch.setattr(idempotency, '_cache', OrderedDict())
+    return Session(app.app.test_client(), fake)
+
+
+@pytest.fixture
+def session(tmp_path, monkeypatch):
+    """A Session on an empty SQLite database, for SQLite-only features"""
+    return start(tmp_path / 'aquarium.db', 'sqlite', monkeypatch)
+
+
+@pytest.fixture
+def on_both(tmp_path, monkeypatch):
+    """on_both(flow) runs flow(session) against each backend
+
+    Every run starts from an empty store at the same (frozen) time. The
+    responses must be identical; the SQLite run's session is returned for
+    further checks.
+    """
+    def run(flow):
+        sessions = {}
+        for storage in BACKENDS:
+            session = sessions[storage] = start(tmp_path / storage / 'aquarium.db', storage, monkeypatch)
+            flow(session)
+        assert sessions['memory'].log == sessions['sqlite'].log
+        return sessions['sqlite']
+    return run
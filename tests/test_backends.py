@@ -0,0 +1,190 @@
+"""
+The memory and SQLite backends must give the same responses to the same
+requests; each test runs one flow of requests against both (see on_both)
+"""
+
+from conftest import START
+
+import clock
+
+DAY = clock.DAY_MS
+
+
+def add_readings(s, count):
+    ids = []
+    for i in range(count):
+        s.clock.advance()
+        ids.append(s.post('/api/parameters', {'ph': 7.0 + i / 10, 'temperature': 25})[1]['id'])
+    return ids
+
+
+def test_crud(on_both):
+    def flow(s):
+        reading = s.post('/api/parameters', {'ph': '7.2', 'temperature': 25.5, 'notes': 'after water change'})
+        s.post('/api/maintenance', {'task_type': 'Water change', 'description': '25%'})
+        s.post('/api/fish', {'species': 'Paracheirodon innesi', 'common_name': 'Neon tetra', 'quantity': '6'})
+        s.post('/api/fish', {'species': 'Corydoras'})
+        weekly = s.post('/api/scheduled', {'task_name': 'Water change', 'frequency_days': 7})[1]['id']
+        s.post('/api/scheduled', {'task_name': 'Replace filter media', 'is_recurring': False,
+                                  'specific_date': clock.iso(START + 2 * DAY)})
+        s.post('/api/parameters', {'ph': 15})
+
+        s.clock.advance(8 * DAY)
+        s.put('/api/scheduled', {'id': weekly, 'task_name': 'Water change'})
+        s.delete('/api/fish?id=2')
+        s.delete(f"/api/parameters?id={reading[1]['id']}")
+
+        for path in ('/api/parameters', '/api/maintenance', '/api/fish', '/api/scheduled',
+                     '/api/scheduled/buckets', f'/api/scheduled/{weekly}/history', '/api/stats'):
+            s.get(path)
+        s.delete(f'/api/scheduled?id={weekly}')
+        s.get(f'/api/scheduled/{weekly}/history')
+
+    s = on_both(flow)
+    assert s.log[6][2] == 400  # ph out of range
+    assert s.log[-1][2] == 404  # history went with the task
+    assert [fish['species'] for fish in s.get('/api/fish')] == ['Paracheirodon innesi']
+
+
+def test_keyset_paging(on_both):
+    def flow(s):
+        ids = add_readings(s, 12)
+        for i in range(7):
+            s.clock.advance()
+            s.post('/api/maintenance', {'task_type': f'Check {i}'})
+        for i in range(6):
+            s.post('/api/scheduled', {'task_name': f'Dose {i}', 'frequency_days': 3 + i % 3})
+
+        seen, before = [], None
+        while True:
+            page = s.get('/api/parameters?limit=5' + (f'&before_id={before}' if before else ''))
+            if not page:
+                break
+            seen += [row['id'] for row in page]
+            before = page[-1]['id']
+        assert seen == ids[::-1]
+
+        page = s.get('/api/maintenance?limit=4')
+        s.get(f"/api/maintenance?limit=4&before_id={page[-1]['id']}")
+        page = s.get('/api/scheduled?limit=4&fields=id,next_due')
+        s.get(f"/api/scheduled?limit=4&after_id={page[-1]['id']}&fields=id,next_due")
+        s.get('/api/parameters?limit=3&format=columnar')
+        s.get('/api/parameters?limit=3&format=arrays&fields=id,ph')
+
+    on_both(flow)
+
+
+def test_changes_and_tombstones(on_both):
+    def flow(s):
+        ids = add_readings(s, 3)
+        task = s.post('/api/scheduled', {'task_name': 'Water change', 'frequency_days': 7})[1]['id']
+        snapshot = s.get('/api/changes?since=0')
+        assert {change['op'] for change in snapshot['changes']} == {'insert'}
+
+        s.put('/api/scheduled', {'id': task, 'task_name': 'Water change'})
+        s.delete(f'/api/parameters?id={ids[0]}')
+        delta = s.get(f"/api/changes?since={snapshot['seq']}")
+        ops = {(change['table'], change['op'], change['id']) for change in delta['changes']}
+        assert ('water_parameters', 'delete', ids[0]) in ops
+        assert ('scheduled_tasks', 'update', task) in ops
+
+        page = s.get('/api/changes?since=0&limit=2')
+        assert page['more']
+        s.get(f"/api/changes?since={page['seq']}&limit=2")
+        s.get('/api/changes?since=0')
+
+    on_both(flow)
+
+
+def test_idempotency_replay(on_both):
+    def flow(s):
+        key = {'Idempotency-Key': 'reading-1'}
+        first = s.post('/api/parameters', {'ph': 7.1}, key)
+        assert s.post('/api/parameters', {'ph': 7.1}, key) == first
+        assert s.log[-1][-1] == 'replayed'
+        assert s.post('/api/fish', {'species': 'Guppy'}, key)[0] == 422
+
+        queued = [
+            {'key': 'offline-1', 'method': 'POST', 'path': '/api/maintenance', 'body': {'task_type': 'Feed'}},
+            {'key': 'offline-2', 'method': 'POST', 'path': '/api/fish', 'body': {'species': 'Molly'}},
+            {'key': 'offline-3', 'method': 'POST', 'path': '/api/fish', 'body': {}},
+        ]
+        sent = s.post('/api/sync', {'requests': queued})
+        assert s.post('/api/sync', {'requests': queued}) == sent
+        s.get('/api/maintenance')
+        s.get('/api/fish')
+
+    on_both(flow)
+
+
+def test_batch_atomic_rollback(on_both):
+    def flow(s):
+        add_readings(s, 2)
+        requests = [
+            {'method': 'POST', 'path': '/api/fish', 'body': {'species': 'Platy'}},
+            {'method': 'POST', 'path': '/api/scheduled', 'body': {'task_name': 'Trim plants', 'frequency_days': 14}},
+            {'method': 'POST', 'path': '/api/parameters', 'body': {'ph': -1}},
+        ]
+        status, body = s.post('/api/batch', {'atomic': True, 'requests': requests})
+        assert status == 400 and body['failed']['index'] == 2
+        assert s.get('/api/fish') == [] and s.get('/api/scheduled') == []
+        assert len(s.get('/api/changes?since=0')['changes']) == 2
+
+        s.post('/api/batch', {'requests': requests})
+        s.post('/api/batch', {'atomic': True, 'requests': requests[:2] + [{'path': '/api/stats'}]})
+        s.get('/api/fish')
+        s.get('/api/changes?since=0')
+
+    on_both(flow)
+
+
+def test_task_filters_and_buckets(on_both):
+    def flow(s):
+        ids = []
+        for i in range(14):
+            s.clock.advance(3_600_000 * (i % 5))
+            ids.append(s.post('/api/scheduled', {'task_name': f'Dose {i}', 'frequency_days': 1 + i % 9,
+                                                 'description': 'filter rinse' if i % 3 else None})[1]['id'])
+        s.post('/api/scheduled', {'task_name': 'Once', 'is_recurring': False,
+                                  'specific_date': clock.iso(START + DAY)})
+        for task in ids[:4]:
+            s.put('/api/scheduled', {'id': task, 'task_name': 'Done'})
+        s.delete(f'/api/scheduled?id={ids[5]}')
+        s.clock.advance(3 * DAY)
+
+        for query in ('', '?status=overdue', '?status=today', '?status=week', '?status=later', '?q=RINSE',
+                      '?status=week&q=dose 1', f'?due_since={clock.iso(s.clock.now)}',
+                      f'?due_until={clock.iso(s.clock.now + 5 * DAY)}&limit=3'):
+            s.get(f'/api/scheduled{query}')
+        s.get('/api/scheduled/buckets')
+        s.get('/api/scheduled/buckets?q=rinse')
+        s.get('/api/stats')
+
+        seen, after = [], None
+        while True:
+            page = s.get('/api/scheduled?limit=4&fields=id' + (f'&after_id={after}' if after else ''))
+            if not page:
+                break
+            seen += [row['id'] for row in page]
+            after = page[-1]['id']
+        assert seen == [row['id'] for row in s.get('/api/scheduled?fields=id')]
+        assert s.get(f'/api/scheduled?after_id={ids[5]}') == []
+
+    on_both(flow)
+
+
+def test_history_paging(on_both):
+    def flow(s):
+        tasks = [s.post('/api/scheduled', {'task_name': name, 'frequency_days': 2})[1]['id']
+                 for name in ('Water change', 'Filter')]
+        for i in range(7):
+            s.clock.advance(DAY * (1 + i % 3))
+            s.put('/api/scheduled', {'id': tasks[i % 2], 'task_name': 'x'})
+        history = s.get(f'/api/scheduled/{tasks[0]}/history?limit=2')
+        s.get(f"/api/scheduled/{tasks[0]}/history?limit=2&before_id={history['completions'][-1]['id']}")
+        s.get(f'/api/scheduled/{tasks[1]}/history?before_id=1')
+        s.delete(f'/api/scheduled?id={tasks[0]}')
+        s.get(f'/api/scheduled/{tasks[1]}/history')
+        s.get('/api/changes?since=0')
+
+    on_both(flow)
@@ -0,0 +1,75 @@
+"""
+The change log keeps one entry per row and tells stale clients to reset
+"""
+
+import sqlite3
+import time
+
+import app
+import changelog
+import clock
+
+
+def log(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute('SELECT table_name, op, row_id FROM changes ORDER BY seq').fetchall()
+    finally:
+        conn.close()
+
+
+def test_one_entry_per_row(session):
+    s = session
+    task = s.post('/api/scheduled', {'task_name': 'Water change', 'frequency_days': 7})[1]['id']
+    fish = s.post('/api/fish', {'species': 'Guppy'})[1]['id']
+    for _ in range(3):
+        s.put('/api/scheduled', {'id': task, 'task_name': 'Water change'})
+    s.delete(f'/api/fish?id={fish}')
+
+    entries = log(app.DB_PATH)
+    assert entries.count(('scheduled_tasks', 'update', task)) == 1
+    assert ('fish_inventory', 'delete', fish) in entries
+    assert len(entries) == len(set((table, row_id) for table, _, row_id in entries))
+
+
+def test_install_logs_existing_rows(tmp_path):
+    db_path = tmp_path / 'old.db'
+    conn = sqlite3.connect(db_path)
+    conn.execute('CREATE TABLE fish_inventory (id INTEGER PRIMARY KEY, species TEXT)')
+    conn.executemany('INSERT INTO fish_inventory (species) VALUES (?)', [('Guppy',), ('Molly',)])
+    for table in changelog.TRACKED_TABLES[:-1]:
+        if table != 'fish_inventory':
+            conn.execute(f'CREATE TABLE {table} (id INTEGER PRIMARY KEY)')
+    conn.execute('CREATE TABLE task_completions (id INTEGER PRIMARY KEY)')
+    changelog.install(conn.cursor())
+    changelog.install(conn.cursor())  # a second init_db logs nothing new
+    conn.commit()
+    conn.close()
+    assert log(db_path) == [('fish_inventory', 'insert', 1), ('fish_inventory', 'insert', 2)]
+
+
+def test_compacted_tombstones_reset_only_stale_clients(session):
+    s = session
+    ids = [s.post('/api/fish', {'species': f'Fish {i}'})[1]['id'] for i in range(3)]
+    s.delete(f'/api/fish?id={ids[0]}')
+    seen = s.get('/api/changes?since=0')['seq']
+    s.delete(f'/api/fish?id={ids[1]}')
+
+    # Triggers stamp entries with SQLite's clock, so age them past it
+    s.clock.now = int(time.time() * 1000) + (changelog.TOMBSTONE_DAYS + 1) * clock.DAY_MS
+    conn = sqlite3.connect(app.DB_PATH, isolation_level=None)
+    assert changelog.compact_tombstones(conn) == 2
+    conn.close()
+
+    assert s.get(f'/api/changes?since={seen}') == {'success': True, 'reset': True}
+    assert s.get(f'/api/changes?since={seen}&horizon=0')['reset']
+
+    # A copy from 0 needs no tombstones, and its pages carry the horizon on
+    s.post('/api/fish', {'species': 'Molly'})
+    page = s.get('/api/changes?since=0&limit=1')
+    copied = [change['id'] for change in page['changes']]
+    assert page['horizon'] > page['seq']
+    while page['more']:
+        page = s.get(f"/api/changes?since={page['seq']}&limit=1&horizon={page['horizon']}")
+        copied += [change['id'] for change in page['changes']]
+    assert copied == [ids[2], ids[2] + 1]
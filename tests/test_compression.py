@@ -0,0 +1,49 @@
+"""
+gzip responses must decompress to exactly the uncompressed body
+"""
+
+import gzip
+
+import pytest
+
+import app
+import compression
+
+GZIP = {'Accept-Encoding': 'gzip'}
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(compression, '_cache', compression.OrderedDict())
+    return app.app.test_client()
+
+
+def test_cached_bodies_stay_with_their_route(client):
+    plain = {path: client.get(path).get_data() for path in ('/', '/sw.js')}
+    for path in ('/', '/sw.js', '/', '/sw.js'):
+        response = client.get(path, headers=GZIP)
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert gzip.decompress(response.get_data()) == plain[path]
+
+
+def test_conditional_request_still_matches(client):
+    etag = client.get('/', headers=GZIP).headers['ETag']
+    assert etag.startswith('W/')
+    assert client.get('/', headers={**GZIP, 'If-None-Match': etag}).status_code == 304
+
+
+def test_streamed_json(on_both):
+    def flow(s):
+        for i in range(60):
+            s.post('/api/maintenance', {'task_type': f'Check {i}', 'description': 'x' * 40})
+        response = s.client.get('/api/maintenance?limit=100', headers=GZIP)
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert 'Content-Length' not in response.headers
+        assert gzip.decompress(response.get_data()) == s.client.get('/api/maintenance?limit=100').get_data()
+
+    on_both(flow)
+
+
+def test_small_and_unaccepted_bodies_are_left_alone(client):
+    assert 'Content-Encoding' not in client.get('/api/stats', headers=GZIP).headers
+    assert 'Content-Encoding' not in client.get('/').headers
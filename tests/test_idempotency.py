@@ -0,0 +1,66 @@
+"""
+Idempotency keys: replays, conflicts and expiry
+"""
+
+import sqlite3
+
+import app
+import clock
+import idempotency
+import repository
+
+KEY = {'Idempotency-Key': 'reading-1'}
+
+
+def test_expired_keys_run_again(on_both):
+    def flow(s):
+        first = s.post('/api/parameters', {'ph': 7.1}, KEY)
+        s.clock.advance(idempotency.TTL_MS + 1)
+        again = s.post('/api/parameters', {'ph': 7.1}, KEY)
+        assert again[1]['id'] == first[1]['id'] + 1
+        assert s.log[-1][-1] != 'replayed'
+        assert s.post('/api/parameters', {'ph': 7.1}, KEY) == again
+        # Taken over for another request once expired, too
+        s.clock.advance(idempotency.TTL_MS + 1)
+        assert s.post('/api/fish', {'species': 'Guppy'}, KEY)[0] == 200
+
+    on_both(flow)
+
+
+def test_duplicate_keys_in_one_sync(on_both):
+    def flow(s):
+        entry = {'key': 'offline-1', 'method': 'POST', 'path': '/api/fish', 'body': {'species': 'Molly'}}
+        status, body = s.post('/api/sync', {'requests': [entry, entry, {**entry, 'path': '/api/maintenance', 'body': {'task_type': 'Feed'}}]})
+        first, repeat, other = body['results']
+        assert repeat == first and first['status'] == 200
+        assert other['status'] == 422
+        assert len(s.get('/api/fish')) == 1
+
+    on_both(flow)
+
+
+def test_key_of_an_unfinished_request(session):
+    s = session
+    # What a crash between the write's commit and storing its response leaves
+    conn = sqlite3.connect(app.DB_PATH)
+    conn.execute('INSERT INTO idempotency_keys (key, method, path, created) VALUES (?, ?, ?, ?)',
+                 ('reading-1', 'POST', '/api/parameters', s.clock.now))
+    conn.commit()
+    conn.close()
+
+    assert s.post('/api/parameters', {'ph': 7.1}, KEY)[0] == 409
+    assert s.get('/api/parameters') == []
+    s.clock.advance(idempotency.TTL_MS + 1)
+    assert s.post('/api/parameters', {'ph': 7.1}, KEY)[0] == 200
+
+
+def test_expire_in_batches(tmp_path):
+    db_path = tmp_path / 'aquarium.db'
+    app.init_db(db_path)
+    now = clock.now_ms()
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    conn.executemany('INSERT INTO idempotency_keys (key, method, path, created) VALUES (?, ?, ?, ?)',
+                     [(f'key-{i}', 'POST', '/api/fish', now - i * 1000) for i in range(25)])
+    assert repository.expire_idempotency_keys(conn, ttl_ms=4500, batch=10, now=now) == 20
+    assert conn.execute('SELECT COUNT(*) FROM idempotency_keys').fetchone()[0] == 5
+    conn.close()
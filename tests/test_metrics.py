@@ -0,0 +1,39 @@
+"""
+/metrics is served only to addresses in WATERSCRIBE_METRICS_ALLOW
+"""
+
+from flask import Flask
+
+import metrics
+
+
+def scrape(tmp_path, monkeypatch, remote_addr, allow='127.0.0.1,::1', headers=None):
+    monkeypatch.setattr(metrics, 'METRICS_ENABLED', True)
+    monkeypatch.setattr(metrics, 'METRICS_ALLOW', allow)
+    monkeypatch.setenv('WATERSCRIBE_METRICS_DIR', str(tmp_path / 'metrics'))
+    app = Flask(__name__)
+    metrics.init_app(app, tmp_path / 'aquarium.db')
+    client = app.test_client()
+    return client.get('/metrics', headers=headers, environ_base={'REMOTE_ADDR': remote_addr})
+
+
+def test_loopback_only_by_default(tmp_path, monkeypatch):
+    response = scrape(tmp_path, monkeypatch, '127.0.0.1')
+    assert response.status_code == 200
+    assert 'waterscribe_db_lock_events_total' in response.text
+    assert scrape(tmp_path, monkeypatch, '::1').status_code == 200
+    assert scrape(tmp_path, monkeypatch, '10.0.0.5').status_code == 403
+
+
+def test_proxied_client_is_checked(tmp_path, monkeypatch):
+    # Nginx passes the real client on; it must not inherit the proxy's loopback address
+    response = scrape(tmp_path, monkeypatch, '127.0.0.1', headers={'X-Real-IP': '203.0.113.9'})
+    assert response.status_code == 403
+
+
+def test_configured_networks(tmp_path, monkeypatch):
+    allow = '10.0.0.0/24, 192.168.1.20'
+    assert scrape(tmp_path, monkeypatch, '10.0.0.5', allow).status_code == 200
+    assert scrape(tmp_path, monkeypatch, '::ffff:192.168.1.20', allow).status_code == 200
+    assert scrape(tmp_path, monkeypatch, '10.0.1.5', allow).status_code == 403
+    assert scrape(tmp_path, monkeypatch, '127.0.0.1', allow).status_code == 403
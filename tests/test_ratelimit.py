@@ -0,0 +1,81 @@
+"""
+Token buckets: limits per client and rule, shared through the bucket file
+"""
+
+import pytest
+from flask import Flask, jsonify, request
+
+import ratelimit
+
+
+def test_parse_rules():
+    rules = ratelimit.parse_rules('read=20/60, write=5 ,POST  /api/sync=1/5')
+    assert rules == {'read': (20.0, 60.0), 'write': (5.0, 5.0), 'POST /api/sync': (1.0, 5.0)}
+    for spec in ('read', 'read=fast', 'read=0/5', 'write=1/0.5', '=1/2'):
+        with pytest.raises(ValueError):
+            ratelimit.parse_rules(spec)
+
+
+def test_buckets_refill_and_go_into_debt(tmp_path):
+    table = ratelimit.BucketTable(tmp_path / 'buckets')
+    assert [table.take('a', 1, 3, now=100) for _ in range(3)] == [0, 0, 0]
+    assert table.take('a', 1, 3, now=100) == 1.0
+    assert table.take('b', 1, 3, now=100) == 0
+    assert table.take('a', 1, 3, now=101) == 0
+
+    # Five tokens with one left: let through, then 4 tokens of debt to repay
+    assert table.take('a', 1, 3, now=102, tokens=5) == 0
+    assert table.take('a', 1, 3, now=102) == 5.0
+    assert table.take('a', 1, 3, now=107) == 0
+
+
+def test_bucket_file_is_shared(tmp_path):
+    first, second = ratelimit.BucketTable(tmp_path / 'buckets'), ratelimit.BucketTable(tmp_path / 'buckets')
+    first.take('a', 1, 2, now=100)
+    second.take('a', 1, 2, now=100)
+    assert first.take('a', 1, 2, now=100) > 0
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setattr(ratelimit, 'RATE_LIMIT_ENABLED', True)
+    monkeypatch.setattr(ratelimit, 'RATE_LIMITS', 'read=0.001/3,write=0.001/2,POST /api/sync=0.001/4')
+    app = Flask(__name__)
+
+    @app.route('/api/items', methods=['GET', 'POST'])
+    def items():
+        return jsonify({'success': True})
+
+    @app.route('/api/sync', methods=['POST'])
+    @ratelimit.cost(lambda data: len(data['requests']))
+    def sync():
+        return jsonify({'success': True, 'count': len(request.get_json()['requests'])})
+
+    ratelimit.init_app(app, tmp_path / 'aquarium.db')
+    return app.test_client()
+
+
+def statuses(client, count, method='GET', path='/api/items', **kwargs):
+    return [client.open(path, method=method, **kwargs).status_code for _ in range(count)]
+
+
+def test_reads_and_writes_have_separate_buckets(client):
+    assert statuses(client, 3, 'POST') == [200, 200, 429]
+    assert statuses(client, 4) == [200, 200, 200, 429]
+    response = client.get('/api/items')
+    assert response.status_code == 429 and int(response.headers['Retry-After']) > 0
+
+
+def test_clients_behind_the_proxy_are_told_apart(client):
+    proxied = {'environ_base': {'REMOTE_ADDR': '127.0.0.1'}}
+    assert statuses(client, 4, headers={'X-Real-IP': '203.0.113.1'}, **proxied)[-1] == 429
+    assert statuses(client, 1, headers={'X-Real-IP': '203.0.113.2'}, **proxied) == [200]
+    # Only a trusted proxy may name the client
+    spoofed = {'environ_base': {'REMOTE_ADDR': '198.51.100.7'}}
+    assert statuses(client, 4, headers={'X-Real-IP': '203.0.113.3'}, **spoofed)[-1] == 429
+    assert statuses(client, 1, headers={'X-Real-IP': '203.0.113.4'}, **spoofed) == [429]
+
+
+def test_sync_pays_per_write(client):
+    three = {'requests': [{}] * 3}
+    assert statuses(client, 3, 'POST', '/api/sync', json=three) == [200, 200, 429]
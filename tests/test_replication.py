@@ -0,0 +1,114 @@
+"""
+A standby fed from the change log ends up with the primary's rows and seqs
+"""
+
+import sqlite3
+import time
+
+import pytest
+from flask import Flask
+
+import app
+import changelog
+import clock
+import replication
+import retention
+
+DAY = clock.DAY_MS
+
+
+def dump(db_path):
+    """Every replicated row (archive included) and the change log"""
+    conn = sqlite3.connect(db_path)
+    try:
+        retention.attach_archive(conn, db_path)
+        tables = {}
+        for table in changelog.TRACKED_TABLES:
+            source = 'water_parameters_all' if table == 'water_parameters' else table
+            tables[table] = conn.execute(f'SELECT * FROM {source} ORDER BY id').fetchall()
+        tables['water_parameters_daily'] = conn.execute('SELECT * FROM water_parameters_daily ORDER BY day').fetchall()
+        tables['changes'] = conn.execute('SELECT seq, table_name, op, row_id FROM changes ORDER BY seq').fetchall()
+        return tables
+    finally:
+        conn.close()
+
+
+@pytest.fixture
+def standby(session, tmp_path):
+    return tmp_path / 'standby' / 'aquarium.db'
+
+
+def test_standby_follows_inserts_updates_and_deletes(session, standby):
+    s = session
+    fish = [s.post('/api/fish', {'species': f'Fish {i}'})[1]['id'] for i in range(3)]
+    standby.parent.mkdir()
+    replication.seed(app.DB_PATH, standby)
+    assert dump(standby) == dump(app.DB_PATH)
+
+    s.post('/api/parameters', {'ph': 7.2, 'temperature': 25})
+    task = s.post('/api/scheduled', {'task_name': 'Filter', 'frequency_days': 14})[1]['id']
+    s.put('/api/scheduled', {'id': task, 'task_name': 'Filter'})
+    s.delete(f'/api/fish?id={fish[0]}')
+
+    assert replication.catch_up(app.DB_PATH, standby) > 0
+    assert dump(standby) == dump(app.DB_PATH)
+    assert replication.catch_up(app.DB_PATH, standby) == 0
+
+
+def test_archived_readings_reach_the_standby(session, standby):
+    s = session
+    ids = [s.post('/api/parameters', {'ph': 7.0 + i / 10})[1]['id'] for i in range(3)]
+    s.clock.advance(30 * DAY)
+    s.post('/api/parameters', {'ph': 6.8})
+    assert retention.archive_old_readings(app.DB_PATH, 14, now=s.clock.now) == 3
+    standby.parent.mkdir()
+    replication.seed(app.DB_PATH, standby)
+
+    s.delete(f'/api/parameters?id={ids[0]}')
+    s.post('/api/parameters', {'ph': 7.4})
+    replication.catch_up(app.DB_PATH, standby)
+    assert dump(standby) == dump(app.DB_PATH)
+    assert ids[0] not in [row[0] for row in dump(standby)['water_parameters']]
+
+
+def test_replica_refuses_writes_until_promoted(session, standby):
+    s = session
+    s.post('/api/fish', {'species': 'Tetra'})
+    standby.parent.mkdir()
+    replication.seed(app.DB_PATH, standby)
+
+    # The guard is bound to the path it was registered with
+    replica = Flask(__name__)
+    replication.init_app(replica, standby)
+    replica.add_url_rule('/api/fish', 'fish', lambda: {'success': True}, methods=['GET', 'POST'])
+    client = replica.test_client()
+
+    assert client.post('/api/fish').status_code == 503
+    assert client.get('/api/fish').status_code == 200
+    s.clock.advance(int(replication.REPLICA_MAX_LAG * 1000) + 1000)
+    replication._status_cache.clear()
+    assert client.get('/api/fish').status_code == 503
+
+    replication.promote(standby, app.DB_PATH)
+    assert client.post('/api/fish').status_code == 200
+    with pytest.raises(replication.NotReplica):
+        replication.apply_batch(app.DB_PATH, standby)
+
+
+def test_standby_behind_the_tombstone_horizon_must_be_seeded_again(session, standby):
+    s = session
+    fish = s.post('/api/fish', {'species': 'Tetra'})[1]['id']
+    standby.parent.mkdir()
+    replication.seed(app.DB_PATH, standby)
+    s.delete(f'/api/fish?id={fish}')
+
+    # Triggers stamp entries with SQLite's clock, so age them past it
+    s.clock.now = int(time.time() * 1000) + (changelog.TOMBSTONE_DAYS + 1) * DAY
+    conn = sqlite3.connect(app.DB_PATH, isolation_level=None)
+    assert changelog.compact_tombstones(conn) == 1
+    conn.close()
+
+    with pytest.raises(replication.FellBehind):
+        replication.apply_batch(app.DB_PATH, standby)
+    replication.seed(app.DB_PATH, standby)
+    assert dump(standby) == dump(app.DB_PATH)
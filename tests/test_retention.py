@@ -0,0 +1,47 @@
+"""
+Readings moved to the archive stay visible through the API
+"""
+
+from conftest import START
+
+import app
+import clock
+import retention
+
+DAY = clock.DAY_MS
+
+
+def archive(s, days=14):
+    moved = retention.archive_old_readings(app.DB_PATH, days, now=s.clock.now)
+    assert retention.archive_path(app.DB_PATH).exists()
+    return moved
+
+
+def test_archived_readings_are_still_listed(session):
+    s = session
+    ids = [s.post('/api/parameters', {'ph': 7.0 + i / 10})[1]['id'] for i in range(3)]
+    s.clock.advance(30 * DAY)
+    recent = s.post('/api/parameters', {'ph': 6.8})[1]['id']
+    assert archive(s) == 3
+
+    assert [row['id'] for row in s.get('/api/parameters')] == [recent, *ids[::-1]]
+    assert s.get(f'/api/parameters?before_id={recent}&limit=2')[0]['id'] == ids[-1]
+    assert s.get('/api/parameters/daily')[0]['readings'] == 3
+
+
+def test_changes_include_archived_rows(session):
+    s = session
+    ids = [s.post('/api/parameters', {'ph': 7.0 + i / 10})[1]['id'] for i in range(3)]
+    s.clock.advance(30 * DAY)
+    archive(s)
+
+    changes = s.get('/api/changes?since=0')['changes']
+    readings = {change['id']: change['row'] for change in changes if change['table'] == 'water_parameters'}
+    assert sorted(readings) == ids
+    assert all(row is not None for row in readings.values())
+    assert readings[ids[1]]['ph'] == 7.1
+    assert readings[ids[0]]['timestamp'] == clock.iso(START)
+
+    s.delete(f'/api/parameters?id={ids[0]}')
+    last = s.get(f"/api/changes?since={max(change['seq'] for change in changes)}")['changes']
+    assert [(change['op'], change['id'], change['row']) for change in last] == [('delete', ids[0], None)]
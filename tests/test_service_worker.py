@@ -0,0 +1,14 @@
+"""
+The service worker is versioned separately from the page shell
+"""
+
+import app
+
+
+def test_service_worker_has_its_own_etag():
+    client = app.app.test_client()
+    page, worker = client.get('/'), client.get('/sw.js')
+    assert worker.mimetype == 'text/javascript'
+    assert page.headers['ETag'] != worker.headers['ETag']
+    assert client.get('/sw.js', headers={'If-None-Match': page.headers['ETag']}).status_code == 200
+    assert client.get('/sw.js', headers={'If-None-Match': worker.headers['ETag']}).status_code == 304
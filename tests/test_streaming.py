@@ -0,0 +1,108 @@
+"""
+Streamed list responses must decode to what json.dumps would have produced
+"""
+
+import json
+import sqlite3
+
+import pytest
+from flask import Flask
+
+import streaming
+
+ROWS = [
+    (1, 'plain', 7.1, None),
+    (2, 'quote " and \\ backslash', 1e999, 3),
+    (3, 'ünïcode\n', -0.5, 2 ** 62),
+    (4, '', float('-inf'), 0),
+    (5, 'last', 8.0, -1),
+]
+
+
+@pytest.fixture
+def cursor():
+    conn = sqlite3.connect(':memory:')
+    conn.execute('CREATE TABLE t (id INTEGER, name TEXT, value REAL, n INTEGER)')
+    conn.executemany('INSERT INTO t VALUES (?, ?, ?, ?)', ROWS)
+    yield lambda: conn.execute('SELECT * FROM t ORDER BY id')
+    conn.close()
+
+
+def expected_objects():
+    columns = ('id', 'name', 'value', 'n')
+    return [dict(zip(columns, row), value=row[2] if abs(row[2]) != float('inf') else None) for row in ROWS]
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 500])
+def test_objects_match_json_dumps(cursor, chunk_size):
+    body = ''.join(streaming.iter_json_array(cursor(), chunk_size=chunk_size))
+    assert json.loads(body) == expected_objects()
+
+
+def test_empty_result(cursor):
+    rows = cursor().execute('SELECT * FROM t WHERE id < 0')
+    assert ''.join(streaming.iter_json_array(rows)) == '[]'
+
+
+def test_converters_apply_to_non_null_values(cursor):
+    body = ''.join(streaming.iter_json_array(cursor(), {'n': lambda value: f'#{value}'}, chunk_size=2))
+    assert [row['n'] for row in json.loads(body)] == [None, '#3', f'#{2 ** 62}', '#0', '#-1']
+
+
+def test_streamed_response_closes_rows(cursor):
+    class Rows:
+        closed = False
+
+        def __init__(self, rows):
+            self.rows = rows
+            self.description = rows.description
+            self.fetchmany = rows.fetchmany
+
+        def close(self):
+            Rows.closed = True
+
+    app = Flask(__name__)
+    with app.test_request_context():
+        response = streaming.stream_rows(Rows(cursor()))
+        assert response.is_streamed and not Rows.closed
+        assert json.loads(response.get_data()) == expected_objects()
+        assert Rows.closed
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 500])
+def test_columnar_and_arrays_hold_the_same_rows(cursor, chunk_size):
+    objects = expected_objects()
+    columnar = json.loads(''.join(streaming.iter_json_columnar(cursor(), chunk_size=chunk_size)))
+    assert columnar['columns'] == ['id', 'name', 'value', 'n']
+    assert [dict(zip(columnar['columns'], row)) for row in columnar['data']] == objects
+    arrays = json.loads(''.join(streaming.iter_json_arrays(cursor(), chunk_size=chunk_size)))
+    assert arrays == {column: [row[column] for row in objects] for column in columnar['columns']}
+
+
+def test_select_columns():
+    allowed = ('id', 'timestamp', 'ph')
+    assert streaming.select_columns(None, allowed) == allowed
+    assert streaming.select_columns(' ph, id ,ph', allowed) == ('ph', 'id')
+    for fields in ('ph,nitrate', ',', 'id;DROP TABLE'):
+        with pytest.raises(ValueError):
+            streaming.select_columns(fields, allowed)
+
+
+def test_response_format():
+    assert streaming.response_format(None) == 'objects'
+    assert streaming.response_format('arrays') == 'arrays'
+    with pytest.raises(ValueError):
+        streaming.response_format('csv')
+
+
+def test_projection_through_the_api(on_both):
+    def flow(s):
+        s.post('/api/parameters', {'ph': 7.2, 'temperature': 25})
+        s.post('/api/fish', {'species': 'Guppy', 'quantity': 3})
+        assert s.get('/api/parameters?fields=ph,id') == [{'ph': 7.2, 'id': 1}]
+        assert s.get('/api/fish?format=arrays&fields=species,quantity') == {'species': ['Guppy'], 'quantity': [3]}
+        assert s.get('/api/parameters?format=columnar&fields=id')['data'] == [[1]]
+        assert s.call('GET', '/api/parameters?fields=secret')[0] == 400
+        assert s.call('GET', '/api/fish?format=xml')[0] == 400
+
+    on_both(flow)
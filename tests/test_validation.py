@@ -0,0 +1,113 @@
+"""
+Request bodies are checked and converted before any handler runs
+"""
+
+import pytest
+
+import clock
+import validation
+
+
+def test_form_strings_are_converted():
+    validate = validation.compile_schema({
+        'ph': {'type': 'number', 'min': 0, 'max': 14},
+        'quantity': {'type': 'integer', 'default': 1},
+        'completed': {'type': 'boolean', 'default': True},
+        'when': {'type': 'timestamp'},
+        'notes': {'type': 'text'},
+    })
+    body = validate({'ph': '7.2', 'quantity': '6.0', 'completed': 'off',
+                     'when': '2026-03-02T09:00:00Z', 'other': 'dropped'})
+    assert body == {'ph': 7.2, 'quantity': 6, 'completed': False,
+                    'when': clock.parse('2026-03-02T09:00:00Z'), 'notes': None}
+    assert validate({'quantity': '  ', 'completed': None}) == {
+        'ph': None, 'quantity': 1, 'completed': True, 'when': None, 'notes': None}
+
+
+@pytest.mark.parametrize('spec, value, message', [
+    ({'type': 'number'}, 'abc', 'must be a number'),
+    ({'type': 'number'}, 'nan', 'must be a number'),
+    ({'type': 'number'}, True, 'must be a number'),
+    ({'type': 'integer'}, '1.5', 'must be a whole number'),
+    ({'type': 'boolean'}, 'maybe', 'must be true or false'),
+    ({'type': 'timestamp'}, 'yesterday', 'must be an ISO 8601 timestamp'),
+    ({'type': 'text'}, 5, 'must be text'),
+    ({'type': 'number', 'min': 0}, -1, 'must be at least 0'),
+    ({'type': 'number', 'max': 14}, '15', 'must be at most 14'),
+    ({'type': 'text', 'max_length': 3}, 'abcd', 'must be at most 3 characters'),
+])
+def test_bad_values_are_named(spec, value, message):
+    with pytest.raises(validation.Invalid) as e:
+        validation.compile_schema({'field': spec})({'field': value})
+    assert e.value.errors == {'field': message}
+
+
+def test_every_error_is_reported_at_once():
+    validate = validation.compile_schema({
+        'kind': {'type': 'text', 'required': True},
+        'recurring': {'type': 'boolean', 'default': True},
+        'days': {'type': 'integer', 'required': lambda body: body['recurring']},
+        'date': {'type': 'timestamp', 'required': lambda body: body['recurring'] is False},
+    })
+    with pytest.raises(validation.Invalid) as e:
+        validate({'days': '1.5'})
+    assert e.value.errors == {'kind': 'is required', 'days': 'must be a whole number'}
+    assert str(e.value) == 'kind is required; days must be a whole number'
+
+    with pytest.raises(validation.Invalid) as e:
+        validate({'kind': 'once', 'recurring': 'false'})
+    assert e.value.errors == {'date': 'is required'}
+
+    with pytest.raises(validation.Invalid) as e:
+        validate(['not', 'an', 'object'])
+    assert e.value.errors == {'body': 'must be a JSON object'}
+
+
+def test_malformed_schema_fails_at_startup():
+    with pytest.raises(ValueError):
+        validation.compile_schema({'ph': {'type': 'float'}})
+    with pytest.raises(ValueError):
+        validation.compile_schema({'ph': {'type': 'number', 'minimum': 0}})
+
+
+def test_bad_bodies_are_rejected_before_writing(on_both):
+    def flow(s):
+        s.post('/api/parameters', {'ph': 15, 'temperature': 'warm'})
+        s.post('/api/fish', {'quantity': -1})
+        s.post('/api/scheduled', {'task_name': 'Once', 'is_recurring': False})
+        s.put('/api/scheduled', {'task_name': 'Filter'})
+        s.post('/api/fish', {'species': 'Tetra', 'quantity': '6'})
+        s.get('/api/parameters')
+        s.get('/api/fish')
+
+    s = on_both(flow)
+    statuses = [entry[2] for entry in s.log]
+    assert statuses == [400, 400, 400, 400, 200, 200, 200]
+    assert s.log[0][3]['errors'] == {'ph': 'must be at most 14', 'temperature': 'must be a number'}
+    assert s.log[1][3]['errors'] == {'species': 'is required', 'quantity': 'must be at least 0'}
+    assert s.log[2][3]['errors'] == {'specific_date': 'is required'}
+    assert s.log[3][3]['errors'] == {'id': 'is required'}
+    assert s.log[-2][3] == []
+    assert [(fish['species'], fish['quantity']) for fish in s.log[-1][3]] == [('Tetra', 6)]
+
+
+def test_sync_and_batch_validate_each_request(on_both):
+    def flow(s):
+        s.post('/api/sync', {'requests': [
+            {'key': 'a', 'method': 'POST', 'path': '/api/fish', 'body': {'quantity': 2}},
+            {'key': 'b', 'method': 'POST', 'path': '/api/fish', 'body': {'species': 'Molly'}},
+        ]})
+        s.post('/api/batch', {'atomic': True, 'requests': [
+            {'method': 'POST', 'path': '/api/fish', 'body': {'species': 'Guppy'}},
+            {'method': 'POST', 'path': '/api/parameters', 'body': {'ph': 'acid'}},
+        ]})
+        s.get('/api/fish')
+
+    s = on_both(flow)
+    results = s.log[0][3]['results']
+    assert [result['status'] for result in results] == [400, 200]
+    assert results[0]['body']['errors'] == {'species': 'is required'}
+    assert s.log[1][2] == 400
+    assert s.log[1][3]['failed']['index'] == 1
+    assert s.log[1][3]['failed']['body']['errors'] == {'ph': 'must be a number'}
+    assert [fish['species'] for fish in s.log[2][3]] == ['Molly']
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+Request Validation
+Each write endpoint declares the JSON body it accepts as a schema, a dict
+of field name -> spec:
+
+    {'ph': {'type': 'number', 'min': 0, 'max': 14},
+     'species': {'type': 'text', 'required': True},
+     'quantity': {'type': 'integer', 'min': 0, 'default': 1}}
+
+Schemas are compiled once, when the app starts, into functions that check
+and convert every field in one pass. Form posts send every value as a
+string, so numbers, booleans and timestamps are converted to the column's
+type here and never reach the database as text. Missing or blank fields
+get their default (None unless given); fields not in the schema are
+dropped. A bad body is answered with 400 before the handler runs:
+
+    {"success": false, "error": "ph must be at most 14; species is required",
+     "errors": {"ph": "must be at most 14", "species": "is required"}}
+
+Spec keys:
+    type        text, number, integer, boolean or timestamp (epoch ms
+                from ISO 8601)
+    required    True, or a function of the converted body for fields
+                that are only needed sometimes
+    default     value for a missing or blank field
+    min, max    bounds for numbers
+    max_length  for text
+"""
+
+import math
+
+from flask import current_app, g, jsonify, request
+
+import clock
+
+OPTIONS = {'type', 'required', 'default', 'min', 'max', 'max_length'}
+TRUE = {'true', '1', 'on', 'yes'}
+FALSE = {'false', '0', 'off', 'no'}
+
+
+class Invalid(ValueError):
+    """A request body that does not match its schema"""
+
+    def __init__(self, errors):
+        super().__init__('; '.join(f'{field} {message}' for field, message in errors.items()))
+        self.errors = errors
+
+    def response(self):
+        return jsonify({'success': False, 'error': str(self), 'errors': self.errors}), 400
+
+
+def _number(value):
+    if isinstance(value, bool):
+        raise ValueError('must be a number')
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise ValueError('must be a number') from None
+    if not math.isfinite(number):
+        raise ValueError('must be a number')
+    return number
+
+
+def _integer(value):
+    number = _number(value)
+    if not number.is_integer():
+        raise ValueError('must be a whole number')
+    return int(number)
+
+
+def _boolean(value):
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, (int, float)) and value in (0, 1):
+        return bool(value)
+    if isinstance(value, str) and value.strip().lower() in TRUE | FALSE:
+        return value.strip().lower() in TRUE
+    raise ValueError('must be true or false')
+
+
+def _timestamp(value):
+    try:
+        return clock.parse(value)
+    except (TypeError, ValueError):
+        raise ValueError('must be an ISO 8601 timestamp') from None
+
+
+def _text(value):
+    if not isinstance(value, str):
+        raise ValueError('must be text')
+    return value
+
+
+TYPES = {
+    'text': _text,
+    'number': _number,
+    'integer': _integer,
+    'boolean': _boolean,
+    'timestamp': _timestamp,
+}
+
+
+def _converter(name, spec):
+    """value -> converted value for one field spec, with its bounds applied"""
+    unknown = set(spec) - OPTIONS
+    if unknown or spec.get('type') not in TYPES:
+        raise ValueError(f'Invalid schema for {name}: {spec!r}')
+    convert = TYPES[spec['type']]
+    low, high, max_length = spec.get('min'), spec.get('max'), spec.get('max_length')
+    if low is None and high is None and max_length is None:
+        return convert
+
+    def checked(value):
+        value = convert(value)
+        if low is not None and value < low:
+            raise ValueError(f'must be at least {low}')
+        if high is not None and value > high:
+            raise ValueError(f'must be at most {high}')
+        if max_length is not None and len(value) > max_length:
+            raise ValueError(f'must be at most {max_length} characters')
+        return value
+    return checked
+
+
+def compile_schema(fields):
+    """Validator for a {field: spec} schema
+
+    validator(data) returns the converted body, or raises Invalid naming
+    every bad field. Raises ValueError for a malformed schema.
+    """
+    steps = tuple((name, _converter(name, spec), spec.get('default'), spec.get('required', False))
+                  for name, spec in fields.items())
+    conditional = tuple((name, required) for name, _, _, required in steps if callable(required))
+
+    def validate(data):
+        if not isinstance(data, dict):
+            raise Invalid({'body': 'must be a JSON object'})
+        body, errors = {}, {}
+        for name, convert, default, required in steps:
+            value = data.get(name)
+            if value is None or (isinstance(value, str) and not value.strip()):
+                if required is True:
+                    errors[name] = 'is required'
+                body[name] = default
+                continue
+            try:
+                body[name] = convert(value)
+            except ValueError as e:
+                errors[name] = str(e)
+                body[name] = None
+        for name, required in conditional:
+            if body[name] is None and name not in errors and required(body):
+                errors[name] = 'is required'
+        if errors:
+            raise Invalid(errors)
+        return body
+    return validate
+
+
+def check():
+    """Validate the current request's body if its endpoint has a schema
+
+    Returns the 400 response for an invalid body, or None. Runs before
+    every request; /api/sync and /api/batch call it for each queued or
+    sub-request, which do not go through the before_request hooks.
+    """
+    validate = current_app.extensions['validation'].get((request.endpoint, request.method))
+    if validate is None:
+        return None
+    try:
+        g._body = validate(request.get_json(silent=True))
+    except Invalid as e:
+        return e.response()
+    return None
+
+
+def body():
+    """The current request's validated and converted body"""
+    return g._body
+
+
+def init_app(app, schemas):
+    """Validate request bodies before their handlers run
+
+    schemas maps (endpoint, method) to a {field: spec} schema. Register
+    before anything that touches the database, so bad input never does.
+    """
+    app.extensions['validation'] = {key: compile_schema(fields) for key, fields in schemas.items()}
+    app.before_request(check)